@@ -35,7 +35,7 @@ function App() {
   const messagesEndRef = useRef(null);
   const [showPendingInvites, setShowPendingInvites] = useState(false);
 
-  const { messages, setMessages } = useMessages(user, chatWith, chatGroup, refreshKey);
+  const { messages, setMessages, loadOlder, hasOlder, loadingOlder } = useMessages(user, chatWith, chatGroup, refreshKey);
   const { users, setUsers, contacts, setContacts, unreadCounts, setUnreadCounts, pendingInvites, setPendingInvites } = useUsers(user, refreshKey);
   const { groups, setGroups } = useGroups(user, refreshKey);
 
@@ -305,6 +305,9 @@ function App() {
           messagesEndRef={messagesEndRef}
           setMessages={setMessages}
           setReplyTarget={setReplyTarget}
+          loadOlder={loadOlder}
+          hasOlder={hasOlder}
+          loadingOlder={loadingOlder}
         />
       </Box>
 
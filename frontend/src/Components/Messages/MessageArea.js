@@ -1,16 +1,42 @@
-import React, { useLayoutEffect, useState, useEffect } from "react";
-import { Box, Typography, Paper, IconButton, Menu, MenuItem } from "@mui/material";
+import React, { useLayoutEffect, useRef, useState, useEffect } from "react";
+import { Box, Typography, Paper, IconButton, Menu, MenuItem, Button, CircularProgress } from "@mui/material";
 import MoreVertIcon from "@mui/icons-material/MoreVert";
 
-const MessageArea = ({ messages, user, messagesEndRef, setMessages, setReplyTarget }) => {
+// distância ao topo (px) a partir da qual se pede a página anterior
+const LOAD_OLDER_THRESHOLD = 80;
+
+const MessageArea = ({ messages, user, messagesEndRef, setMessages, setReplyTarget, loadOlder, hasOlder, loadingOlder }) => {
   const [menuAnchor, setMenuAnchor] = useState(null);
   const [menuMsgId, setMenuMsgId] = useState(null);
+  const scrollRef = useRef(null);
+  // altura/posição antes de pedir mensagens antigas, para não saltar quando entram no topo
+  const anchorRef = useRef(null);
 
   useLayoutEffect(() => {
+    const el = scrollRef.current;
+    if (anchorRef.current && el) {
+      if (loadingOlder) return;
+      // página antiga juntada no início → mantém a mesma mensagem à vista
+      const { scrollHeight, scrollTop } = anchorRef.current;
+      el.scrollTop = el.scrollHeight - scrollHeight + scrollTop;
+      anchorRef.current = null;
+      return;
+    }
     if (messagesEndRef.current) {
       messagesEndRef.current.scrollIntoView({ behavior: "auto" });
     }
-  }, [messages, messagesEndRef]);
+  }, [messages, messagesEndRef, loadingOlder]);
+
+  const requestOlder = () => {
+    const el = scrollRef.current;
+    if (!loadOlder || !hasOlder || loadingOlder || !el) return;
+    anchorRef.current = { scrollHeight: el.scrollHeight, scrollTop: el.scrollTop };
+    loadOlder();
+  };
+
+  const handleScroll = (e) => {
+    if (e.currentTarget.scrollTop <= LOAD_OLDER_THRESHOLD) requestOlder();
+  };
 
   const handleOpenMenu = (e, msgId) => {
     setMenuAnchor(e.currentTarget);
@@ -43,7 +69,14 @@ const MessageArea = ({ messages, user, messagesEndRef, setMessages, setReplyTarg
   */
 
   return (
-    <Paper sx={{py: 2, height: "70vh", overflowY: "auto", mb: 1, backgroundColor: "#0b1220" }}>
+    <Paper ref={scrollRef} onScroll={handleScroll} sx={{py: 2, height: "70vh", overflowY: "auto", mb: 1, backgroundColor: "#0b1220" }}>
+      {hasOlder && (
+        <Box sx={{ display: "flex", justifyContent: "center", mb: 1 }}>
+          {loadingOlder
+            ? <CircularProgress size={20} />
+            : <Button size="small" onClick={requestOlder}>Load older messages</Button>}
+        </Box>
+      )}
       {messages.map((msg, i) => {
         const isFirst = i === 0;
 
@@ -102,7 +135,7 @@ const MessageArea = ({ messages, user, messagesEndRef, setMessages, setReplyTarg
                   {msg.image_url && (
                     <Box
                       component="img"
-                      src={msg.image_url}
+                      src={msg.image_variants?.medium?.url || msg.image_url}
                       alt="sent image"
                       sx={{
                         maxWidth: "100%",
@@ -195,7 +228,7 @@ const MessageArea = ({ messages, user, messagesEndRef, setMessages, setReplyTarg
                   {msg.image_url && (
                     <Box
                       component="img"
-                      src={msg.image_url}
+                      src={msg.image_variants?.medium?.url || msg.image_url}
                       alt="sent image"
                       sx={{
                         maxWidth: "100%",
@@ -1,38 +1,68 @@
 // src/hooks/useMessages.js
-import { useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
+
+// URL do histórico da conversa aberta (1-to-1 ou grupo)
+const historyUrl = (user, chatWith, chatGroup) => {
+    if (!user) return null;
+    if (chatWith) return `/api/message/messages/${user.id}/${chatWith.id}`;
+    if (chatGroup) return `/api/message/group_messages/${chatGroup.id}`;
+    return null;
+};
 
 const useMessages = (user, chatWith, chatGroup, refreshKey) => {
     const [messages, setMessages] = useState([]);
+    // cursor da página anterior (mais antiga); null → não há mais histórico
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingOlder, setLoadingOlder] = useState(false);
+
+    const url = historyUrl(user, chatWith, chatGroup);
+    // conversa atual, para ignorar respostas que chegam depois de mudar de chat
+    const currentUrl = useRef(url);
+    currentUrl.current = url;
 
     useEffect(() => {
-        if (!user) return;
+        if (!url) return;
 
-        if (chatWith) {
-        // Conversa 1-to-1
-        fetch(`/api/message/messages/${user.id}/${chatWith.id}`, {
+        setNextCursor(null);
+        fetch(url, {
             headers: {
             "Authorization": `Bearer ${user.token}`
             }
         })
             .then((res) => res.json())
-            .then((data) => Array.isArray(data) ? setMessages(data) : setMessages([]))
+            .then((data) => {
+                if (currentUrl.current !== url) return;
+                setMessages(Array.isArray(data?.messages) ? data.messages : []);
+                setNextCursor(data?.next_cursor || null);
+            })
             .catch((err) => console.error("Erro a buscar histórico:", err));
-        }
+    }, [url, user, refreshKey]);
+
+    // Página seguinte (mais antiga), com ?before=next_cursor, juntada no início
+    const loadOlder = useCallback(() => {
+        if (!url || !nextCursor || loadingOlder) return;
 
-        if (chatGroup) {
-        // Conversa em grupo
-        fetch(`/api/message/group_messages/${chatGroup.id}`, {
+        setLoadingOlder(true);
+        fetch(`${url}?before=${encodeURIComponent(nextCursor)}`, {
             headers: {
             "Authorization": `Bearer ${user.token}`
             }
         })
             .then((res) => res.json())
-            .then((data) => Array.isArray(data) ? setMessages(data) : setMessages([]))
-            .catch((err) => console.error("Erro a buscar histórico de grupo:", err));
-        }
-    }, [user, chatWith, chatGroup, refreshKey]);
+            .then((data) => {
+                if (currentUrl.current !== url) return;
+                const older = Array.isArray(data?.messages) ? data.messages : [];
+                setMessages((prev) => {
+                    const seen = new Set(prev.map((m) => m.id));
+                    return [...older.filter((m) => !seen.has(m.id)), ...prev];
+                });
+                setNextCursor(data?.next_cursor || null);
+            })
+            .catch((err) => console.error("Erro a buscar histórico antigo:", err))
+            .finally(() => setLoadingOlder(false));
+    }, [url, user, nextCursor, loadingOlder]);
 
-    return { messages, setMessages };
+    return { messages, setMessages, loadOlder, hasOlder: Boolean(nextCursor), loadingOlder };
 };
 
 export default useMessages;
@@ -0,0 +1,157 @@
+import asyncio
+import os
+from fastapi import WebSocket
+from prometheus_client import Counter, Gauge
+
+# mensagens pendentes por sessão antes de a considerarmos um consumidor lento
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# código de fecho enviado a quem é expulso (1013 = "try again later")
+WS_EVICT_CLOSE_CODE = 1013
+
+WS_SESSIONS = Gauge("ws_sessions", "Active WebSocket sessions")
+WS_QUEUE_DEPTH = Gauge("ws_send_queue_depth", "Messages queued for WebSocket delivery (all sessions)")
+WS_SESSIONS_DROPPED = Counter(
+    "ws_sessions_dropped_total", "WebSocket sessions dropped by the server",
+    ["reason"]
+)
+WS_MESSAGES_DROPPED = Counter("ws_messages_dropped_total", "Queued WebSocket messages discarded on drop")
+
+
+class Session:
+    """
+    Uma ligação WebSocket de um user (um separador / dispositivo).
+
+    Os envios vão para uma fila limitada que uma tarefa própria escreve no
+    socket, por isso o fan-out nunca espera pela rede de ninguém.
+    """
+
+    __slots__ = ("websocket", "user_id", "queue", "writer")
+
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.writer = None
+
+    def enqueue(self, message: str) -> bool:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        WS_QUEUE_DEPTH.inc()
+        return True
+
+    async def write_loop(self, on_dead):
+        try:
+            while True:
+                message = await self.queue.get()
+                WS_QUEUE_DEPTH.dec()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # socket fechado / erro de rede
+            WS_SESSIONS_DROPPED.labels("send_error").inc()
+            on_dead(self.websocket)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.cancel()
+        pending = self.queue.qsize()
+        if pending:
+            WS_QUEUE_DEPTH.dec(pending)
+            WS_MESSAGES_DROPPED.inc(pending)
+
+
+class ConnectionRegistry:
+    """
+    Registo das ligações ativas: user → {sessões} e websocket → sessão.
+
+    Um user pode ter várias sessões em simultâneo. Ligar, desligar e procurar
+    são O(1) — nunca há varrimentos de todas as ligações.
+
+    send() só enfileira. Política para consumidores lentos: se a fila de uma
+    sessão encher, a sessão é removida (on_dead), as mensagens pendentes são
+    descartadas e o socket é fechado com 1013 — o cliente volta a ligar e
+    recupera o histórico pela API.
+    """
+
+    def __init__(self, on_dead=None):
+        self.by_user: dict[int, set[Session]] = {}
+        self.by_socket: dict[WebSocket, Session] = {}
+        # chamado quando uma sessão morre ou é expulsa (normalmente manager.disconnect)
+        self.on_dead = on_dead or self.remove
+
+    def add(self, websocket: WebSocket, user_id: int):
+        """Regista a ligação. Devolve (sessão, é_a_primeira_sessão_do_user)."""
+        session = Session(websocket, user_id)
+        self.by_socket[websocket] = session
+        sessions = self.by_user.get(user_id)
+        first = sessions is None
+        if first:
+            sessions = self.by_user[user_id] = set()
+        sessions.add(session)
+        session.writer = asyncio.create_task(session.write_loop(self.on_dead))
+        WS_SESSIONS.inc()
+        return session, first
+
+    def remove(self, websocket: WebSocket):
+        """Remove a ligação. Devolve (sessão ou None, era_a_última_sessão_do_user)."""
+        session = self.by_socket.pop(websocket, None)
+        if session is None:
+            return None, False
+        session.close()
+        WS_SESSIONS.dec()
+        sessions = self.by_user.get(session.user_id)
+        if sessions is None:
+            return session, False
+        sessions.discard(session)
+        if sessions:
+            return session, False
+        del self.by_user[session.user_id]
+        return session, True
+
+    def send(self, sessions, message: str):
+        """Enfileira a mensagem em cada sessão, sem esperar por escritas de rede."""
+        for session in tuple(sessions):
+            if not session.enqueue(message):
+                self.evict(session)
+
+    def send_to_user(self, user_id: int, message: str):
+        self.send(self.by_user.get(user_id, ()), message)
+
+    def send_to_users(self, user_ids, message: str):
+        for user_id in user_ids:
+            sessions = self.by_user.get(user_id)
+            if sessions:
+                self.send(sessions, message)
+
+    def broadcast(self, message: str):
+        self.send(self.by_socket.values(), message)
+
+    def evict(self, session: Session):
+        print(f"🐢 Sessão do user {session.user_id} expulsa: fila de envio cheia")
+        WS_SESSIONS_DROPPED.labels("slow_consumer").inc()
+        self.on_dead(session.websocket)
+        asyncio.create_task(self._close_socket(session.websocket))
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=WS_EVICT_CLOSE_CODE)
+        except Exception:
+            pass
+
+    def sessions_for(self, user_id: int):
+        return self.by_user.get(user_id, ())
+
+    def all_sessions(self):
+        return self.by_socket.values()
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.by_user
+
+    def online_users(self) -> list[int]:
+        return list(self.by_user)
+
+    def __len__(self):
+        return len(self.by_socket)
@@ -1,13 +1,18 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update, select
 from . import models, schemas
+from .http_client import get_client
 import os
-import requests
 
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
+MESSAGE_SERVICE_URL = os.getenv("MESSAGE_SERVICE_URL")
+# máximo de ids por GET /users?ids= (mesmo setting que o user-service)
+MAX_BULK_IDS = int(os.getenv("MAX_BULK_IDS", "1000"))
 
 def create_group(db: Session, name: str, member_ids: list[int], owner_id: int):
-    group = models.Group(name=name, owner_id=owner_id)
+    group = models.Group(name=name, owner_id=owner_id, membership_version=1)
     db.add(group)
     db.commit()
     db.refresh(group)
@@ -19,13 +24,13 @@ def create_group(db: Session, name: str, member_ids: list[int], owner_id: int):
 
     return group
 
-def get_user_groups(db: Session, user_id: int):
-    return (
-        db.query(models.Group)
+async def get_user_groups(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.Group.id, models.Group.name)
         .join(models.GroupMember)
-        .filter(models.GroupMember.user_id == user_id)
-        .all()
+        .where(models.GroupMember.user_id == user_id)
     )
+    return result.all()
 
 def leave_group(db: Session, group_id: int, user_id: int):
     member = db.query(models.GroupMember).filter_by(group_id=group_id, user_id=user_id).first()
@@ -51,18 +56,56 @@ def assert_owner(db: Session, group_id: int, token_data: dict):
 
     return group
 
-def get_usernames_from_ids(user_ids, token_data):
-    headers = {"Authorization": f"Bearer {token_data.get('token')}"}
-    usernames = []
-    for uid in user_ids:
+async def get_user(user_id: int, token: str):
+    """Busca um user ao user-service (None se não existir / falhar)"""
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        r = await get_client().get(f"{USER_SERVICE_URL}/users/{user_id}", headers=headers)
+        if r.status_code == 200:
+            return r.json()
+    except Exception as e:
+        print("Error fetching user:", e)
+    return None
+
+async def get_user_by_username(username: str, token: str):
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        r = await get_client().get(f"{USER_SERVICE_URL}/users/by-username/{username}", headers=headers)
+        if r.status_code == 200:
+            return r.json()
+    except Exception as e:
+        print("Error fetching user:", e)
+    return None
+
+async def get_users(user_ids, token: str):
+    """Lookup em bulk (GET /users?ids=..., lotes de MAX_BULK_IDS) → {id: {"id", "username"}}"""
+    ids = sorted(set(user_ids))
+    users = {}
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(0, len(ids), MAX_BULK_IDS):
+        batch = ids[i:i + MAX_BULK_IDS]
         try:
-            # ✅ URL absoluta para user-service
-            r = requests.get(f"{USER_SERVICE_URL}/users/{uid}", headers=headers)
+            r = await get_client().get(
+                f"{USER_SERVICE_URL}/users",
+                params={"ids": ",".join(str(uid) for uid in batch)},
+                headers=headers,
+            )
             if r.status_code == 200:
-                usernames.append(r.json()["username"])
+                users.update({u["id"]: u for u in r.json()})
         except Exception as e:
-            print("Error fetching username:", e)
-    return usernames
+            print("Error fetching users:", e)
+    return users
+
+async def get_usernames_from_ids(user_ids, token_data):
+    users = await get_users(user_ids, token_data.get("token"))
+    return [users[uid]["username"] for uid in user_ids if uid in users]
+
+async def get_member_ids(db: AsyncSession, group_id: int):
+    result = await db.execute(
+        select(models.GroupMember.user_id).where(models.GroupMember.group_id == group_id)
+    )
+    return list(result.scalars().all())
+
 
 def get_group_members_ids(db: Session, group_id: int, token: str):
     """✅ Obtém member IDs diretamente da BD - SEM loop"""
@@ -71,4 +114,39 @@ def get_group_members_ids(db: Session, group_id: int, token: str):
         return [m.user_id for m in members]
     except Exception as e:
         print(f"❌ Erro ao obter membros da BD: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+# --- Membership events (réplica de membros no message-service) ---
+
+def bump_membership_version(db: Session, group_id: int) -> int:
+    """Incrementa a versão dos membros do grupo (na transação atual)"""
+    return db.execute(
+        update(models.Group)
+        .where(models.Group.id == group_id)
+        .values(membership_version=models.Group.membership_version + 1)
+        .returning(models.Group.membership_version)
+    ).scalar_one()
+
+async def get_membership_snapshot(db: AsyncSession, group_id: int | None = None):
+    """[{group_id, version, member_ids}] de um grupo ou de todos"""
+    stmt = select(models.Group.id, models.Group.membership_version, models.GroupMember.user_id).outerjoin(models.GroupMember)
+    if group_id is not None:
+        stmt = stmt.where(models.Group.id == group_id)
+
+    snapshots = {}
+    for gid, version, user_id in await db.execute(stmt):
+        snap = snapshots.setdefault(gid, {"group_id": gid, "version": version, "member_ids": []})
+        if user_id is not None:
+            snap["member_ids"].append(user_id)
+    return list(snapshots.values())
+
+async def publish_membership_event(event: dict):
+    """Envia o evento ao message-service (uma réplica recebe-o e o broker leva-o a todas); se falhar, resincronizam pela versão"""
+    try:
+        headers = {"Authorization": "Bearer INTERNAL"}
+        r = await get_client().post(f"{MESSAGE_SERVICE_URL}/internal/group_events", json=event, headers=headers)
+        if r.status_code != 200:
+            print(f"⚠️ message-service rejeitou evento {event['type']}: {r.status_code}")
+    except Exception as e:
+        print(f"⚠️ Falha a publicar evento {event['type']}: {e}")
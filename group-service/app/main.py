@@ -1,13 +1,16 @@
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy.orm import Session
-from . import models, schemas, crud
-from .db import engine, SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, crud, migrations
+from .db import engine, async_engine, SessionLocal, AsyncSessionLocal
 from .websocket import manager
 from fastapi.middleware.cors import CORSMiddleware
 import json
 from .auth import verify_token
 from jose import jwt, JWTError
-import requests
+from .http_client import close_client
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 import os
 
 
@@ -21,7 +24,14 @@ USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_client()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # --- Define Prometheus metrics ---
@@ -60,6 +70,7 @@ async def prometheus_middleware(request, call_next):
 
 # Create tables
 models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
 
 
 
@@ -74,6 +85,12 @@ def get_db():
     finally:
         db.close()
 
+
+# Sessão async (asyncpg) para as rotas mais usadas
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 @app.websocket("/ws/groups/{user_id}")
 async def websocket_groups(websocket: WebSocket, user_id: int):
     token = websocket.query_params.get("token")
@@ -109,6 +126,13 @@ async def create_group(payload: schemas.GroupCreate, db: Session = Depends(get_d
     group.owner_id = owner_id
     db.commit(); db.refresh(group)
 
+    await crud.publish_membership_event({
+        "type": "group_created",
+        "group_id": group.id,
+        "member_ids": payload.member_ids,
+        "version": group.membership_version,
+    })
+
     await manager.send_to_group(db, group.id, json.dumps({
         "type": "group_created",
         "id": group.id,
@@ -116,7 +140,7 @@ async def create_group(payload: schemas.GroupCreate, db: Session = Depends(get_d
         "owner_id": owner_id
     }), token_data.get("token"))
 
-    for username in crud.get_usernames_from_ids(payload.member_ids, token_data):  # helper below
+    for username in await crud.get_usernames_from_ids(payload.member_ids, token_data):  # helper below
         await manager.broadcast(json.dumps({
             "type": "group_joined",
             "group_id": group.id,
@@ -127,33 +151,19 @@ async def create_group(payload: schemas.GroupCreate, db: Session = Depends(get_d
 
 
 @app.get("/groups/{user_id}")
-def list_user_groups(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    groups = crud.get_user_groups(db, user_id)
+async def list_user_groups(user_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    groups = await crud.get_user_groups(db, user_id)
     return [{"id": g.id, "name": g.name} for g in groups]
 
 @app.get("/groups/{group_id}/members")
-def get_group_members(group_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    members = db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).all()
-    if not members:
+async def get_group_members(group_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    member_ids = await crud.get_member_ids(db, group_id)
+    if not member_ids:
         raise HTTPException(status_code=404, detail="No members found for this group")
 
-    result = []
-    for m in members:
-        try:
-            token = token_data.get("token")
-            headers = {"Authorization": f"Bearer {token}"}
-            res = requests.get(f"{USER_SERVICE_URL}/users/{m.user_id}", headers=headers)
-            if res.status_code == 200:
-                user_data = res.json()
-            else:
-                user_data = {"id": m.user_id, "username": "Unknown"}
-        except Exception as e:
-            print(f"Erro ao contactar user-service: {e}")
-            user_data = {"id": m.user_id, "username": "Unknown"}
-
-        result.append(user_data)
-
-    return result
+    # Um único pedido ao user-service para todos os membros
+    users = await crud.get_users(member_ids, token_data.get("token"))
+    return [users.get(uid, {"id": uid, "username": "Unknown"}) for uid in member_ids]
 
 @app.delete("/groups/{group_id}/delete/{user_id}")
 async def delete_group(group_id: int, user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
@@ -172,6 +182,8 @@ async def delete_group(group_id: int, user_id: int, db: Session = Depends(get_db
     db.delete(group)  # graças ao cascade, apaga membros também
     db.commit()
 
+    await crud.publish_membership_event({"type": "group_deleted", "group_id": group_id})
+
     # Broadcast para todos os clientes → remover grupo em tempo real
     await manager.send_to_group(db, group_id, json.dumps({
         "type": "group_deleted",
@@ -197,6 +209,7 @@ async def leave_group(
 
     # 🧠 Remove the member
     db.delete(member)
+    version = crud.bump_membership_version(db, group_id)
     db.commit()
 
     # Get remaining members
@@ -208,12 +221,21 @@ async def leave_group(
         db.delete(group)
         db.commit()
 
+        await crud.publish_membership_event({"type": "group_deleted", "group_id": group_id})
+
         await manager.broadcast(json.dumps({
             "type": "group_deleted",
             "id": group_id
         }))
         return {"status": "deleted_empty"}
 
+    await crud.publish_membership_event({
+        "type": "group_left",
+        "group_id": group_id,
+        "user_id": user_id,
+        "version": version,
+    })
+
     # 🧩 CASE 2: user who left was the owner -> transfer ownership
     if user_id == group.owner_id:
         new_owner_id = remaining_ids[0]  # pick first member
@@ -221,13 +243,8 @@ async def leave_group(
         db.commit()
 
         # fetch username for broadcast
-        USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
-        headers = {"Authorization": f"Bearer {token_data.get('token')}"}
-        res = requests.get(f"{USER_SERVICE_URL}/users/{new_owner_id}", headers=headers)
-        if res.status_code == 200:
-            new_owner_username = res.json().get("username")
-        else:
-            new_owner_username = str(new_owner_id)
+        new_owner = await crud.get_user(new_owner_id, token_data.get('token'))
+        new_owner_username = new_owner.get("username") if new_owner else str(new_owner_id)
 
         await manager.send_to_group(db, group_id, json.dumps({
             "type": "owner_transferred",
@@ -258,13 +275,10 @@ async def add_member(group_id: int, username: str = Query(...), db: Session = De
         raise HTTPException(status_code=404, detail="Group not found")
 
     # Buscar o utilizador no user-service pelo username
-    USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
-    headers = {"Authorization": f"Bearer {token_data.get('token')}"}
-    res = requests.get(f"{USER_SERVICE_URL}/users/by-username/{username}", headers=headers)
-    if res.status_code != 200:
+    user_data = await crud.get_user_by_username(username, token_data.get('token'))
+    if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_data = res.json()
     user_id = user_data["id"]
 
     # Verificar se já é membro
@@ -275,11 +289,20 @@ async def add_member(group_id: int, username: str = Query(...), db: Session = De
     # Adicionar membro
     new_member = models.GroupMember(user_id=user_id, group_id=group_id)
     db.add(new_member)
+    version = crud.bump_membership_version(db, group_id)
     db.commit()
 
+    await crud.publish_membership_event({
+        "type": "member_added",
+        "group_id": group_id,
+        "user_id": user_id,
+        "version": version,
+    })
+
     await manager.send_to_group(db, group_id, json.dumps({
         "type": "member_added",
         "group_id": group_id,
+        "user_id": user_id,
         "username": username
     }), token_data.get('token'))
 
@@ -300,13 +323,10 @@ async def remove_member(group_id: int, username: str, db: Session = Depends(get_
 
     group = crud.assert_owner(db, group_id, token_data)
 
-    USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
-    headers = {"Authorization": f"Bearer {token_data.get('token')}"}
-    res = requests.get(f"{USER_SERVICE_URL}/users/by-username/{username}", headers=headers)
-    if res.status_code != 200:
+    user_data = await crud.get_user_by_username(username, token_data.get('token'))
+    if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_data = res.json()
     user_id = user_data["id"]
 
     member = db.query(models.GroupMember).filter_by(group_id=group_id, user_id=user_id).first()
@@ -314,8 +334,16 @@ async def remove_member(group_id: int, username: str, db: Session = Depends(get_
         raise HTTPException(status_code=404, detail="User not in group")
 
     db.delete(member)
+    version = crud.bump_membership_version(db, group_id)
     db.commit()
 
+    await crud.publish_membership_event({
+        "type": "member_removed",
+        "group_id": group_id,
+        "user_id": user_id,
+        "version": version,
+    })
+
     await manager.send_to_group(db, group_id, json.dumps({
         "type": "member_removed",
         "group_id": group_id,
@@ -338,13 +366,10 @@ async def remove_member(group_id: int, username: str, db: Session = Depends(get_
 async def transfer_owner(group_id: int, new_owner_username: str = Query(...), db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
     group = crud.assert_owner(db, group_id, token_data)  # only current owner can transfer
    
-    USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
-    headers = {"Authorization": f"Bearer {token_data.get('token')}"}
-    res = requests.get(f"{USER_SERVICE_URL}/users/by-username/{new_owner_username}", headers=headers)
-    if res.status_code != 200:
+    user_data = await crud.get_user_by_username(new_owner_username, token_data.get('token'))
+    if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_data = res.json()
     new_owner_id = user_data["id"]
     
     group.owner_id = new_owner_id
@@ -355,15 +380,13 @@ async def transfer_owner(group_id: int, new_owner_username: str = Query(...), db
     return {"status":"owner_transferred"}
 
 @app.get("/groups/{group_id}/info", response_model=schemas.GroupInfoOut)
-def group_info(group_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+async def group_info(group_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+    group = await run_in_threadpool(lambda: db.query(models.Group).filter(models.Group.id == group_id).first())
     if not group: raise HTTPException(404, "Group not found")
 
     # fetch owner username via user-service
-    token = token_data.get("token")
-    headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(f"{USER_SERVICE_URL}/users/{group.owner_id}", headers=headers)
-    owner_username = r.json().get("username","unknown") if r.status_code==200 else "unknown"
+    owner = await crud.get_user(group.owner_id, token_data.get("token"))
+    owner_username = owner.get("username", "unknown") if owner else "unknown"
 
     return {"id": group.id, "name": group.name, "owner_username": owner_username}
 
@@ -371,11 +394,11 @@ def group_info(group_id: int, db: Session = Depends(get_db), token_data: dict =
 
 
 
-import httpx
 import os
 import json
 from fastapi import Depends
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import models, crud
 
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
@@ -387,25 +410,19 @@ async def remove_user_from_all_groups(user_id: int, db: Session = Depends(get_db
     transferred = 0
 
     # 1️⃣ Buscar info do user (para saber username)
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.get(f"{USER_SERVICE_URL}/users/{user_id}", headers={"Authorization": "Bearer INTERNAL"})
-            if res.status_code == 200:
-                user_info = res.json()
-                username = user_info.get("username", f"user_{user_id}")
-            else:
-                username = f"user_{user_id}"
-        except Exception as e:
-            print(f"⚠️ Falha a obter info do user {user_id}: {e}")
-            username = f"user_{user_id}"
+    user_info = await crud.get_user(user_id, "INTERNAL")
+    username = user_info.get("username", f"user_{user_id}") if user_info else f"user_{user_id}"
 
     # 2️⃣ Buscar grupos onde é membro
     memberships = db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).all()
+    events = []
     for member in memberships:
         group = db.query(models.Group).filter(models.Group.id == member.group_id).first()
         if not group:
             continue
 
+        group_deleted = False
+
         # 3️⃣ Se é o owner → transferir
         if group.owner_id == user_id:
             members = (
@@ -417,6 +434,8 @@ async def remove_user_from_all_groups(user_id: int, db: Session = Depends(get_db
             if not members:
                 # Sem mais ninguém → apagar o grupo
                 db.delete(group)
+                group_deleted = True
+                events.append({"type": "group_deleted", "group_id": group.id})
                 print(f"🗑️ Grupo {group.name} removido (sem membros restantes)")
             else:
                 # Transfere ownership
@@ -427,10 +446,20 @@ async def remove_user_from_all_groups(user_id: int, db: Session = Depends(get_db
 
         # 4️⃣ Remover user do grupo
         db.delete(member)
+        if not group_deleted:
+            events.append({
+                "type": "member_removed",
+                "group_id": group.id,
+                "user_id": user_id,
+                "version": crud.bump_membership_version(db, group.id),
+            })
         removed_from += 1
         print(f"🚪 User {user_id} removido do grupo {group.name}")
 
     db.commit()
+
+    for event in events:
+        await crud.publish_membership_event(event)
     print(f"✅ Cleanup completo: {removed_from} grupos limpos, {transferred} transferências")
 
     return {"removed_from": removed_from, "transferred": transferred}
@@ -440,6 +469,19 @@ async def remove_user_from_all_groups(user_id: int, db: Session = Depends(get_db
 
 
 
+@app.get("/memberships")
+async def list_memberships(db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    """Snapshot de todos os grupos → réplica de membros do message-service"""
+    return await crud.get_membership_snapshot(db)
+
+@app.get("/groups/{group_id}/membership")
+async def group_membership(group_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    snapshots = await crud.get_membership_snapshot(db, group_id)
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return snapshots[0]
+
+
 @app.get("/metrics")
 def metrics():
     """Expose Prometheus metrics endpoint"""
@@ -0,0 +1,22 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from .db import Base
+
+
+def add_missing_columns(conn):
+    """create_all não altera tabelas existentes → adicionar colunas novas dos models"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {ddl}"))
+                print(f"🛠️ Coluna {table.name}.{column.name} adicionada")
+
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        add_missing_columns(conn)
@@ -8,6 +8,8 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     owner_id = Column(Integer, nullable=False)
+    # incrementa a cada alteração de membros (réplicas noutros serviços detetam eventos perdidos)
+    membership_version = Column(Integer, nullable=False, default=0, server_default="0")
     members = relationship("GroupMember", back_populates="group", cascade="all, delete-orphan")
 
 
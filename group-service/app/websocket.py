@@ -1,46 +1,30 @@
-from typing import List
 from fastapi import WebSocket
 from . import crud
+from .connections import ConnectionRegistry
 from sqlalchemy.orm import Session
 
 class ConnectionManager:
     def __init__(self):
-        self.user_map: dict[int, WebSocket] = {}
+        # user → {sessões}; um user pode ter vários separadores/dispositivos
+        # cada sessão tem fila de envio própria; lentos são expulsos (ver connections.py)
+        self.registry = ConnectionRegistry(on_dead=self.disconnect)
 
     async def connect(self, websocket: WebSocket, user_id: int):
         await websocket.accept()
-        self.user_map[user_id] = websocket
+        self.registry.add(websocket, user_id)
 
     def disconnect(self, websocket: WebSocket):
-        for uid, ws in list(self.user_map.items()):
-            if ws == websocket:
-                del self.user_map[uid]
-                break
+        self.registry.remove(websocket)
 
     async def send_to_user(self, user_id: int, message: str):
-        ws = self.user_map.get(user_id)
-        if ws:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                self.disconnect(ws)
+        self.registry.send_to_user(user_id, message)
 
     async def broadcast(self, message: str):
-        for ws in list(self.user_map.values()):
-            try:
-                await ws.send_text(message)
-            except Exception:
-                self.disconnect(ws)
+        self.registry.broadcast(message)
 
     async def send_to_group(self, db: Session, group_id: int, message: str, token: str):
-        from app.crud import get_group_members_ids
         member_ids = crud.get_group_members_ids(db, group_id, token)
-        for uid in member_ids:
-            if uid in self.user_map:
-                try:
-                    await self.user_map[uid].send_text(message)
-                except Exception:
-                    self.disconnect(self.user_map[uid])
+        self.registry.send_to_users(member_ids, message)
 
 
 # Singleton
@@ -0,0 +1,220 @@
+import asyncio
+import os
+
+# vazio → entrega só dentro do processo; redis://host:6379/0 → pub/sub entre réplicas;
+# memory:// → bus em memória (várias "réplicas" no mesmo processo, para testes)
+BROKER_URL = os.getenv("BROKER_URL", "")
+BROKER_CHANNEL_PREFIX = os.getenv("BROKER_CHANNEL_PREFIX", "pingu")
+
+
+class Broker:
+    """
+    Transporte das mensagens WebSocket entre réplicas do message-service.
+
+    O ConnectionManager publica para o canal de cada user; cada réplica só
+    subscreve os canais dos users que tem ligados, e recebe-os em
+    on_message(user_id, message). O broadcast usa um canal próprio que todas
+    as réplicas subscrevem (user_id = None).
+
+    Eventos internos (ex.: membros dos grupos) seguem num canal de eventos que
+    todas as réplicas subscrevem, entregues em on_event(message) — incluindo
+    à réplica que publicou.
+    """
+
+    def __init__(self, on_message, on_event=None):
+        self.on_message = on_message
+        self.on_event = on_event
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def subscribe_user(self, user_id: int):
+        pass
+
+    async def unsubscribe_user(self, user_id: int):
+        pass
+
+    async def publish_user(self, user_id: int, message: str):
+        raise NotImplementedError
+
+    async def publish_users(self, user_ids, message: str):
+        for user_id in user_ids:
+            await self.publish_user(user_id, message)
+
+    async def publish_broadcast(self, message: str):
+        raise NotImplementedError
+
+    async def publish_event(self, message: str):
+        raise NotImplementedError
+
+    async def _deliver_event(self, message: str):
+        if self.on_event is not None:
+            await self.on_event(message)
+
+
+class InProcessBroker(Broker):
+    """Uma só réplica: entrega diretamente às ligações locais."""
+
+    async def publish_user(self, user_id: int, message: str):
+        await self.on_message(user_id, message)
+
+    async def publish_broadcast(self, message: str):
+        await self.on_message(None, message)
+
+    async def publish_event(self, message: str):
+        await self._deliver_event(message)
+
+
+class MemoryBus:
+    """Pub/sub em memória partilhado por vários MemoryBroker do mesmo processo."""
+
+    def __init__(self):
+        self.channels: dict[str, set] = {}
+
+    def subscribe(self, channel: str, broker):
+        self.channels.setdefault(channel, set()).add(broker)
+
+    def unsubscribe(self, channel: str, broker):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(broker)
+            if not subscribers:
+                del self.channels[channel]
+
+    async def publish(self, channel: str, message: str):
+        for broker in list(self.channels.get(channel, ())):
+            await broker._receive(channel, message)
+
+
+_memory_bus = MemoryBus()
+
+USER_CHANNEL = "user:"
+BROADCAST_CHANNEL = "broadcast"
+EVENTS_CHANNEL = "events"
+
+
+class MemoryBroker(Broker):
+    """
+    Broker falso com a mesma semântica do Redis (só recebe o que subscreveu),
+    sobre um MemoryBus: cada instância faz de uma réplica. Para testes e
+    desenvolvimento local sem Redis.
+    """
+
+    def __init__(self, on_message, on_event=None, bus: MemoryBus | None = None):
+        super().__init__(on_message, on_event)
+        self.bus = bus or _memory_bus
+
+    async def start(self):
+        self.bus.subscribe(BROADCAST_CHANNEL, self)
+        self.bus.subscribe(EVENTS_CHANNEL, self)
+
+    async def close(self):
+        for channel in list(self.bus.channels):
+            self.bus.unsubscribe(channel, self)
+
+    async def subscribe_user(self, user_id: int):
+        self.bus.subscribe(f"{USER_CHANNEL}{user_id}", self)
+
+    async def unsubscribe_user(self, user_id: int):
+        self.bus.unsubscribe(f"{USER_CHANNEL}{user_id}", self)
+
+    async def publish_user(self, user_id: int, message: str):
+        await self.bus.publish(f"{USER_CHANNEL}{user_id}", message)
+
+    async def publish_broadcast(self, message: str):
+        await self.bus.publish(BROADCAST_CHANNEL, message)
+
+    async def publish_event(self, message: str):
+        await self.bus.publish(EVENTS_CHANNEL, message)
+
+    async def _receive(self, channel: str, message: str):
+        if channel == BROADCAST_CHANNEL:
+            await self.on_message(None, message)
+        elif channel == EVENTS_CHANNEL:
+            await self._deliver_event(message)
+        else:
+            await self.on_message(int(channel[len(USER_CHANNEL):]), message)
+
+
+class RedisBroker(Broker):
+    """Pub/sub Redis (ou compatível: Valkey, KeyDB, ...)."""
+
+    def __init__(self, on_message, url: str, on_event=None):
+        super().__init__(on_message, on_event)
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("BROKER_URL requer o pacote 'redis' (pip install redis)")
+        self.redis = redis.from_url(url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.user_prefix = f"{BROKER_CHANNEL_PREFIX}:user:"
+        self.broadcast_channel = f"{BROKER_CHANNEL_PREFIX}:broadcast"
+        self.events_channel = f"{BROKER_CHANNEL_PREFIX}:events"
+        self.reader = None
+
+    def _user_channel(self, user_id: int) -> str:
+        return f"{self.user_prefix}{user_id}"
+
+    async def start(self):
+        await self.pubsub.subscribe(self.broadcast_channel, self.events_channel)
+        self.reader = asyncio.create_task(self._read_loop())
+        print(f"📡 Broker Redis ligado ({BROKER_URL})")
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def subscribe_user(self, user_id: int):
+        await self.pubsub.subscribe(self._user_channel(user_id))
+
+    async def unsubscribe_user(self, user_id: int):
+        await self.pubsub.unsubscribe(self._user_channel(user_id))
+
+    async def publish_user(self, user_id: int, message: str):
+        await self.redis.publish(self._user_channel(user_id), message)
+
+    async def publish_users(self, user_ids, message: str):
+        # um round-trip para todos os destinatários
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.publish(self._user_channel(user_id), message)
+            await pipe.execute()
+
+    async def publish_broadcast(self, message: str):
+        await self.redis.publish(self.broadcast_channel, message)
+
+    async def publish_event(self, message: str):
+        await self.redis.publish(self.events_channel, message)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                async for msg in self.pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    channel = msg["channel"].decode()
+                    data = msg["data"].decode()
+                    if channel == self.broadcast_channel:
+                        await self.on_message(None, data)
+                    elif channel == self.events_channel:
+                        await self._deliver_event(data)
+                    elif channel.startswith(self.user_prefix):
+                        await self.on_message(int(channel[len(self.user_prefix):]), data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro no broker Redis: {e}")
+                await asyncio.sleep(1)
+
+
+def create_broker(on_message, on_event=None) -> Broker:
+    if BROKER_URL.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(on_message, BROKER_URL, on_event)
+    if BROKER_URL.startswith("memory://"):
+        return MemoryBroker(on_message, on_event)
+    return InProcessBroker(on_message, on_event)
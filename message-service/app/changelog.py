@@ -0,0 +1,203 @@
+import asyncio
+import base64
+import os
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, or_, and_, not_, cast, literal, DateTime, Text
+from sqlalchemy.types import UserDefinedType
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+from .db import run_db
+
+ChangeLog = models.ChangeLog
+
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "1000"))
+# o log é podado; cursores mais antigos do que isto pedem um reset (refetch completo)
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+CHANGE_LOG_PRUNE_SECONDS = float(os.getenv("CHANGE_LOG_PRUNE_SECONDS", "3600"))
+CHANGE_LOG_PRUNE_BATCH = 10000
+
+
+# --- Escrita (na mesma transação da alteração; quem chama faz o commit) ---
+
+def _direct(sender_id: int, receiver_id: int) -> dict:
+    low, high = sorted((sender_id, receiver_id))
+    return {"chat_type": "direct", "user_low": low, "user_high": high, "group_id": None}
+
+
+def _group(group_id: int) -> dict:
+    return {"chat_type": "group", "user_low": None, "user_high": None, "group_id": group_id}
+
+
+def _scope(chat_type: str, row: dict) -> dict:
+    if chat_type == "direct":
+        return _direct(row["sender_id"], row["receiver_id"])
+    return _group(row["group_id"])
+
+
+def record_messages(db, chat_type: str, rows: list[dict], ids: list[int]):
+    """Mensagens novas (rows = colunas do INSERT, ids pela mesma ordem)"""
+    if not ids:
+        return
+    db.execute(insert(ChangeLog), [
+        {"kind": "message", "user_id": row["sender_id"], "message_id": message_id, **_scope(chat_type, row)}
+        for row, message_id in zip(rows, ids)
+    ])
+
+
+def record_message_deleted(db, chat_type: str, msg):
+    scope = _direct(msg.sender_id, msg.receiver_id) if chat_type == "direct" else _group(msg.group_id)
+    db.execute(insert(ChangeLog).values(
+        kind="message_deleted", user_id=msg.sender_id, message_id=msg.id, **scope,
+    ))
+
+
+def record_conversation_deleted(db, chat_type: str, conversation_key: str, cutoff_id: int):
+    if chat_type == "direct":
+        low, high = (int(u) for u in conversation_key.split(":"))
+        scope = _direct(low, high)
+    else:
+        scope = _group(int(conversation_key))
+    db.execute(insert(ChangeLog).values(kind="conversation_deleted", message_id=cutoff_id, **scope))
+
+
+def record_read(db, chat_type: str, user_id: int, key, watermark):
+    """key = id do outro user (direct) ou group_id; watermark pode ser uma subquery"""
+    scope = _direct(user_id, key) if chat_type == "direct" else _group(key)
+    db.execute(insert(ChangeLog).values(
+        kind="read", user_id=user_id, message_id=func.coalesce(watermark, 0), **scope,
+    ))
+
+
+# --- Cursor ---
+#
+# O cursor leva o último id entregue e o snapshot (txid_current_snapshot) em que
+# foi lido. Os ids saem da sequence antes do commit, por isso uma transação
+# lenta pode commitar um id abaixo do cursor depois de o cliente já ter passado
+# por ele: essas linhas são as que não eram visíveis no snapshot do cursor
+# (txid_visible_in_snapshot) e vêm no sync seguinte. Não há janela de tempo a
+# afinar contra o statement_timeout.
+
+SNAPSHOT_RE = re.compile(r"^\d+:\d+:[\d,]*$")
+
+
+class TxidSnapshot(UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "txid_snapshot"
+
+
+def _snapshot(value: str):
+    return cast(cast(literal(value, Text), Text), TxidSnapshot())
+
+
+def encode_cursor(change_id: int, snapshot: str, at: datetime) -> str:
+    raw = f"{change_id}|{at.isoformat()}|{snapshot}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(change_id, snapshot, instante) ou None se o cursor for inválido (ou de um formato antigo)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        change_id, at, snapshot = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 2)
+        if not SNAPSHOT_RE.match(snapshot):
+            return None
+        return int(change_id), snapshot, datetime.fromisoformat(at)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# --- Leitura ---
+
+async def read_head(db: AsyncSession):
+    """
+    (head, snapshot, instante): o maior id visível e o snapshot da mesma
+    instrução — head é exatamente o que esse snapshot vê.
+    """
+    row = (await db.execute(select(
+        func.coalesce(select(func.max(ChangeLog.id)).scalar_subquery(), 0),
+        cast(func.txid_current_snapshot(), Text),
+        func.timezone("utc", func.now(), type_=DateTime),
+    ))).one()
+    return row[0], row[1], row[2]
+
+
+def _in_snapshot(snapshot: str):
+    return func.txid_visible_in_snapshot(ChangeLog.txid, _snapshot(snapshot))
+
+
+async def load_changes(
+    db: AsyncSession,
+    user_id: int,
+    group_ids,
+    since: int,
+    since_snapshot: str,
+    head: int,
+    snapshot: str,
+    limit: int = SYNC_MAX_CHANGES,
+):
+    """
+    Alterações que interessam ao user e que o cursor (since, since_snapshot)
+    ainda não viu, tal como as vê snapshot. Devolve (atrasadas, novas):
+
+    - atrasadas: id <= since mas commitadas depois de since_snapshot (sem
+      limite: só as transações que estavam a correr nesse sync)
+    - novas: (since, head], por ordem, até limit + 1
+    """
+    visible = [
+        and_(
+            ChangeLog.kind != "read",
+            or_(ChangeLog.user_low == user_id, ChangeLog.user_high == user_id),
+        ),
+        and_(ChangeLog.kind == "read", ChangeLog.user_id == user_id),
+    ]
+    if group_ids:
+        visible.append(and_(ChangeLog.kind != "read", ChangeLog.group_id.in_(sorted(group_ids))))
+
+    late = await db.execute(
+        select(ChangeLog)
+        .where(
+            ChangeLog.id <= since,
+            ChangeLog.txid >= func.txid_snapshot_xmin(_snapshot(since_snapshot)),
+            not_(_in_snapshot(since_snapshot)),
+            _in_snapshot(snapshot),
+            or_(*visible),
+        )
+        .order_by(ChangeLog.id)
+    )
+    new = await db.execute(
+        select(ChangeLog)
+        .where(ChangeLog.id > since, ChangeLog.id <= head, _in_snapshot(snapshot), or_(*visible))
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+    )
+    return late.scalars().all(), new.scalars().all()
+
+
+# --- Retenção ---
+
+def _prune_batch(db: Session) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=CHANGE_LOG_RETENTION_DAYS)
+    ids = (
+        select(ChangeLog.id)
+        .where(ChangeLog.created_at < cutoff)
+        .order_by(ChangeLog.id)
+        .limit(CHANGE_LOG_PRUNE_BATCH)
+        .scalar_subquery()
+    )
+    count = db.execute(delete(ChangeLog).where(ChangeLog.id.in_(ids))).rowcount
+    db.commit()
+    return count
+
+
+async def run_prune_loop():
+    while True:
+        await asyncio.sleep(CHANGE_LOG_PRUNE_SECONDS)
+        try:
+            while await run_db(_prune_batch) == CHANGE_LOG_PRUNE_BATCH:
+                await asyncio.sleep(0.01)
+        except Exception as e:
+            print(f"❌ Erro a podar o change_log: {e}")
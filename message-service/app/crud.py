@@ -1,9 +1,14 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, search, media, changelog
+from .deletion import visible_after
+from .pagination import paginate, DEFAULT_PAGE_SIZE
+from .http_client import get_client
 from passlib.context import CryptContext
-from sqlalchemy import or_, and_, func
-from datetime import datetime, timezone
-import requests
+from sqlalchemy import or_, and_, func, select, insert, values, column, true, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime, timedelta, timezone
+import asyncio
 import os
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,11 +16,13 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
 GROUP_SERVICE_URL = os.getenv("GROUP_SERVICE_URL")
+# máximo de ids por GET /users?ids= (mesmo setting que o user-service)
+MAX_BULK_IDS = int(os.getenv("MAX_BULK_IDS", "1000"))
 
-def get_user_info(user_id: int, token: str):
+async def get_user_info(user_id: int, token: str):
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{USER_SERVICE_URL}/users/{user_id}", headers=headers)
+        res = await get_client().get(f"{USER_SERVICE_URL}/users/{user_id}", headers=headers)
         if res.status_code == 200:
             data = res.json()
             username = data.get("username")
@@ -28,30 +35,51 @@ def get_user_info(user_id: int, token: str):
     return {"id": user_id, "username": "Unknown User"}
 
 
+async def _fetch_users(ids, headers) -> list:
+    res = await get_client().get(
+        f"{USER_SERVICE_URL}/users",
+        params={"ids": ",".join(str(uid) for uid in ids)},
+        headers=headers,
+    )
+    if res.status_code != 200:
+        print(f"⚠️ Erro a obter users {ids[0]}..{ids[-1]}: {res.status_code}")
+        return []
+    return res.json()
+
+
+async def get_users_info(user_ids, token: str):
+    """Resolve vários users no user-service (lotes de MAX_BULK_IDS, em paralelo) → {id: {"id", "username"}}"""
+    ids = sorted({uid for uid in user_ids if uid is not None})
+    if not ids:
+        return {}
+
+    users = {}
+    headers = {"Authorization": f"Bearer {token}"}
+    batches = [ids[i:i + MAX_BULK_IDS] for i in range(0, len(ids), MAX_BULK_IDS)]
+    results = await asyncio.gather(*(_fetch_users(batch, headers) for batch in batches), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"⚠️ Erro ao contactar user-service: {result}")
+            continue
+        for data in result:
+            username = data.get("username")
+            # Se foi anonimizado
+            if username and username.startswith("UnknownUser_"):
+                data = {"id": data["id"], "username": "Unknown User"}
+            users[data["id"]] = data
 
-def get_group_members_ids(db: Session, group_id: int, token: str):
-    try:
-        # Chamamos o group-service (já tens o GROUP_SERVICE_URL definido)
-        headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{GROUP_SERVICE_URL}/groups/{group_id}/members", headers=headers)
+    # Quem não vier na resposta fica como "Unknown User"
+    for uid in ids:
+        users.setdefault(uid, {"id": uid, "username": "Unknown User"})
+    return users
 
-        if res.status_code == 200:
-            members = res.json()
-            # cada membro vem do group-service no formato {"id": x, "username": "..."}
-            return [m["id"] for m in members]
-        else:
-            print(f"⚠️ Erro a obter membros do grupo {group_id}: {res.status_code}")
-            return []
-    except Exception as e:
-        print(f"❌ Erro ao contactar group-service: {e}")
-        return []
 
 
-def get_user_groups(user_id: int, token: str):
+async def get_user_groups(user_id: int, token: str):
     """Busca os grupos de um user no group-service"""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{GROUP_SERVICE_URL}/groups/{user_id}", headers = headers)
+        res = await get_client().get(f"{GROUP_SERVICE_URL}/groups/{user_id}", headers=headers)
         if res.status_code == 200:
             return res.json()  # lista [{id, name}, ...]
     except Exception as e:
@@ -59,306 +87,622 @@ def get_user_groups(user_id: int, token: str):
     return []
 
 
+async def get_user_contacts(user_id: int, token: str):
+    """Busca os contactos de um user no user-service"""
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        res = await get_client().get(f"{USER_SERVICE_URL}/contacts/{user_id}", headers=headers)
+        if res.status_code == 200:
+            return res.json()  # lista [{id, username}, ...]
+    except Exception as e:
+        print(f"Erro ao contactar user-service: {e}")
+    return []
+
+
 
-def save_message(db: Session, sender_id: int, receiver_id: int, content: str, reply_to_id: int | None = None, image_url=None):
-    msg = models.Message(
-        sender_id=sender_id,
-        receiver_id=receiver_id,
-        content=content,
-        reply_to_id=reply_to_id,
-        was_reply=bool(reply_to_id),
-        image_url=image_url
+def direct_conversation_id(user1_id: int, user2_id: int) -> str:
+    """Chave da conversa direta, igual nos dois sentidos"""
+    low, high = sorted((user1_id, user2_id))
+    return f"{low}:{high}"
+
+
+def message_values(sender_id: int, receiver_id: int, content: str, reply_to_id: int | None = None, image_url=None):
+    """Colunas de uma nova mensagem direta (usado também pelo write_batcher)"""
+    return {
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "conversation_id": direct_conversation_id(sender_id, receiver_id),
+        "content": content,
+        "reply_to_id": reply_to_id,
+        "was_reply": bool(reply_to_id),
+        "image_url": image_url,
+    }
+
+
+def _seed_read_state(db: Session, rows: list[dict]):
+    """
+    Watermark 0 para o destinatário na primeira mensagem de cada conversa: assim cada
+    conversa do user tem uma linha em direct_read_state e os unread counts partem dela.
+    """
+    seeds = {(row["receiver_id"], row["conversation_id"]) for row in rows if row.get("receiver_id") is not None}
+    if not seeds:
+        return
+    db.execute(
+        pg_insert(models.DirectReadState)
+        .values([
+            {"user_id": user_id, "conversation_id": conversation_id, "last_read_message_id": 0}
+            for user_id, conversation_id in sorted(seeds)
+        ])
+        .on_conflict_do_nothing()
     )
+
+
+def save_message(db: Session, sender_id: int, receiver_id: int, content: str, reply_to_id: int | None = None, image_url=None):
+    values = message_values(sender_id, receiver_id, content, reply_to_id, image_url)
+    msg = models.Message(**values)
     db.add(msg)
+    db.flush()
+    _seed_read_state(db, [values])
+    media.add_refs(db, [image_url])
+    changelog.record_messages(db, "direct", [values], [msg.id])
     db.commit()
     db.refresh(msg)
     return msg
 
 
-def get_conversation(db, user1_id: int, user2_id: int, token: str):
-    messages = (
-        db.query(models.Message)
-        .filter(
-            ((models.Message.sender_id == user1_id) & (models.Message.receiver_id == user2_id))
-            | ((models.Message.sender_id == user2_id) & (models.Message.receiver_id == user1_id))
+def insert_many(db: Session, model, rows: list[dict]):
+    """
+    Insere várias linhas numa só transação (multi-row INSERT ... RETURNING).
+    Devolve os ids pela mesma ordem de `rows`.
+    """
+    stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+    ids = db.execute(stmt, rows).scalars().all()
+    if model is models.Message:
+        _seed_read_state(db, rows)
+    media.add_refs(db, [row.get("image_url") for row in rows])
+    changelog.record_messages(db, "direct" if model is models.Message else "group", rows, ids)
+    db.commit()
+    return ids
+
+
+def _reply_dict(replied, users):
+    if replied:
+        return {
+            "id": replied.id,
+            "from": users[replied.sender_id]["username"],
+            "content": replied.content,
+        }
+    return {
+        "id": None,
+        "from": None,
+        "content": "Message unavailable",
+    }
+
+
+async def _load_conversation(db: AsyncSession, conversation_id: str, before, after, limit):
+    # As mensagens respondidas vêm na mesma query (self-join)
+    stmt = (
+        select(models.Message)
+        .options(joinedload(models.Message.reply_to))
+        .where(
+            models.Message.conversation_id == conversation_id,
+            # conversas apagadas ficam escondidas logo (tombstone), antes do DELETE acabar
+            models.Message.id > visible_after(models.Message, "direct", conversation_id),
         )
-        .order_by(models.Message.timestamp.asc())
-        .all()
     )
+    return await paginate(db, stmt, models.Message, before=before, after=after, limit=limit)
+
+
+async def get_conversation(
+    db: AsyncSession,
+    user1_id: int,
+    user2_id: int,
+    token: str,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    messages, next_cursor = await _load_conversation(
+        db, direct_conversation_id(user1_id, user2_id), before, after, limit
+    )
+
+    # Um único pedido ao user-service para todos os participantes
+    user_ids = {m.sender_id for m in messages} | {m.receiver_id for m in messages}
+    user_ids |= {m.reply_to.sender_id for m in messages if m.reply_to}
+    users = await get_users_info(user_ids, token)
+    variants = await media.load_variants(db, {m.image_url for m in messages if m.image_url})
 
     result = []
     for m in messages:
-        sender = get_user_info(m.sender_id, token)
-        receiver = get_user_info(m.receiver_id, token) if m.receiver_id else None
-
         msg_dict = {
             "id": m.id,
-            "from": sender["username"],
-            "to": receiver["username"] if receiver else None,
+            "from": users[m.sender_id]["username"],
+            "to": users[m.receiver_id]["username"] if m.receiver_id else None,
             "content": m.content,
             "image_url": m.image_url,
             "timestamp": m.timestamp.replace(tzinfo=timezone.utc).isoformat(),
         }
+        if m.image_url in variants:
+            msg_dict["image_variants"] = variants[m.image_url]
 
-        # Se é (ou foi) uma reply
         if m.was_reply:
-            replied = None
-            if m.reply_to_id:
-                replied = db.query(models.Message).get(m.reply_to_id)
-
-            if replied:
-                replied_sender = get_user_info(replied.sender_id, token)
-                msg_dict["reply_to"] = {
-                    "id": replied.id,
-                    "from": replied_sender["username"],
-                    "content": replied.content,
-                }
-            else:
-                msg_dict["reply_to"] = {
-                    "id": None,
-                    "from": None,
-                    "content": "Message unavailable",
-                }
+            msg_dict["reply_to"] = _reply_dict(m.reply_to, users)
 
         result.append(msg_dict)
 
+    return {"messages": result, "next_cursor": next_cursor}
 
 
 
-    return result
-
+def group_message_values(sender_id: int, group_id: int, content: str, reply_to_id: int | None = None, image_url=None):
+    """Colunas de uma nova mensagem de grupo (usado também pelo write_batcher)"""
+    return {
+        "sender_id": sender_id,
+        "group_id": group_id,
+        "content": content,
+        "reply_to_id": reply_to_id,  # 👈 store the relation if present
+        "was_reply": bool(reply_to_id),
+        "image_url": image_url,
+    }
 
 
 def save_group_message(
     db: Session,
-    token: str,
     sender_id: int,
     group_id: int,
     content: str,
     reply_to_id: int | None = None,
     image_url=None
 ):
-    # 1️⃣ Create and save message (with optional reply_to_id)
-    msg = models.GroupMessage(
-        sender_id=sender_id,
-        group_id=group_id,
-        content=content,
-        reply_to_id=reply_to_id,  # 👈 store the relation if present
-        was_reply=bool(reply_to_id),
-        image_url=image_url
-    )
+    # Uma única linha por mensagem: o estado de leitura vem dos watermarks (GroupReadState)
+    values = group_message_values(sender_id, group_id, content, reply_to_id, image_url)
+    msg = models.GroupMessage(**values)
     db.add(msg)
+    db.flush()
+    media.add_refs(db, [image_url])
+    changelog.record_messages(db, "group", [values], [msg.id])
     db.commit()
     db.refresh(msg)
-
-    # 2️⃣ Fetch group members from group-service
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{GROUP_SERVICE_URL}/groups/{group_id}/members", headers=headers)
-        members = res.json() if res.status_code == 200 else []
-    except Exception as e:
-        print(f"Erro ao contactar group-service: {e}")
-        members = []
-
-    # 3️⃣ Create unread-tracking rows (skip sender)
-    for m in members:
-        if m["id"] != sender_id:
-            db.add(models.GroupMessageRead(
-                message_id=msg.id,
-                user_id=m["id"],
-                read=False
-            ))
-    db.commit()
-
     return msg
 
 
 
 
-def get_group_messages(db: Session, group_id: int, token: str):
-    messages = (
-        db.query(models.GroupMessage)
-        .filter(models.GroupMessage.group_id == group_id)
-        .order_by(models.GroupMessage.timestamp.asc())
-        .all()
+async def _load_group_messages(db: AsyncSession, group_id: int, before, after, limit):
+    stmt = (
+        select(models.GroupMessage)
+        .options(joinedload(models.GroupMessage.reply_to))
+        .where(
+            models.GroupMessage.group_id == group_id,
+            models.GroupMessage.id > visible_after(models.GroupMessage, "group", str(group_id)),
+        )
     )
+    return await paginate(db, stmt, models.GroupMessage, before=before, after=after, limit=limit)
+
+
+async def get_group_messages(
+    db: AsyncSession,
+    group_id: int,
+    token: str,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    messages, next_cursor = await _load_group_messages(db, group_id, before, after, limit)
+
+    user_ids = {m.sender_id for m in messages}
+    user_ids |= {m.reply_to.sender_id for m in messages if m.reply_to}
+    users = await get_users_info(user_ids, token)
+    variants = await media.load_variants(db, {m.image_url for m in messages if m.image_url})
 
     result = []
     for m in messages:
-        sender = get_user_info(m.sender_id, token)
-
         msg_dict = {
             "id": m.id,
-            "from": sender["username"],
+            "from": users[m.sender_id]["username"],
             "group": group_id,
             "content": m.content,
             "image_url": m.image_url,
             "timestamp": m.timestamp.replace(tzinfo=timezone.utc).isoformat(),
         }
+        if m.image_url in variants:
+            msg_dict["image_variants"] = variants[m.image_url]
 
         # 👇 incluir info de reply (se for ou tiver sido uma reply)
         if getattr(m, "was_reply", False):
-            replied = None
-            if m.reply_to_id:
-                replied = db.query(models.GroupMessage).get(m.reply_to_id)
-
-            if replied:
-                replied_sender = get_user_info(replied.sender_id, token)
-                msg_dict["reply_to"] = {
-                    "id": replied.id,
-                    "from": replied_sender["username"],
-                    "content": replied.content,
-                }
-            else:
-                msg_dict["reply_to"] = {
-                    "id": None,
-                    "from": None,
-                    "content": "Message unavailable",
-                }
+            msg_dict["reply_to"] = _reply_dict(m.reply_to, users)
 
         result.append(msg_dict)
 
-    return result
+    return {"messages": result, "next_cursor": next_cursor}
 
 
-def get_last_message_between(db, user1_id: int, user2_id: int):
-    return (
-        db.query(models.Message)
-        .filter(
-            or_(
-                and_(models.Message.sender_id == user1_id, models.Message.receiver_id == user2_id),
-                and_(models.Message.sender_id == user2_id, models.Message.receiver_id == user1_id),
-            )
+async def get_last_direct_messages(db: AsyncSession, user_id: int):
+    """Última mensagem de cada conversa direta do user (uma query, window function)"""
+    ranked = (
+        select(
+            models.Message.id.label("id"),
+            func.row_number().over(
+                partition_by=models.Message.conversation_id,
+                order_by=(models.Message.timestamp.desc(), models.Message.id.desc()),
+            ).label("rn"),
+        )
+        .where(
+            or_(models.Message.sender_id == user_id, models.Message.receiver_id == user_id),
+            models.Message.id > visible_after(models.Message, "direct", models.Message.conversation_id),
         )
-        .order_by(models.Message.timestamp.desc())
-        .first()
+        .subquery()
     )
-
-def get_last_group_message(db, group_id: int):
-    return (
-        db.query(models.GroupMessage)
-        .filter(models.GroupMessage.group_id == group_id)
-        .order_by(models.GroupMessage.timestamp.desc())
-        .first()
+    result = await db.execute(
+        select(models.Message)
+        .join(ranked, ranked.c.id == models.Message.id)
+        .where(ranked.c.rn == 1)
     )
-
-def mark_messages_read(db: Session, user_id: int, other_id: int):
-    """Marca todas as mensagens de other_id → user_id como lidas"""
-    messages = (
-        db.query(models.Message)
-        .filter(
-            models.Message.sender_id == other_id,
-            models.Message.receiver_id == user_id
+    return result.scalars().all()
+
+
+async def get_last_group_messages(db: AsyncSession, group_ids: list[int]):
+    """Última mensagem de cada grupo → {group_id: GroupMessage}"""
+    if not group_ids:
+        return {}
+    ranked = (
+        select(
+            models.GroupMessage.id.label("id"),
+            func.row_number().over(
+                partition_by=models.GroupMessage.group_id,
+                order_by=(models.GroupMessage.timestamp.desc(), models.GroupMessage.id.desc()),
+            ).label("rn"),
+        )
+        .where(
+            models.GroupMessage.group_id.in_(group_ids),
+            models.GroupMessage.id > visible_after(models.GroupMessage, "group", models.GroupMessage.group_id),
         )
-        .all()
+        .subquery()
+    )
+    result = await db.execute(
+        select(models.GroupMessage)
+        .join(ranked, ranked.c.id == models.GroupMessage.id)
+        .where(ranked.c.rn == 1)
+    )
+    return {m.group_id: m for m in result.scalars().all()}
+
+
+async def get_inbox(db: AsyncSession, user_id: int, token: str):
+    """
+    Conversas do user: peers com quem já falou + contactos, e os seus grupos.
+    Custo proporcional à atividade do user (e não ao nº total de users).
+    """
+    # Contactos e grupos vêm de outros serviços → pedidos em paralelo
+    contacts_list, groups = await asyncio.gather(
+        get_user_contacts(user_id, token),
+        get_user_groups(user_id, token),
     )
+    contacts = {c["id"]: c for c in contacts_list}
+
+    last_direct = await get_last_direct_messages(db, user_id)
+    last_by_group = await get_last_group_messages(db, [g["id"] for g in groups])
+
+    # 🔹 Direct chats
+    last_by_peer = {}
+    for m in last_direct:
+        peer_id = m.receiver_id if m.sender_id == user_id else m.sender_id
+        if peer_id is not None and peer_id != user_id:
+            last_by_peer[peer_id] = m
+
+    # Um único pedido ao user-service para os nomes que faltam
+    missing = {pid for pid in last_by_peer if pid not in contacts}
+    missing |= {m.sender_id for m in last_by_group.values()}
+    users = await get_users_info(missing, token)
+    users.update(contacts)
+
+    user_data = []
+    for peer_id in set(last_by_peer) | set(contacts):
+        if peer_id == user_id:
+            continue
+        last_msg = last_by_peer.get(peer_id)
+        user_data.append({
+            "id": peer_id,
+            "username": users[peer_id]["username"],
+            "last_message": last_msg.content if last_msg else None,
+            "last_timestamp": last_msg.timestamp if last_msg else None,
+        })
+    user_data.sort(key=lambda u: u["id"])
+
+    group_data = []
+    for g in groups:
+        last_msg = last_by_group.get(g["id"])
+        group_data.append({
+            "id": g["id"],
+            "name": g["name"],
+            "last_message": (
+                f"{users[last_msg.sender_id]['username']}: {last_msg.content}"
+                if last_msg else None
+            ),
+            "last_timestamp": last_msg.timestamp if last_msg else None,
+        })
+
+    return {"users": user_data, "groups": group_data}
+
+
+def _upsert_watermark(db: Session, model, key: dict, latest):
+    """INSERT ... ON CONFLICT: o watermark só avança (GREATEST)"""
+    stmt = pg_insert(model).values(
+        **key,
+        last_read_message_id=func.coalesce(latest, 0),
+        updated_at=datetime.utcnow(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            "last_read_message_id": func.greatest(model.last_read_message_id, stmt.excluded.last_read_message_id),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
 
-    for m in messages:
-        existing = (
-            db.query(models.MessageRead)
-            .filter(models.MessageRead.message_id == m.id, models.MessageRead.user_id == user_id)
-            .first()
-        )
-        if existing:
-            if not existing.read:
-                existing.read = True
-                existing.read_at = datetime.utcnow()
-        else:
-            db.add(models.MessageRead(
-                message_id=m.id,
-                user_id=user_id,
-                read=True,
-                read_at=datetime.utcnow()
-            ))
 
+def mark_messages_read(db: Session, user_id: int, other_id: int):
+    """Marca todas as mensagens de other_id → user_id como lidas"""
+    conversation_id = direct_conversation_id(user_id, other_id)
+    latest = (
+        select(func.max(models.Message.id))
+        .where(models.Message.conversation_id == conversation_id)
+        .scalar_subquery()
+    )
+    _upsert_watermark(db, models.DirectReadState, {"user_id": user_id, "conversation_id": conversation_id}, latest)
+    changelog.record_read(db, "direct", user_id, other_id, latest)
     db.commit()
 
 
 def mark_group_messages_read(db: Session, user_id: int, group_id: int):
     """Marca todas as mensagens do grupo como lidas para o user_id"""
-    messages = (
-        db.query(models.GroupMessage)
-        .filter(models.GroupMessage.group_id == group_id)
-        .all()
+    latest = (
+        select(func.max(models.GroupMessage.id))
+        .where(models.GroupMessage.group_id == group_id)
+        .scalar_subquery()
     )
-
-    for m in messages:
-        existing = (
-            db.query(models.GroupMessageRead)
-            .filter(models.GroupMessageRead.message_id == m.id, models.GroupMessageRead.user_id == user_id)
-            .first()
-        )
-        if existing:
-            if not existing.read:
-                existing.read = True
-                existing.read_at = datetime.utcnow()
-        else:
-            db.add(models.GroupMessageRead(
-                message_id=m.id,
-                user_id=user_id,
-                read=True,
-                read_at=datetime.utcnow()
-            ))
-
+    _upsert_watermark(db, models.GroupReadState, {"user_id": user_id, "group_id": group_id}, latest)
+    changelog.record_read(db, "group", user_id, group_id, latest)
     db.commit()
 
 
-def get_unread_counts(db: Session, user_id: int, token: str):
-    # Diretas
-    direct_unread = (
-        db.query(models.Message.sender_id, func.count(models.Message.id))
-        .outerjoin(
-            models.MessageRead,
-            (models.Message.id == models.MessageRead.message_id) & (models.MessageRead.user_id == user_id)
+async def _count_unread(db: AsyncSession, user_id: int, group_ids: list[int]):
+    """
+    Uma contagem LATERAL por conversa, a começar no watermark: cada uma é um range scan
+    em (conversation_id, id) / (group_id, id) só sobre as mensagens por ler, por isso o
+    custo acompanha o nº de não lidas e não o histórico do user.
+    """
+    # Diretas: cada conversa do user tem linha em direct_read_state (ver _seed_read_state)
+    read_state = models.DirectReadState
+    direct = models.Message
+    unread = (
+        select(func.count().label("unread"))
+        .where(
+            direct.conversation_id == read_state.conversation_id,
+            direct.id > func.greatest(
+                read_state.last_read_message_id,
+                visible_after(read_state, "direct", read_state.conversation_id),
+            ),
+            direct.receiver_id == user_id,
+            direct.sender_id != user_id,
         )
-        .filter(
-            models.Message.receiver_id == user_id,
-            models.Message.sender_id != user_id,
-            or_(
-                models.MessageRead.id == None,
-                models.MessageRead.read == False
-            )
-        )
-        .group_by(models.Message.sender_id)
-        .all()
+        .lateral()
     )
-    direct_counts = {str(sender_id): count for sender_id, count in direct_unread}
-
-    # 🔹 Buscar grupos do utilizador ao group-service
-    try:
-        headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{GROUP_SERVICE_URL}/groups/{user_id}", headers=headers)
-        groups = res.json() if res.status_code == 200 else []
-        group_ids = [g["id"] for g in groups]
-    except Exception as e:
-        print(f"Erro ao contactar group-service: {e}")
-        group_ids = []
-
-    # Grupos
+    direct_unread = await db.execute(
+        select(read_state.conversation_id, unread.c.unread)
+        .join(unread, true())
+        .where(read_state.user_id == user_id)
+    )
+    direct_counts = {}
+    for conversation_id, count in direct_unread:
+        if count:
+            low, high = conversation_id.split(":")
+            direct_counts[high if low == str(user_id) else low] = count
+
+    # Grupos: a lista de grupos vem do group-service; watermark em falta = 0
+    group_counts = {}
     if group_ids:
-        group_unread = (
-            db.query(models.GroupMessage.group_id, func.count(models.GroupMessage.id))
-            .outerjoin(
-                models.GroupMessageRead,
-                (models.GroupMessage.id == models.GroupMessageRead.message_id) & (models.GroupMessageRead.user_id == user_id)
+        groups = values(column("group_id", Integer), name="user_groups").data([(gid,) for gid in group_ids])
+        group_state = models.GroupReadState
+        group = models.GroupMessage
+        unread = (
+            select(func.count().label("unread"))
+            .where(
+                group.group_id == groups.c.group_id,
+                group.id > func.greatest(
+                    func.coalesce(group_state.last_read_message_id, 0),
+                    visible_after(groups, "group", groups.c.group_id),
+                ),
+                group.sender_id != user_id,
             )
-            .filter(
-                models.GroupMessage.group_id.in_(group_ids),
-                models.GroupMessage.sender_id != user_id,
-                or_(
-                    models.GroupMessageRead.id == None,
-                    models.GroupMessageRead.read == False
-                )
+            .lateral()
+        )
+        group_unread = await db.execute(
+            select(groups.c.group_id, unread.c.unread)
+            .select_from(groups)
+            .outerjoin(
+                group_state,
+                (group_state.user_id == user_id) & (group_state.group_id == groups.c.group_id),
             )
-            .group_by(models.GroupMessage.group_id)
-            .all()
+            .join(unread, true())
         )
-        group_counts = {str(group_id): count for group_id, count in group_unread}
-    else:
-        group_counts = {}
+        group_counts = {str(group_id): count for group_id, count in group_unread if count}
 
     return {"direct": direct_counts, "groups": group_counts}
 
+
+async def get_unread_counts(db: AsyncSession, user_id: int, token: str):
+    # 🔹 Buscar grupos do utilizador ao group-service
+    groups = await get_user_groups(user_id, token)
+    group_ids = [g["id"] for g in groups]
+    return await _count_unread(db, user_id, group_ids)
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    q: str,
+    token: str,
+    group_ids,
+    with_user: int | None = None,
+    group_id: int | None = None,
+    scope: str = "all",
+    sort: str = "recent",
+    cursor: str | None = None,
+    limit: int = search.DEFAULT_SEARCH_LIMIT,
+):
+    conversation_id = direct_conversation_id(user_id, with_user) if with_user is not None else None
+    if group_id is not None:
+        group_ids = {group_id} & set(group_ids)
+
+    rows, next_cursor = await search.search(
+        db, q, user_id, group_ids,
+        conversation_id=conversation_id,
+        include_direct=scope in ("all", "direct") and group_id is None,
+        include_groups=scope in ("all", "group") and with_user is None,
+        sort=sort,
+        cursor=cursor,
+        limit=limit,
+    )
+
+    users = await get_users_info(
+        {r["sender_id"] for r in rows} | {r["receiver_id"] for r in rows}, token
+    )
+
+    results = []
+    for r in rows:
+        item = {
+            "id": r["id"],
+            "chat_type": "direct" if r["kind"] == search.DIRECT else "group",
+            "from": users[r["sender_id"]]["username"],
+            "content": r["content"],
+            "snippet": r["snippet"],
+            "rank": r["rank"],
+            "image_url": r["image_url"],
+            "timestamp": r["timestamp"].replace(tzinfo=timezone.utc).isoformat(),
+        }
+        if r["kind"] == search.DIRECT:
+            item["to"] = users[r["receiver_id"]]["username"]
+        else:
+            item["group_id"] = r["group_id"]
+        results.append(item)
+
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def _sync_message(m, chat_type: str, users, variants) -> dict:
+    item = {
+        "id": m.id,
+        "chat_type": chat_type,
+        "from": users[m.sender_id]["username"],
+        "content": m.content,
+        "image_url": m.image_url,
+        "timestamp": m.timestamp.replace(tzinfo=timezone.utc).isoformat(),
+    }
+    if chat_type == "direct":
+        item["to"] = users[m.receiver_id]["username"] if m.receiver_id else None
+    else:
+        item["group_id"] = m.group_id
+    if m.image_url in variants:
+        item["image_variants"] = variants[m.image_url]
+    if m.was_reply:
+        item["reply_to"] = _reply_dict(m.reply_to, users)
+    return item
+
+
+async def _load_by_ids(db: AsyncSession, model, chat_type: str, ids):
+    if not ids:
+        return []
+    key = model.conversation_id if model is models.Message else model.group_id
+    result = await db.execute(
+        select(model)
+        .options(joinedload(model.reply_to))
+        .where(model.id.in_(ids), model.id > visible_after(model, chat_type, key))
+        .order_by(model.id)
+    )
+    return result.scalars().all()
+
+
+async def sync_changes(
+    db: AsyncSession,
+    user_id: int,
+    token: str,
+    group_ids,
+    since: str | None = None,
+    limit: int = changelog.SYNC_MAX_CHANGES,
+):
+    """
+    Delta desde o cursor (GET /sync): mensagens novas, apagadas, conversas apagadas e
+    watermarks de leitura em todas as conversas do user. O custo depende só do que
+    mudou desde o cursor, não do tamanho do histórico.
+    reset=True → cursor em falta/expirado: o cliente recarrega tudo e continua do novo cursor.
+    """
+    head, snapshot, now = await changelog.read_head(db)
+    position = changelog.decode_cursor(since) if since else None
+    retention = datetime.utcnow() - timedelta(days=changelog.CHANGE_LOG_RETENTION_DAYS)
+    if position is None or position[2] < retention or position[0] > head:
+        return {
+            "reset": True,
+            "cursor": changelog.encode_cursor(head, snapshot, now),
+            "has_more": False,
+            "messages": [],
+            "deleted_messages": [],
+            "deleted_conversations": [],
+            "read_state": [],
+        }
+
+    late, changes = await changelog.load_changes(db, user_id, group_ids, position[0], position[1], head, snapshot, limit)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # tudo o que snapshot vê até ao id do cursor foi entregue (as atrasadas incluídas)
+    cursor = changelog.encode_cursor(changes[-1].id if has_more else head, snapshot, now)
+    changes = late + changes
+
+    new_ids = {"direct": [], "group": []}
+    deleted_messages, deleted_conversations, read_state = [], [], {}
+    for c in changes:
+        if c.chat_type == "direct":
+            scope = {"with_user": c.user_high if c.user_low == user_id else c.user_low}
+        else:
+            scope = {"group_id": c.group_id}
+
+        if c.kind == "message":
+            new_ids[c.chat_type].append(c.message_id)
+        elif c.kind == "message_deleted":
+            deleted_messages.append({"id": c.message_id, "chat_type": c.chat_type, **scope})
+        elif c.kind == "conversation_deleted":
+            # tudo até cutoff_id (inclusive) desapareceu da conversa
+            deleted_conversations.append({"chat_type": c.chat_type, "cutoff_id": c.message_id, **scope})
+        elif c.kind == "read":
+            key = (c.chat_type, *scope.values())
+            previous = read_state.get(key)
+            if previous is None or c.message_id > previous["last_read_message_id"]:
+                read_state[key] = {"chat_type": c.chat_type, "last_read_message_id": c.message_id, **scope}
+
+    # apagadas entretanto (ou escondidas por um tombstone) já não voltam
+    direct = await _load_by_ids(db, models.Message, "direct", new_ids["direct"])
+    groups = await _load_by_ids(db, models.GroupMessage, "group", new_ids["group"])
+    messages = direct + groups
+
+    user_ids = {m.sender_id for m in messages} | {m.receiver_id for m in direct}
+    user_ids |= {m.reply_to.sender_id for m in messages if m.reply_to}
+    users = await get_users_info(user_ids, token)
+    variants = await media.load_variants(db, {m.image_url for m in messages if m.image_url})
+
+    result = [_sync_message(m, "direct", users, variants) for m in direct]
+    result += [_sync_message(m, "group", users, variants) for m in groups]
+    result.sort(key=lambda item: item["timestamp"])
+
+    return {
+        "reset": False,
+        "cursor": cursor,
+        "has_more": has_more,
+        "messages": result,
+        "deleted_messages": deleted_messages,
+        "deleted_conversations": deleted_conversations,
+        "read_state": list(read_state.values()),
+    }
+
+
 #def delete_direct_conversation(db: Session, user1_id: int, user2_id: int):
 #    db.query(models.Message).filter(
 #        ((models.Message.sender_id == user1_id) & (models.Message.receiver_id == user2_id)) |
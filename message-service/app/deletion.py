@@ -0,0 +1,138 @@
+import asyncio
+import os
+from datetime import datetime
+from sqlalchemy import select, delete, func, cast, String
+from sqlalchemy.orm import Session
+from . import models, media, changelog
+from .db import run_db, SessionLocal
+
+# linhas apagadas por transação (locks curtos, sem statement timeouts)
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "5000"))
+# pausa entre batches para não competir com o tráfego normal
+DELETE_BATCH_PAUSE_MS = float(os.getenv("DELETE_BATCH_PAUSE_MS", "10"))
+
+# tarefas em curso (referência forte para não serem recolhidas pelo GC)
+_jobs: set[asyncio.Task] = set()
+
+
+def _scope(chat_type: str, conversation_key: str):
+    """(modelo, filtro) das mensagens de uma conversa"""
+    if chat_type == "direct":
+        return models.Message, models.Message.conversation_id == conversation_key
+    return models.GroupMessage, models.GroupMessage.group_id == int(conversation_key)
+
+
+def visible_after(db_model, chat_type: str, key_column):
+    """
+    Subquery correlacionada com o cutoff do tombstone mais recente da conversa
+    (0 se nunca foi apagada). Usar como filtro: db_model.id > visible_after(...).
+    db_model é o FROM de fora a que key_column pertence (modelo ou subquery).
+    """
+    if chat_type == "group":
+        key_column = cast(key_column, String)
+    return (
+        select(func.coalesce(func.max(models.ConversationDeletion.cutoff_id), 0))
+        .where(
+            models.ConversationDeletion.chat_type == chat_type,
+            models.ConversationDeletion.conversation_key == key_column,
+        )
+        .correlate(db_model)
+        .scalar_subquery()
+    )
+
+
+def create_tombstone(db: Session, chat_type: str, conversation_key: str):
+    """Regista o pedido de apagar. Devolve o job ou None se a conversa já estiver vazia."""
+    model, scope = _scope(chat_type, conversation_key)
+    previous = visible_after(model, chat_type, conversation_key)
+    cutoff, total = db.execute(
+        select(func.max(model.id), func.count(model.id)).where(scope, model.id > previous)
+    ).one()
+    if cutoff is None:
+        return None
+
+    job = models.ConversationDeletion(
+        chat_type=chat_type,
+        conversation_key=conversation_key,
+        cutoff_id=cutoff,
+        total=total,
+    )
+    db.add(job)
+    changelog.record_conversation_deleted(db, chat_type, conversation_key, cutoff)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _delete_batch(db: Session, job_id: int) -> int:
+    job = db.get(models.ConversationDeletion, job_id)
+    model, scope = _scope(job.chat_type, job.conversation_key)
+
+    ids = (
+        select(model.id)
+        .where(scope, model.id <= job.cutoff_id)
+        .order_by(model.id)
+        .limit(DELETE_BATCH_SIZE)
+        .scalar_subquery()
+    )
+    image_urls = db.execute(
+        delete(model).where(model.id.in_(ids)).returning(model.image_url)
+    ).scalars().all()
+    count = len(image_urls)
+    orphaned = media.release_urls_sync(db, image_urls)
+
+    job.deleted += count
+    job.status = "running" if count else "done"
+    if not count:
+        job.finished_at = datetime.utcnow()
+    db.commit()
+    media.delete_blobs(orphaned)
+    return count
+
+
+def _mark_failed(db: Session, job_id: int):
+    job = db.get(models.ConversationDeletion, job_id)
+    job.status = "failed"
+    job.finished_at = datetime.utcnow()
+    db.commit()
+
+
+async def run_job(job_id: int):
+    try:
+        while await run_db(_delete_batch, job_id):
+            await asyncio.sleep(DELETE_BATCH_PAUSE_MS / 1000)
+        print(f"🗑️ Job de remoção {job_id} concluído")
+    except asyncio.CancelledError:
+        raise  # fica pending/running e é retomado no próximo arranque
+    except Exception as e:
+        print(f"❌ Job de remoção {job_id} falhou: {e}")
+        await run_db(_mark_failed, job_id)
+
+
+def start_job(job_id: int):
+    task = asyncio.create_task(run_job(job_id))
+    _jobs.add(task)
+    task.add_done_callback(_jobs.discard)
+
+
+def resume_jobs():
+    """Retoma jobs interrompidos (ex.: restart a meio). O DELETE é idempotente."""
+    db = SessionLocal()
+    try:
+        pending = db.execute(
+            select(models.ConversationDeletion.id)
+            .where(models.ConversationDeletion.status.in_(("pending", "running")))
+        ).scalars().all()
+    finally:
+        db.close()
+    for job_id in pending:
+        start_job(job_id)
+
+
+def stop_jobs():
+    for task in list(_jobs):
+        task.cancel()
+
+
+def get_job(db: Session, job_id: int):
+    return db.get(models.ConversationDeletion, job_id)
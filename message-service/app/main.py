@@ -1,18 +1,27 @@
-from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, HTTPException, Query
 from sqlalchemy.orm import Session
-from . import models, crud
-from .db import engine, SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, crud, migrations, write_batcher, deletion, partitions, media, thumbnails, media_server, uploads, schemas, changelog
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from .changelog import SYNC_MAX_CHANGES
+from .db import engine, async_engine, SessionLocal, AsyncSessionLocal, run_db
 from .websocket import manager
+from .membership import membership
+from .typing_state import typing_state
 from fastapi.middleware.cors import CORSMiddleware
-import asyncio, json
+import asyncio
+from .serialization import dumps, loads, json_response, ORJSONResponse
 from datetime import datetime, timezone
 from .auth import verify_token
+from .http_client import close_client
+from .storage import storage, UPLOAD_DIR, TooLarge
+from .uploads import ALLOWED_MIME, MAX_BYTES
+from contextlib import asynccontextmanager
 from jose import jwt, JWTError
-import requests
 
-import os, uuid
+import os
 from fastapi import File, UploadFile, Request
-from fastapi.staticfiles import StaticFiles
 
 # --- Prometheus Metrics ---
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
@@ -20,7 +29,37 @@ from starlette.responses import Response
 import time
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # pub/sub entre réplicas (BROKER_URL); sem broker, entrega local
+    await manager.start()
+    # réplica dos membros dos grupos (arranque + resync periódico)
+    resync_task = asyncio.create_task(membership.run_resync_loop())
+    # expiração dos indicadores de "a escrever"
+    typing_task = asyncio.create_task(typing_state.run_expiry_loop())
+    # jobs de remoção de conversas interrompidos por um restart
+    deletion.resume_jobs()
+    # partições mensais futuras + retenção (MESSAGE_RETENTION_MONTHS)
+    partitions_task = asyncio.create_task(partitions.run_maintenance_loop(engine))
+    # uploads resumíveis abandonados
+    uploads_task = asyncio.create_task(uploads.run_cleanup_loop())
+    # retenção do change_log (GET /sync)
+    changelog_task = asyncio.create_task(changelog.run_prune_loop())
+    yield
+    changelog_task.cancel()
+    uploads_task.cancel()
+    partitions_task.cancel()
+    deletion.stop_jobs()
+    typing_task.cancel()
+    resync_task.cancel()
+    await write_batcher.close()
+    thumbnails.close()
+    await manager.close()
+    await close_client()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # --- Define Prometheus metrics ---
@@ -57,12 +96,12 @@ async def prometheus_middleware(request, call_next):
     return response
 
 
-# === File uploads (simple local storage) ===
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# === File uploads (content-addressed, ver storage.py / media.py) ===
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Serve static files from /uploads → available at /uploads/<filename>
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# GET /uploads/<key> com cache immutable, ETag e Range. Com MEDIA_BASE_URL os URLs novos
+# apontam para um processo só de media; esta rota fica para os URLs antigos.
+app.include_router(media_server.router)
 
 
 
@@ -73,6 +112,8 @@ ALGORITHM = "HS256"
 
 # Create tables
 models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
+partitions.run_maintenance(engine)
 
 # DB session dependency
 def get_db():
@@ -82,15 +123,29 @@ def get_db():
     finally:
         db.close()
 
+
+# Sessão async (asyncpg) para as rotas mais usadas
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 @app.get("/")
 def read_root():
     return {"message": "Hello from FastAPI 🚀 with DB + WebSockets"}
 
 
 @app.get("/messages/{user1}/{user2}")
-def get_conversation(user1: int, user2: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+async def get_conversation(
+    user1: int,
+    user2: int,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+    token_data: dict = Depends(verify_token),
+):
     token = token_data.get("token")
-    return crud.get_conversation(db, user1, user2, token)
+    return json_response(await crud.get_conversation(db, user1, user2, token, before=before, after=after, limit=limit))
 
 
 @app.delete("/messages/{message_id}")
@@ -112,9 +167,11 @@ async def delete_message(
     }
 
     db.delete(msg)
+    changelog.record_message_deleted(db, "direct", msg)
     db.commit()
 
-    await manager.send_to_users([msg.sender_id, msg.receiver_id], json.dumps(payload))
+    await manager.send_to_users([msg.sender_id, msg.receiver_id], dumps(payload))
+    await media.release_urls([msg.image_url])
 
     return {"status": "deleted"}
 
@@ -136,15 +193,17 @@ async def delete_group_message(message_id: int, db: Session = Depends(get_db), t
     }
 
     db.delete(msg)
+    changelog.record_message_deleted(db, "group", msg)
     db.commit()
 
-    await manager.send_to_group(db, msg.group_id, json.dumps(payload), token_data.get("token"))
+    await manager.send_to_group(msg.group_id, dumps(payload))
+    await media.release_urls([msg.image_url])
 
     return {"status": "deleted"}
 
 
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, user_id: int):
     token = websocket.query_params.get("token")
     if not token:
         await websocket.close(code=1008)
@@ -161,18 +220,24 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
         return
     
     
-    await manager.connect(websocket, user_id)
+    # tudo o que vem depois do connect fica dentro do try: qualquer saída
+    # (erro incluído) passa pelo finally e liberta a sessão, a tarefa de
+    # escrita e a subscrição no broker
+    username = None
+    try:
+        await manager.connect(websocket, user_id)
 
-    # Buscar user info no user-service
-    user_info = crud.get_user_info(user_id, token)
-    if not user_info or user_info.get("username") == "Unknown":
-        await websocket.close()
-        return
-    username = user_info["username"]
+        # Buscar user info no user-service
+        user_info = await crud.get_user_info(user_id, token)
+        if not user_info or user_info.get("username") == "Unknown":
+            await websocket.close()
+            return
+        username = user_info["username"]
+        # base dos URLs de /upload neste host (ws[s]:// → http[s]://), para validar image_url
+        media_base = "http" + str(websocket.base_url).rstrip("/")[2:]
 
-    try:
         while True:
-            data = await websocket.receive_json()
+            data = loads(await websocket.receive_text())
             msg_type = data.get("type")
             content = data.get("content")
 
@@ -180,7 +245,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
 
             if msg_type == "direct":
                 to_id = data.get("to")
-                receiver = crud.get_user_info(to_id, token)
+                receiver = await crud.get_user_info(to_id, token)
                 if not receiver:
                     await websocket.send_json(f"User {to_id} not found")
                     continue
@@ -189,10 +254,13 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
                 reply_to = data.get("reply_to")
                 reply_to_id = reply_to.get("id") if reply_to else None
                 image_url = data.get("image_url")
+                if image_url and not await media.check_image_url(image_url, user_id, media_base):
+                    await websocket.send_json("Invalid image_url")
+                    continue
 
                 # save message in DB
-                save = crud.save_message(
-                    db,
+                # sessão curta por evento, fora do event loop (ou em batch, ver write_batcher)
+                message_id = await write_batcher.save_message(
                     sender_id=user_id,
                     receiver_id=receiver["id"],
                     content=content,
@@ -202,7 +270,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
 
                 # build broadcast payload
                 message_payload = {
-                    "id": save.id,
+                    "id": message_id,
                     "type": "direct",
                     "from": username,
                     "to": receiver["username"],
@@ -220,8 +288,12 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
 
                 if image_url:
                     message_payload["image_url"] = image_url
+                    image_variants = await media.variants_for_url(image_url)
+                    if image_variants:
+                        message_payload["image_variants"] = image_variants
 
-                await manager.send_to_users([user_id, to_id], json.dumps(message_payload))
+                await manager.send_to_users([user_id, to_id], dumps(message_payload))
+                await typing_state.stop(user_id, "direct", to_id)
 
 
             elif msg_type == "group":
@@ -229,10 +301,11 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
                 reply_to = data.get("reply_to")
                 reply_to_id = reply_to.get("id") if reply_to else None
                 image_url = data.get("image_url")
+                if image_url and not await media.check_image_url(image_url, user_id, media_base):
+                    await websocket.send_json("Invalid image_url")
+                    continue
 
-                save = crud.save_group_message(
-                    db,
-                    token,
+                message_id = await write_batcher.save_group_message(
                     sender_id=user_id,
                     group_id=group_id,
                     content=content,
@@ -241,7 +314,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
                 )
 
                 message_payload = {
-                    "id": save.id,
+                    "id": message_id,
                     "type": "group",
                     "from": username,
                     "group": group_id,
@@ -258,115 +331,119 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
 
                 if image_url:
                     message_payload["image_url"] = image_url
+                    image_variants = await media.variants_for_url(image_url)
+                    if image_variants:
+                        message_payload["image_variants"] = image_variants
 
-                await manager.send_to_group(db, group_id, json.dumps(message_payload), token)
+                await manager.send_to_group(group_id, dumps(message_payload))
+                await typing_state.stop(user_id, "group", group_id)
 
+            # typing: só mudanças de estado chegam aos clientes (ver typing_state)
             elif msg_type == "typing":
                 to_id = data.get("to")
                 if to_id:
-                    await manager.send_to_user(to_id, json.dumps({
-                        "type": "typing",
-                        "from_user_id": user_id,
-                        "from_username": username
-                    }))
+                    await typing_state.start(user_id, username, "direct", to_id)
 
             elif msg_type == "stop_typing":
                 to_id = data.get("to")
                 if to_id:
-                    await manager.send_to_user(to_id, json.dumps({
-                        "type": "stop_typing",
-                        "from_user_id": user_id
-                    }))
+                    await typing_state.stop(user_id, "direct", to_id)
 
             elif msg_type == "group_typing":
                 group_id = data.get("group")
                 if group_id:
-                    members = crud.get_group_members_ids(db, group_id, token)
-                    for member_id in members:
-                        if member_id != user_id:
-                            await manager.send_to_user(member_id, json.dumps({
-                                "type": "group_typing",
-                                "group_id": group_id,
-                                "from_user_id": user_id,
-                                "from_username": username
-                            }))
+                    await typing_state.start(user_id, username, "group", group_id)
 
             elif msg_type == "group_stop_typing":
-                print(f"🛑 {username} stopped typing in group {data.get('group')}")
                 group_id = data.get("group")
                 if group_id:
-                    members = crud.get_group_members_ids(db, group_id, token)
-                    for m_id in members:
-                        if m_id != user_id:
-                            await manager.send_to_user(m_id, json.dumps({
-                                "type": "group_stop_typing",
-                                "from_user_id": user_id,
-                                "from_username": username,
-                                "group_id": group_id
-                            }))
+                    await typing_state.stop(user_id, "group", group_id)
 
 
 
     except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Erro na ligação WS do user {user_id}: {e}")
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass  # o socket já pode estar fechado
+    finally:
         manager.disconnect(websocket)
-        await manager.broadcast(json.dumps({
-            "type": "status",
-            "message": f"{username} left the chat"
-        }))
+        if username is not None:
+            if not manager.registry.is_online(user_id):
+                await typing_state.stop_all(user_id)
+            await manager.broadcast(dumps({
+                "type": "status",
+                "message": f"{username} left the chat"
+            }))
 
 @app.get("/group_messages/{group_id}")
-def get_group_msgs(group_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+async def get_group_msgs(
+    group_id: int,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+    token_data: dict = Depends(verify_token),
+):
     token = token_data.get("token")
-    return crud.get_group_messages(db, group_id, token)
+    return json_response(await crud.get_group_messages(db, group_id, token, before=before, after=after, limit=limit))
+
+@app.get("/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    scope: str = Query("all", pattern="^(all|direct|group)$"),
+    sort: str = Query("recent", pattern="^(recent|relevance)$"),
+    with_user: int | None = None,
+    group_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    token_data: dict = Depends(verify_token),
+):
+    # só o próprio user: os grupos vêm da réplica local de membros (índice inverso)
+    if "sub" not in token_data:
+        raise HTTPException(status_code=403, detail="Search requires a user token")
+    user_id = int(token_data["sub"])
+    group_ids = membership.groups_for(user_id)
+    if group_id is not None and group_id not in group_ids:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+
+    return json_response(await crud.search_messages(
+        db, user_id, q, token_data.get("token"), group_ids,
+        with_user=with_user, group_id=group_id, scope=scope, sort=sort, cursor=cursor, limit=limit,
+    ))
+
+
+@app.get("/sync")
+async def sync(
+    since: str | None = None,
+    limit: int = Query(SYNC_MAX_CHANGES, ge=1, le=SYNC_MAX_CHANGES),
+    db: AsyncSession = Depends(get_async_db),
+    token_data: dict = Depends(verify_token),
+):
+    # reconexão: só o que mudou desde o último cursor (sem since → reset + cursor atual)
+    if "sub" not in token_data:
+        raise HTTPException(status_code=403, detail="Sync requires a user token")
+    user_id = int(token_data["sub"])
+    return json_response(await crud.sync_changes(
+        db, user_id, token_data.get("token"), membership.groups_for(user_id), since=since, limit=limit,
+    ))
+
 
 @app.get("/conversations/{user_id}")
-def list_conversations(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    # 🔹 Buscar todos os users ao user-service
-    try:
-        token = token_data.get("token")
-        headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(f"{crud.USER_SERVICE_URL}/users", headers=headers)
-        all_users = res.json() if res.status_code == 200 else []
-    except Exception as e:
-        print(f"Erro ao contactar user-service: {e}")
-        all_users = []
-
-    # 🔹 Direct chats (exclui o próprio user)
-    user_data = []
-    for u in all_users:
-        if u["id"] == user_id:
-            continue
-        last_msg = crud.get_last_message_between(db, user_id, u["id"])
-        user_data.append({
-            "id": u["id"],
-            "username": u["username"],
-            "last_message": last_msg.content if last_msg else None,
-            "last_timestamp": last_msg.timestamp if last_msg else None,
-        })
-
-    # 🔹 Groups (a DB local ainda sabe quais grupos ele pertence)
-    groups = crud.get_user_groups(user_id, token)
-    group_data = []
-    for g in groups:
-        last_msg = crud.get_last_group_message(db, g["id"])
-        group_data.append({
-            "id": g["id"],
-            "name": g["name"],
-            "last_message": (
-                f"{crud.get_user_info(last_msg.sender_id, token)['username']}: {last_msg.content}"
-                if last_msg else None
-            ),
-            "last_timestamp": last_msg.timestamp if last_msg else None,
-        })
-
-    return {"users": user_data, "groups": group_data}
+async def list_conversations(user_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    token = token_data.get("token")
+    return json_response(await crud.get_inbox(db, user_id, token))
 
 
 
 @app.get("/conversations/{user_id}/unread")
-def get_unread(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+async def get_unread(user_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
     token = token_data.get("token")
-    return crud.get_unread_counts(db, user_id, token)
+    return json_response(await crud.get_unread_counts(db, user_id, token))
 
 @app.post("/conversations/{user_id}/read/{other_id}")
 def mark_direct_as_read(user_id: int, other_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
@@ -379,62 +456,56 @@ def mark_group_as_read(user_id: int, group_id: int, db: Session = Depends(get_db
     return {"status": "ok"}
 
 @app.delete("/conversations/{user1_id}/{user2_id}")
-async def delete_direct_conversation(user1_id: int, user2_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    messages = (
-        db.query(models.Message)
-        .filter(
-            ((models.Message.sender_id == user1_id) & (models.Message.receiver_id == user2_id)) |
-            ((models.Message.sender_id == user2_id) & (models.Message.receiver_id == user1_id))
-        )
-        .all()
-    )
-
-    if not messages:
+async def delete_direct_conversation(user1_id: int, user2_id: int, token_data: dict = Depends(verify_token)):
+    # tombstone já esconde a conversa; as linhas são apagadas em background, em batches
+    job = await run_db(deletion.create_tombstone, "direct", crud.direct_conversation_id(user1_id, user2_id))
+    if not job:
         raise HTTPException(status_code=404, detail="No messages found in this conversation")
 
-    for msg in messages:
-        db.delete(msg)
-    db.commit()
-
     # broadcast para todos os sockets → conversa apagada
-    await manager.send_to_users([user1_id, user2_id], json.dumps({
+    await manager.send_to_users([user1_id, user2_id], dumps({
         "type": "conversation_deleted",
         "chat_type": "direct",
         "user1": user1_id,
         "user2": user2_id
     }))
 
-    return {"status": "deleted"}
+    deletion.start_job(job.id)
+    return {"status": "deleted", "job_id": job.id}
 
 @app.delete("/group_conversations/{group_id}")
-async def delete_group_conversation(group_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+async def delete_group_conversation(group_id: int, token_data: dict = Depends(verify_token)):
 
-    messages = db.query(models.GroupMessage).filter(models.GroupMessage.group_id == group_id).all()
-
-    if not messages:
+    job = await run_db(deletion.create_tombstone, "group", str(group_id))
+    if not job:
         raise HTTPException(status_code=404, detail="No messages found in this group")
 
-    for msg in messages:
-        db.delete(msg)
-    db.commit()
-
-    await manager.send_to_group(db, group_id, json.dumps({
+    await manager.send_to_group(group_id, dumps({
         "type": "conversation_deleted",
         "chat_type": "group",
         "group_id": group_id
-    }), token_data.get("token"))
+    }))
 
-    return {"status": "deleted"}
+    deletion.start_job(job.id)
+    return {"status": "deleted", "job_id": job.id}
+
+@app.get("/deletions/{job_id}")
+def deletion_progress(job_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+    job = deletion.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return {
+        "id": job.id,
+        "chat_type": job.chat_type,
+        "status": job.status,
+        "total": job.total,
+        "deleted": job.deleted,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
 
 
 
-ALLOWED_MIME = {
-    "image/jpeg": ".jpg",
-    "image/png": ".png",
-    "image/webp": ".webp",
-    "image/gif": ".gif",
-}
-MAX_BYTES = 10 * 1024 * 1024  # 10 MB
 
 @app.post("/upload")
 async def upload_image(
@@ -447,37 +518,104 @@ async def upload_image(
     if not ext:
         raise HTTPException(status_code=400, detail="Only images (jpg, png, webp, gif) are allowed.")
 
-    # 2) Nome seguro
-    filename = f"{uuid.uuid4().hex}{ext}"
-    dest_path = os.path.join(UPLOAD_DIR, filename)
-
-    # 3) Guardar com limite de tamanho
-    size = 0
+    # 2) Guardar pelo hash do conteúdo (duplicados só incrementam o refcount)
     try:
-        with open(dest_path, "wb") as out:
-            while True:
-                chunk = await file.read(1024 * 1024)  # 1MB
-                if not chunk:
-                    break
-                size += len(chunk)
-                if size > MAX_BYTES:
-                    try:
-                        os.remove(dest_path)
-                    except FileNotFoundError:
-                        pass
-                    raise HTTPException(status_code=413, detail="File too large (max 10MB).")
-                out.write(chunk)
+        key = await media.store_upload(file.file, file.content_type, ext, MAX_BYTES, _upload_user(token_data))
+    except TooLarge:
+        raise HTTPException(status_code=413, detail="File too large (max 10MB).")
     finally:
         await file.close()
 
-    # 4) URL pública (ex.: http://localhost:8000/uploads/<filename>)
+    # 3) URL pública (ex.: http://localhost:8000/uploads/ab/cd/<sha256>.png)
     base = str(request.base_url).rstrip("/")
-    url = f"{base}/uploads/{filename}"
+    url = storage.url(key, base)
 
     return {"url": url}
 
 
 
+# === Uploads resumíveis: criar sessão → PUT dos chunks com Upload-Offset → complete ===
+
+def _upload_user(token_data: dict) -> int:
+    if "sub" not in token_data:
+        raise HTTPException(status_code=403, detail="Uploads require a user token")
+    return int(token_data["sub"])
+
+
+async def _load_upload_session(session_id: str, token_data: dict):
+    session = await run_db(uploads.get_session, session_id, _upload_user(token_data))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+def _upload_state(session):
+    return {
+        "id": session.id,
+        "offset": session.offset,
+        "size": session.size,
+        "chunk_size": uploads.UPLOAD_CHUNK_MAX_BYTES,
+        "expires_at": session.expires_at.replace(tzinfo=timezone.utc).isoformat(),
+    }
+
+
+@app.post("/upload/sessions", status_code=201)
+async def create_upload_session(body: schemas.UploadSessionCreate, token_data: dict = Depends(verify_token)):
+    limits = uploads.limits_for(body.content_type)
+    if not limits:
+        raise HTTPException(status_code=400, detail="File type not allowed.")
+    if body.size <= 0 or body.size > limits[1]:
+        raise HTTPException(status_code=413, detail=f"File too large (max {limits[1] // (1024 * 1024)}MB).")
+
+    session = await run_db(
+        uploads.create_session, _upload_user(token_data), body.filename, body.content_type, body.size
+    )
+    return _upload_state(session)
+
+
+@app.get("/upload/sessions/{session_id}")
+async def get_upload_session(session_id: str, token_data: dict = Depends(verify_token)):
+    # para retomar: o cliente continua a partir de "offset"
+    return _upload_state(await _load_upload_session(session_id, token_data))
+
+
+@app.put("/upload/sessions/{session_id}")
+async def put_upload_chunk(session_id: str, request: Request, token_data: dict = Depends(verify_token)):
+    session = await _load_upload_session(session_id, token_data)
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Offset header")
+
+    new_offset = await uploads.write_chunk(session, offset, request.stream())
+    return {"id": session.id, "offset": new_offset, "size": session.size}
+
+
+@app.post("/upload/sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str, request: Request, token_data: dict = Depends(verify_token)):
+    session = await _load_upload_session(session_id, token_data)
+    key = await uploads.finalize(session)
+
+    base = str(request.base_url).rstrip("/")
+    return {"url": storage.url(key, base), "content_type": session.content_type, "size": session.size}
+
+
+@app.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(session_id: str, token_data: dict = Depends(verify_token)):
+    await uploads.abort(await _load_upload_session(session_id, token_data))
+    return {"status": "aborted"}
+
+
+@app.post("/internal/group_events")
+async def group_event(event: dict, token_data: dict = Depends(verify_token)):
+    """Eventos de membros publicados pelo group-service (chegam a uma réplica; o broker leva-os a todas)"""
+    if token_data.get("token") != "INTERNAL":
+        raise HTTPException(status_code=403, detail="Internal endpoint")
+    await manager.publish_membership_event(event)
+    return {"status": "ok"}
+
+
+
 @app.get("/metrics")
 def metrics():
     """Expose Prometheus metrics endpoint"""
@@ -0,0 +1,257 @@
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models, thumbnails
+from .db import run_db
+from .storage import storage, object_key, sha256_from_url, ingest, discard_async
+
+# quanto tempo um envio por WS espera pelas variantes de uma imagem acabada de enviar
+VARIANTS_WAIT_SECONDS = float(os.getenv("VARIANTS_WAIT_SECONDS", "2"))
+# um upload pode ser usado em mensagens durante este tempo; se nunca for enviado, é apagado
+MEDIA_UPLOAD_TTL_HOURS = float(os.getenv("MEDIA_UPLOAD_TTL_HOURS", "24"))
+
+MediaObject = models.MediaObject
+MediaUpload = models.MediaUpload
+
+
+class InvalidMedia(Exception):
+    pass
+
+
+def get_media(db: Session, sha256: str):
+    return db.get(MediaObject, sha256)
+
+
+def register_upload(db: Session, sha256: str, key: str, content_type: str, size: int, user_id: int):
+    """
+    Upload de user_id: cria o objeto (sem referências) no primeiro upload do conteúdo
+    e regista/renova o dono. As referências vêm das mensagens (add_refs).
+    """
+    db.execute(
+        pg_insert(MediaObject)
+        .values(sha256=sha256, key=key, content_type=content_type, size=size, refcount=0)
+        .on_conflict_do_nothing(index_elements=[MediaObject.sha256])
+    )
+    now = datetime.utcnow()
+    db.execute(
+        pg_insert(MediaUpload)
+        .values(sha256=sha256, user_id=user_id, created_at=now)
+        .on_conflict_do_update(index_elements=[MediaUpload.sha256, MediaUpload.user_id], set_={"created_at": now})
+    )
+    db.commit()
+
+
+def _upload_cutoff():
+    return datetime.utcnow() - timedelta(hours=MEDIA_UPLOAD_TTL_HOURS)
+
+
+def _owned_media(db: Session, sha256: str, user_id: int):
+    return db.execute(
+        select(MediaObject)
+        .join(MediaUpload, MediaUpload.sha256 == MediaObject.sha256)
+        .where(
+            MediaObject.sha256 == sha256,
+            MediaUpload.user_id == user_id,
+            MediaUpload.created_at >= _upload_cutoff(),
+        )
+    ).scalar_one_or_none()
+
+
+async def check_image_url(image_url: str, user_id: int, base_url: str) -> bool:
+    """
+    image_url de uma mensagem nova: tem de ser exatamente o URL que este serviço
+    gera (storage.url) para um ficheiro que o próprio user enviou.
+    """
+    sha256 = sha256_from_url(image_url)
+    if not sha256:
+        return False
+    media = await run_db(_owned_media, sha256, user_id)
+    return media is not None and image_url == storage.url(media.key, base_url)
+
+
+def add_refs(db, urls):
+    """
+    +1 referência por mensagem com image_url (sem commit: corre na transação do INSERT).
+    Um ficheiro que já não existe faz falhar o INSERT.
+    """
+    counts = Counter(sha for sha in map(sha256_from_url, urls) if sha)
+    for sha256, n in sorted(counts.items()):
+        found = db.execute(
+            update(MediaObject)
+            .where(MediaObject.sha256 == sha256)
+            .values(refcount=MediaObject.refcount + n)
+            .returning(MediaObject.sha256)
+        ).first()
+        if found is None:
+            raise InvalidMedia(f"Media {sha256} not found")
+
+
+def _orphaned_keys(rows) -> list[str]:
+    keys = []
+    for key, variants in rows:
+        keys.append(key)
+        keys.extend(v["key"] for v in (variants or {}).values())
+    return keys
+
+
+def release(db, sha256s) -> list[str]:
+    """
+    -1 referência por mensagem apagada (sem commit: corre na transação de quem apaga).
+    Devolve as keys que ficaram sem referências nem uploads por usar, a apagar do
+    storage depois do commit.
+    """
+    counts = Counter(sha for sha in sha256s if sha)
+    if not counts:
+        return []
+    for sha256, n in sorted(counts.items()):
+        db.execute(
+            update(MediaObject)
+            .where(MediaObject.sha256 == sha256)
+            .values(refcount=MediaObject.refcount - n)
+        )
+    orphaned = db.execute(
+        delete(MediaObject)
+        .where(
+            MediaObject.sha256.in_(list(counts)),
+            MediaObject.refcount <= 0,
+            ~exists().where(MediaUpload.sha256 == MediaObject.sha256),
+        )
+        .returning(MediaObject.key, MediaObject.variants)
+    ).all()
+    return _orphaned_keys(orphaned)
+
+
+def release_urls_sync(db, urls) -> list[str]:
+    return release(db, [sha256_from_url(url) for url in urls])
+
+
+def delete_blobs(keys):
+    """Versão bloqueante (threads de trabalho, ex.: jobs de remoção)"""
+    for key in keys:
+        try:
+            storage.delete_file(key)
+        except Exception as e:
+            print(f"⚠️ Erro a apagar {key} do storage: {e}")
+
+
+def _release_and_commit(db: Session, urls) -> list[str]:
+    keys = release_urls_sync(db, urls)
+    db.commit()
+    return keys
+
+
+async def release_urls(urls):
+    """Mensagens apagadas → larga as referências e apaga os ficheiros órfãos"""
+    urls = [url for url in urls if sha256_from_url(url)]
+    if not urls:
+        return
+    keys = await run_db(_release_and_commit, urls)
+    for key in keys:
+        try:
+            await storage.delete(key)
+        except Exception as e:
+            print(f"⚠️ Erro a apagar {key} do storage: {e}")
+
+
+def _cleanup_unsent(db: Session) -> list[str]:
+    cutoff = _upload_cutoff()
+    db.execute(delete(MediaUpload).where(MediaUpload.created_at < cutoff))
+    orphaned = db.execute(
+        delete(MediaObject)
+        .where(
+            MediaObject.refcount <= 0,
+            MediaObject.created_at < cutoff,
+            ~exists().where(MediaUpload.sha256 == MediaObject.sha256),
+        )
+        .returning(MediaObject.key, MediaObject.variants)
+    ).all()
+    db.commit()
+    return _orphaned_keys(orphaned)
+
+
+async def cleanup_unsent() -> int:
+    """Uploads expirados que nunca chegaram a uma mensagem → apaga os ficheiros"""
+    keys = await run_db(_cleanup_unsent)
+    for key in keys:
+        try:
+            await storage.delete(key)
+        except Exception as e:
+            print(f"⚠️ Erro a apagar {key} do storage: {e}")
+    return len(keys)
+
+
+async def store_file(tmp_path: str, sha256: str, size: int, content_type: str, ext: str, user_id: int):
+    """
+    Guarda um ficheiro temporário já com hash calculado (fica dono de tmp_path).
+    Se o mesmo conteúdo já existe, só regista o upload (sem escrever nada no storage).
+    As variantes das imagens (thumbnails WebP) são geradas depois, num process pool.
+    Devolve a key do objeto.
+    """
+    key = object_key(sha256, ext)
+    try:
+        existing = await run_db(get_media, sha256)
+        if existing is not None:
+            key = existing.key
+        else:
+            await storage.put(key, tmp_path, content_type)
+        await run_db(register_upload, sha256, key, content_type, size, user_id)
+    except BaseException:
+        await discard_async(tmp_path)
+        raise
+
+    needs_variants = existing is None or existing.variants is None
+    if content_type.startswith("image/") and needs_variants:
+        thumbnails.schedule(sha256, tmp_path)  # fica dono do temporário
+    else:
+        await discard_async(tmp_path)
+    return key
+
+
+async def store_upload(src, content_type: str, ext: str, max_bytes: int, user_id: int):
+    """Upload num só pedido: lê + hash fora do event loop e guarda pelo sha256"""
+    tmp_path, sha256, size = await ingest(src, max_bytes)
+    return await store_file(tmp_path, sha256, size, content_type, ext, user_id)
+
+
+def variants_payload(image_url: str, media) -> dict | None:
+    """image_variants de uma mensagem: mesmas base/URL do original, key da variante"""
+    if media is None or not media.variants or not image_url.endswith(media.key):
+        return None
+    base = image_url[: -len(media.key)]
+    return {
+        name: {"url": base + v["key"], "width": v["width"], "height": v["height"]}
+        for name, v in media.variants.items()
+    }
+
+
+async def load_variants(db: AsyncSession, image_urls) -> dict:
+    """{image_url: image_variants} para um conjunto de mensagens (uma query)"""
+    by_sha = {}
+    for url in image_urls:
+        sha256 = sha256_from_url(url)
+        if sha256:
+            by_sha.setdefault(sha256, []).append(url)
+    if not by_sha:
+        return {}
+
+    result = await db.execute(select(MediaObject).where(MediaObject.sha256.in_(list(by_sha))))
+    variants = {}
+    for media in result.scalars():
+        for url in by_sha[media.sha256]:
+            payload = variants_payload(url, media)
+            if payload:
+                variants[url] = payload
+    return variants
+
+
+async def variants_for_url(image_url: str | None):
+    """Para mensagens novas (WS): espera um pouco se as variantes ainda estão a ser geradas"""
+    sha256 = sha256_from_url(image_url)
+    if not sha256:
+        return None
+    await thumbnails.wait_for(sha256, VARIANTS_WAIT_SECONDS)
+    return variants_payload(image_url, await run_db(get_media, sha256))
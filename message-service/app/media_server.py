@@ -0,0 +1,58 @@
+import mimetypes
+import os
+import re
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from starlette.responses import FileResponse, Response
+from .storage import UPLOAD_DIR
+
+# nomes únicos por conteúdo → podem ficar em cache para sempre
+MEDIA_CACHE_CONTROL = os.getenv("MEDIA_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+# ab/cd/<sha256>[_<variante>].<ext>  (storage.object_key / thumbnails.variant_key)
+_CONTENT_KEY = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}(?:_[a-z0-9]+)?)\.[a-z0-9]+$")
+# uploads antigos: <uuid4 hex>.<ext>
+_LEGACY_KEY = re.compile(r"^([0-9a-f]{32})\.[a-z0-9]+$")
+
+mimetypes.add_type("image/webp", ".webp")  # python < 3.11
+
+router = APIRouter()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # comparação fraca (RFC 9110 §13.1.2): W/"x" equivale a "x"
+    return any(t.removeprefix("W/") == etag for t in tags)
+
+
+@router.api_route("/uploads/{key:path}", methods=["GET", "HEAD"])
+async def serve_media(key: str, request: Request):
+    """
+    Ficheiros enviados com Cache-Control immutable e ETag forte (o próprio hash do conteúdo).
+    If-None-Match → 304; Range/If-Range → 206 (FileResponse). Com um servidor que suporte
+    http.response.pathsend (ex.: granian) o ficheiro segue por sendfile, sem cópias em Python.
+    """
+    match = _CONTENT_KEY.match(key) or _LEGACY_KEY.match(key)
+    if not match:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    etag = f'"{match.group(1)}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = os.path.join(UPLOAD_DIR, key)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+# Processo dedicado (MEDIA_BASE_URL aponta para aqui), ex.:
+#   granian --interface asgi --host 0.0.0.0 --port 8003 app.media_server:app
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+app.include_router(router)
@@ -0,0 +1,134 @@
+import asyncio
+import os
+from .http_client import get_client
+
+GROUP_SERVICE_URL = os.getenv("GROUP_SERVICE_URL")
+# resync completo periódico (apanha grupos cujos eventos se perderam sem haver outros depois)
+MEMBERSHIP_RESYNC_SECONDS = float(os.getenv("MEMBERSHIP_RESYNC_SECONDS", "300"))
+
+
+class MembershipIndex:
+    """
+    Réplica local dos membros de cada grupo (group_id → {user_ids}).
+
+    Carregada no arranque a partir do group-service e mantida pelos eventos
+    que ele publica em /internal/group_events. Cada grupo tem uma versão que
+    o group-service incrementa a cada alteração: se um evento chega com um
+    salto de versão, o grupo é resincronizado.
+
+    Mantém também o índice inverso user_id → {group_ids} (ex.: /search).
+    """
+
+    def __init__(self):
+        self.members: dict[int, set[int]] = {}
+        self.versions: dict[int, int] = {}
+        self.groups: dict[int, set[int]] = {}
+
+    def _add_member(self, group_id: int, user_id: int):
+        self.members.setdefault(group_id, set()).add(user_id)
+        self.groups.setdefault(user_id, set()).add(group_id)
+
+    def _remove_member(self, group_id: int, user_id: int):
+        self.members.get(group_id, set()).discard(user_id)
+        groups = self.groups.get(user_id)
+        if groups is not None:
+            groups.discard(group_id)
+            if not groups:
+                del self.groups[user_id]
+
+    def apply_snapshot(self, group_id: int, version: int, member_ids):
+        if version < self.versions.get(group_id, -1):
+            return
+        old = self.members.get(group_id, set())
+        new = set(member_ids)
+        for user_id in old - new:
+            self._remove_member(group_id, user_id)
+        for user_id in new - old:
+            self._add_member(group_id, user_id)
+        self.members[group_id] = new
+        self.versions[group_id] = version
+
+    def remove_group(self, group_id: int):
+        for user_id in list(self.members.get(group_id, ())):
+            self._remove_member(group_id, user_id)
+        self.members.pop(group_id, None)
+        self.versions.pop(group_id, None)
+
+    def groups_for(self, user_id: int) -> set[int]:
+        return self.groups.get(user_id, set())
+
+    async def get_members(self, group_id: int) -> set[int]:
+        members = self.members.get(group_id)
+        if members is None:
+            await self.resync(group_id)
+            members = self.members.get(group_id, set())
+        return members
+
+    async def apply_event(self, event: dict):
+        event_type = event.get("type")
+        group_id = event["group_id"]
+
+        if event_type == "group_deleted":
+            self.remove_group(group_id)
+            return
+
+        version = event.get("version")
+        if event_type == "group_created":
+            self.apply_snapshot(group_id, version, event.get("member_ids", []))
+            return
+
+        current = self.versions.get(group_id)
+        if current is not None and version <= current:
+            return  # duplicado / atrasado
+        if current is None or version != current + 1:
+            # grupo desconhecido ou eventos perdidos → snapshot
+            await self.resync(group_id)
+            return
+
+        if event_type == "member_added":
+            self._add_member(group_id, event["user_id"])
+        elif event_type in ("member_removed", "group_left"):
+            self._remove_member(group_id, event["user_id"])
+        self.versions[group_id] = version
+
+    async def resync(self, group_id: int):
+        try:
+            headers = {"Authorization": "Bearer INTERNAL"}
+            res = await get_client().get(f"{GROUP_SERVICE_URL}/groups/{group_id}/membership", headers=headers)
+            if res.status_code == 200:
+                snap = res.json()
+                self.apply_snapshot(group_id, snap["version"], snap["member_ids"])
+            elif res.status_code == 404:
+                self.remove_group(group_id)
+            else:
+                print(f"⚠️ Erro a resincronizar grupo {group_id}: {res.status_code}")
+        except Exception as e:
+            print(f"❌ Erro ao contactar group-service: {e}")
+
+    async def load_all(self):
+        try:
+            headers = {"Authorization": "Bearer INTERNAL"}
+            res = await get_client().get(f"{GROUP_SERVICE_URL}/memberships", headers=headers)
+            if res.status_code != 200:
+                print(f"⚠️ Erro a carregar membros dos grupos: {res.status_code}")
+                return
+            snapshots = res.json()
+        except Exception as e:
+            print(f"❌ Erro ao contactar group-service: {e}")
+            return
+
+        seen = set()
+        for snap in snapshots:
+            seen.add(snap["group_id"])
+            self.apply_snapshot(snap["group_id"], snap["version"], snap["member_ids"])
+        for group_id in set(self.members) - seen:
+            self.remove_group(group_id)
+        print(f"👥 Réplica de membros carregada: {len(seen)} grupos")
+
+    async def run_resync_loop(self):
+        while True:
+            await self.load_all()
+            await asyncio.sleep(MEMBERSHIP_RESYNC_SECONDS)
+
+
+membership = MembershipIndex()
@@ -0,0 +1,459 @@
+import os
+import sys
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from .db import Base
+from . import partitions
+
+# lock partilhado entre réplicas para não correrem migrações em simultâneo
+MIGRATIONS_LOCK_ID = 4711
+BACKFILL_BATCH = 10000
+
+
+def add_missing_columns(conn, generated: bool = False):
+    """
+    create_all não altera tabelas existentes → adicionar colunas novas dos models.
+    Colunas geradas (ex.: search_vector) reescrevem a tabela toda sob ACCESS EXCLUSIVE:
+    no arranque só entram em tabelas vazias, as outras ficam para o passo offline
+    (python -m app.migrations columns, com o serviço parado).
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if column.computed is not None and not generated and not _is_empty(conn, table.name):
+                print(
+                    f"⚠️ Coluna gerada {table.name}.{column.name} em falta: "
+                    f"correr `python -m app.migrations columns` com o serviço parado"
+                )
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {ddl}"))
+            print(f"🛠️ Coluna {table.name}.{column.name} adicionada")
+
+
+def _index_valid(conn, name: str):
+    """True / False (CREATE INDEX CONCURRENTLY interrompido) / None se não existir"""
+    return conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"), {"n": name}
+    ).scalar()
+
+
+def _missing_indexes(conn):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if _index_valid(conn, index.name):
+                continue
+            if not {c.name for c in index.columns} <= columns:
+                print(f"⚠️ Índice {index.name} adiado: faltam colunas (python -m app.migrations columns)")
+                continue
+            yield table, index
+
+
+def ensure_indexes(conn):
+    """
+    create_all só cria índices em tabelas novas → criar os que faltam nas existentes.
+    Em tabelas vazias é imediato; nas outras um CREATE INDEX bloqueia as escritas durante
+    o build, por isso ficam para `python -m app.migrations indexes` (CONCURRENTLY).
+    """
+    for table, index in list(_missing_indexes(conn)):
+        if _index_valid(conn, index.name) is None and _is_empty(conn, table.name):
+            index.create(bind=conn)
+        else:
+            print(
+                f"⚠️ Índice {index.name} em falta: correr `python -m app.migrations indexes` "
+                f"(CONCURRENTLY, pode ser com o serviço a correr)"
+            )
+
+
+def _index_sql(index, table: str, name: str, concurrently: bool = False, only: bool = False) -> str:
+    using = index.dialect_options["postgresql"]["using"]
+    return (
+        f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {name} ON {'ONLY ' if only else ''}{table}"
+        f"{f' USING {using}' if using else ''} ({', '.join(c.name for c in index.columns)})"
+    )
+
+
+def _create_index_concurrently(conn, index, table: str, name: str):
+    if _index_valid(conn, name) is False:
+        # sobra de um build interrompido: inválido, não é usado mas atrasa as escritas
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(_index_sql(index, table, name, concurrently=True)))
+
+
+def _child_tables(conn, table: str) -> list[str]:
+    return conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:t)
+        ORDER BY c.relname
+    """), {"t": table}).scalars().all()
+
+
+def build_indexes_concurrently(engine):
+    """
+    Índices em falta em tabelas com dados, sem bloquear escritas:
+
+        python -m app.migrations indexes
+
+    Tabelas particionadas não aceitam CONCURRENTLY: cria-se o índice só no pai (ON ONLY,
+    fica inválido), um CONCURRENTLY por partição e ATTACH de cada um; o do pai fica
+    válido quando todas estiverem ligadas. Interrompido, correr outra vez retoma.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table, index in list(_missing_indexes(conn)):
+            print(f"🛠️ A criar {index.name}")
+            if not partitions.is_partitioned(conn, table.name):
+                _create_index_concurrently(conn, index, table.name, index.name)
+                continue
+            conn.execute(text(_index_sql(index, table.name, index.name, only=True)))
+            suffix = "_".join(c.name for c in index.columns)
+            for child in _child_tables(conn, table.name):
+                child_index = f"{child}_{suffix}_idx"[:63]
+                attached = conn.execute(
+                    text("SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:n))"),
+                    {"n": child_index},
+                ).scalar()
+                if not attached:
+                    _create_index_concurrently(conn, index, child, child_index)
+                    conn.execute(text(f"ALTER INDEX {index.name} ATTACH PARTITION {child_index}"))
+
+
+# --- One-off migrations (correm uma única vez, registadas em schema_migrations) ---
+
+def backfill_conversation_id(conn):
+    """Preenche messages.conversation_id ("low:high") nas mensagens antigas, em lotes"""
+    # índice parcial só com as linhas por preencher: cada lote é um index scan curto
+    # (sem ele, cada lote varria a tabela toda à procura das que faltam)
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_messages_missing_conversation_id
+        ON messages (id) WHERE conversation_id IS NULL AND receiver_id IS NOT NULL
+    """))
+    conn.commit()
+    while True:
+        res = conn.execute(text("""
+            UPDATE messages
+            SET conversation_id = LEAST(sender_id, receiver_id) || ':' || GREATEST(sender_id, receiver_id)
+            WHERE id IN (
+                SELECT id FROM messages
+                WHERE conversation_id IS NULL AND receiver_id IS NOT NULL
+                ORDER BY id
+                LIMIT :batch
+            )
+        """), {"batch": BACKFILL_BATCH})
+        conn.commit()
+        if res.rowcount == 0:
+            break
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_missing_conversation_id"))
+
+
+def drop_pair_index(conn):
+    """Substituído por ix_messages_conversation_ts_id"""
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_pair_ts_id"))
+
+
+def compact_direct_reads(conn):
+    """message_reads (uma linha por mensagem) → direct_read_state (um watermark por conversa)"""
+    if not inspect(conn).has_table("message_reads"):
+        return
+    conn.execute(text("""
+        INSERT INTO direct_read_state (user_id, conversation_id, last_read_message_id, updated_at)
+        SELECT r.user_id, m.conversation_id, MAX(r.message_id), now()
+        FROM message_reads r
+        JOIN messages m ON m.id = r.message_id
+        WHERE r.read AND m.conversation_id IS NOT NULL
+        GROUP BY r.user_id, m.conversation_id
+        ON CONFLICT (user_id, conversation_id) DO UPDATE
+        SET last_read_message_id = GREATEST(direct_read_state.last_read_message_id, EXCLUDED.last_read_message_id)
+    """))
+    conn.execute(text("DROP TABLE message_reads"))
+
+
+def compact_group_reads(conn):
+    """group_message_reads lidas → group_read_state"""
+    if not inspect(conn).has_table("group_message_reads"):
+        return
+    conn.execute(text("""
+        INSERT INTO group_read_state (user_id, group_id, last_read_message_id, updated_at)
+        SELECT r.user_id, m.group_id, MAX(r.message_id), now()
+        FROM group_message_reads r
+        JOIN group_messages m ON m.id = r.message_id
+        WHERE r.read
+        GROUP BY r.user_id, m.group_id
+        ON CONFLICT (user_id, group_id) DO UPDATE
+        SET last_read_message_id = GREATEST(group_read_state.last_read_message_id, EXCLUDED.last_read_message_id)
+    """))
+
+
+def drop_receiver_index(conn):
+    """Substituído por ix_messages_receiver_id_id"""
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_receiver_id"))
+
+
+def drop_group_message_reads(conn):
+    """Já compactada em group_read_state e deixou de ser escrita"""
+    conn.execute(text("DROP TABLE IF EXISTS group_message_reads"))
+
+
+def seed_direct_read_state(conn):
+    """Watermark 0 para cada (destinatário, conversa) sem linha: os unread counts partem dela"""
+    conn.execute(text("""
+        INSERT INTO direct_read_state (user_id, conversation_id, last_read_message_id, updated_at)
+        SELECT DISTINCT receiver_id, conversation_id, 0, now()
+        FROM messages
+        WHERE receiver_id IS NOT NULL AND conversation_id IS NOT NULL
+        ON CONFLICT (user_id, conversation_id) DO NOTHING
+    """))
+
+
+def recount_media_refs(conn):
+    """
+    refcount passa a contar mensagens (antes contava uploads): recalcula-o a partir
+    dos image_url. Ficheiros sem mensagens ficam a 0 e a limpeza de uploads apaga-os.
+    """
+    conn.execute(text("""
+        UPDATE media_objects m
+        SET refcount = COALESCE(r.n, 0)
+        FROM media_objects o
+        LEFT JOIN (
+            SELECT sha256, count(*) AS n
+            FROM (
+                SELECT substring(image_url from '([0-9a-f]{64})[^/]*$') AS sha256 FROM messages WHERE image_url IS NOT NULL
+                UNION ALL
+                SELECT substring(image_url from '([0-9a-f]{64})[^/]*$') FROM group_messages WHERE image_url IS NOT NULL
+            ) refs
+            GROUP BY sha256
+        ) r ON r.sha256 = o.sha256
+        WHERE m.sha256 = o.sha256
+    """))
+
+
+# --- Particionar tabelas existentes (passo offline, ver partition_offline) ---
+
+PARTITION_COPY_BATCH = int(os.getenv("PARTITION_COPY_BATCH", "10000"))
+
+
+def _is_empty(conn, name: str) -> bool:
+    return not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar()
+
+
+def _has_table(conn, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": name}).scalar()
+
+
+def _start_partitioning(conn, table):
+    """Renomeia a tabela antiga para <nome>_old e cria a particionada no lugar dela"""
+    name = table.name
+    old = f"{name}_old"
+
+    # libertar os nomes (índices, FK, sequência) para a tabela nova; a PK fica com
+    # outro nome porque a cópia em lotes percorre a tabela antiga por id
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+    for index in inspect(conn).get_indexes(old):
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+    conn.execute(text(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {name}_reply_to_id_fkey"))
+    if inspect(conn).get_pk_constraint(old).get("name") == f"{name}_pkey":
+        conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {name}_pkey TO {old}_pkey"))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {name}_id_seq RENAME TO {old}_id_seq"))
+
+    table.create(bind=conn)
+
+    # least/greatest ignoram NULLs: timestamps em falta ficam no mês atual
+    first, last = conn.execute(text(f"""
+        SELECT LEAST(min(timestamp), now() AT TIME ZONE 'utc'),
+               GREATEST(max(timestamp), now() AT TIME ZONE 'utc')
+        FROM {old}
+    """)).one()
+    partitions.ensure_partitions(conn, name, first, last)
+    conn.commit()
+
+
+def _copy_batches(conn, table, batch: int = PARTITION_COPY_BATCH):
+    """Copia <nome>_old → <nome> por ordem de id, um lote por transação (retoma onde ficou)"""
+    name = table.name
+    old = f"{name}_old"
+    # colunas geradas (ex.: search_vector) são recalculadas pelo Postgres
+    columns = [c.name for c in table.columns if c.computed is None]
+    selected = ", ".join(
+        "COALESCE(timestamp, now() AT TIME ZONE 'utc')" if c == "timestamp" else c for c in columns
+    )
+
+    last_id = conn.execute(text(f"SELECT COALESCE(max(id), 0) FROM {name}")).scalar()
+    copied = 0
+    while True:
+        ids = conn.execute(text(f"""
+            INSERT INTO {name} ({", ".join(columns)})
+            SELECT {selected} FROM {old}
+            WHERE id > :last_id
+            ORDER BY id
+            LIMIT :batch
+            RETURNING id
+        """), {"last_id": last_id, "batch": batch}).scalars().all()
+        conn.commit()
+        if not ids:
+            break
+        last_id = max(ids)
+        copied += len(ids)
+        print(f"🛠️ {name}: {copied} linhas copiadas (id ≤ {last_id})")
+
+
+def _finish_partitioning(conn, table):
+    name = table.name
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 0) + 1, false)
+        FROM {name}
+    """))
+    conn.execute(text(f"DROP TABLE {name}_old"))
+    conn.commit()
+    print(f"🛠️ Tabela {name} particionada por mês")
+
+
+def _message_tables():
+    from .models import Message, GroupMessage
+    return [Message.__table__, GroupMessage.__table__]
+
+
+def partition_offline(engine, batch: int = PARTITION_COPY_BATCH):
+    """
+    Converte messages / group_messages antigas (com dados) em tabelas particionadas.
+    Passo offline, com o message-service parado:
+
+        python -m app.migrations partition
+
+    A cópia é feita em lotes de PARTITION_COPY_BATCH linhas, cada um na sua transação;
+    se for interrompida, correr o mesmo comando retoma a partir do último id copiado.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        conn.commit()
+        try:
+            for table in _message_tables():
+                if not _has_table(conn, f"{table.name}_old"):
+                    if partitions.is_partitioned(conn, table.name):
+                        continue
+                    _start_partitioning(conn, table)
+                _copy_batches(conn, table, batch)
+                _finish_partitioning(conn, table)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+
+
+def partition_message_tables(conn):
+    """
+    messages / group_messages → RANGE (timestamp) com uma partição por mês.
+    No arranque só se convertem tabelas vazias; com dados fica para o passo offline
+    (partition_offline), para não copiar o histórico todo numa transação de arranque.
+    """
+    for table in _message_tables():
+        if partitions.is_partitioned(conn, table.name):
+            continue
+        if _is_empty(conn, table.name):
+            _start_partitioning(conn, table)
+            _finish_partitioning(conn, table)
+        else:
+            print(
+                f"⚠️ {table.name} tem dados e não está particionada: "
+                f"correr `python -m app.migrations partition` com o serviço parado"
+            )
+
+
+def check_partitioning(conn):
+    """Uma conversão offline interrompida deixa <nome>_old: não arrancar a meio dela"""
+    for table in _message_tables():
+        if _has_table(conn, f"{table.name}_old"):
+            raise RuntimeError(
+                f"{table.name}: particionamento offline incompleto; "
+                f"correr `python -m app.migrations partition` para o terminar"
+            )
+
+
+ONE_OFF_MIGRATIONS = [
+    ("0001_backfill_conversation_id", backfill_conversation_id),
+    ("0002_drop_pair_index", drop_pair_index),
+    ("0003_compact_direct_reads", compact_direct_reads),
+    ("0004_compact_group_reads", compact_group_reads),
+    ("0005_drop_receiver_index", drop_receiver_index),
+    ("0006_drop_group_message_reads", drop_group_message_reads),
+    ("0007_partition_message_tables", partition_message_tables),
+    ("0008_seed_direct_read_state", seed_direct_read_state),
+    ("0009_recount_media_refs", recount_media_refs),
+]
+
+
+def run_one_off_migrations(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """))
+    conn.commit()
+    applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+
+    for name, migration in ONE_OFF_MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"🛠️ A aplicar migração {name}")
+        migration(conn)
+        conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        conn.commit()
+
+
+def run_migrations(engine):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        try:
+            check_partitioning(conn)
+            add_missing_columns(conn)
+            conn.commit()
+            run_one_off_migrations(conn)
+            ensure_indexes(conn)
+            conn.commit()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+
+
+def add_generated_columns(engine):
+    """Passo offline (serviço parado): colunas geradas que o arranque deixou por adicionar"""
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        try:
+            add_missing_columns(conn, generated=True)
+            conn.commit()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            conn.commit()
+
+
+if __name__ == "__main__":
+    # passos de manutenção fora do arranque da app, ex.: python -m app.migrations partition
+    from .db import engine
+
+    if sys.argv[1:] == ["columns"]:
+        add_generated_columns(engine)
+    elif sys.argv[1:] == ["indexes"]:
+        build_indexes_concurrently(engine)
+    elif sys.argv[1:] == ["partition"]:
+        from . import models
+
+        with engine.connect() as conn:
+            resuming = any(_has_table(conn, f"{t.name}_old") for t in _message_tables())
+        if not resuming:
+            # colunas novas e backfills primeiro: a cópia usa o schema atual dos models
+            models.Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
+        partition_offline(engine)
+    else:
+        print("uso: python -m app.migrations columns | indexes | partition")
+        sys.exit(2)
@@ -1,50 +1,186 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, func, Table, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, func, Table, Boolean, Index, Computed, BigInteger
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB
 from sqlalchemy.orm import relationship
 from .db import Base
 from datetime import datetime
 
+# configuração text search: 'simple' não faz stemming (mensagens em PT e EN misturadas)
+SEARCH_CONFIG = "simple"
+SEARCH_VECTOR_SQL = f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))"
+
 class Message(Base):
     __tablename__ = "messages"
 
-    id = Column(Integer, primary_key=True, index=True)
-    sender_id = Column(Integer)
+    # particionada por mês em timestamp (ver partitions.py): a PK tem de incluir a chave de partição
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    sender_id = Column(Integer, index=True)
     receiver_id = Column(Integer, nullable=True)  # null se for grupo
+    # chave normalizada da conversa: "low_user:high_user" (ver crud.direct_conversation_id)
+    conversation_id = Column(String, nullable=True)
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    reply_to_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    # sem FK: numa tabela particionada o id sozinho não é único para o Postgres
+    reply_to_id = Column(Integer, nullable=True)
     was_reply = Column(Boolean, default=False)
     image_url = Column(String, nullable=True)
+    # gerada pelo Postgres a partir do content (pesquisa full-text, ver search.py)
+    search_vector = Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True))
+
+    # mensagem respondida (carregar com joinedload para evitar N+1)
+    reply_to = relationship(
+        "Message",
+        primaryjoin="foreign(Message.reply_to_id) == remote(Message.id)",
+        uselist=False,
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        # histórico, última mensagem e keyset pagination numa só index scan
+        Index("ix_messages_conversation_ts_id", "conversation_id", "timestamp", "id"),
+        # unread counts: range scan por conversa a partir do watermark
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+        Index("ix_messages_receiver_id_id", "receiver_id", "id"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
 
 class GroupMessage(Base):
     __tablename__ = "group_messages"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     sender_id = Column(Integer)
     group_id = Column(Integer)
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    reply_to_id = Column(Integer, ForeignKey("group_messages.id", ondelete="SET NULL"), nullable=True)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    reply_to_id = Column(Integer, nullable=True)
     was_reply = Column(Boolean, default=False)
     image_url = Column(String, nullable=True)
+    search_vector = Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True))
+
+    reply_to = relationship(
+        "GroupMessage",
+        primaryjoin="foreign(GroupMessage.reply_to_id) == remote(GroupMessage.id)",
+        uselist=False,
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        # keyset pagination do histórico de grupo
+        Index("ix_group_messages_group_ts_id", "group_id", "timestamp", "id"),
+        Index("ix_group_messages_group_id_id", "group_id", "id"),
+        Index("ix_group_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+class DirectReadState(Base):
+    """Watermark de leitura: tudo até last_read_message_id nesta conversa foi lido pelo user"""
+    __tablename__ = "direct_read_state"
+    user_id = Column(Integer, primary_key=True)
+    conversation_id = Column(String, primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GroupReadState(Base):
+    __tablename__ = "group_read_state"
+    user_id = Column(Integer, primary_key=True)
+    group_id = Column(Integer, primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ConversationDeletion(Base):
+    """
+    Tombstone de uma conversa apagada + progresso do job que apaga as linhas.
+    As leituras escondem logo tudo com id <= cutoff_id; o DELETE corre em background.
+    """
+    __tablename__ = "conversation_deletions"
+    id = Column(Integer, primary_key=True)
+    chat_type = Column(String, nullable=False)          # "direct" | "group"
+    conversation_key = Column(String, nullable=False)   # "low:high" ou str(group_id)
+    cutoff_id = Column(Integer, nullable=False)         # maior id de mensagem no momento do pedido
+    status = Column(String, nullable=False, default="pending")  # pending | running | done | failed
+    total = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_conversation_deletions_key", "chat_type", "conversation_key", "cutoff_id"),
+    )
+
+
+class MediaObject(Base):
+    """
+    Ficheiro enviado, guardado uma única vez pelo sha256 do conteúdo (ver storage.py).
+    refcount = nº de mensagens com este image_url (+1 no INSERT, -1 ao apagar); a 0 e
+    sem uploads recentes (MediaUpload) o ficheiro é apagado.
+    """
+    __tablename__ = "media_objects"
+    sha256 = Column(String(64), primary_key=True)
+    key = Column(String, nullable=False)            # caminho no backend (ab/cd/<sha256><ext>)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    # variantes WebP geradas em background: {"thumb": {"key", "width", "height"}, ...}
+    variants = Column(JSONB, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MediaUpload(Base):
+    """
+    Quem fez upload de cada ficheiro. Só o dono pode pôr o URL numa mensagem, e só
+    durante MEDIA_UPLOAD_TTL_HOURS; depois disso a linha é limpa e um ficheiro que
+    nunca foi enviado (refcount 0) é apagado.
+    """
+    __tablename__ = "media_uploads"
+    sha256 = Column(String(64), ForeignKey("media_objects.sha256", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_media_uploads_created_at", "created_at"),
+    )
 
 
-class MessageRead(Base):
-    __tablename__ = "message_reads"
-    id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"))
-    user_id = Column(Integer)
-    read = Column(Boolean, default=False)
-    read_at = Column(DateTime, nullable=True)
+class UploadSession(Base):
+    """Upload resumível em curso: os bytes vão para um ficheiro temporário até offset == size"""
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    offset = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
 
-    message = relationship("Message")
 
-class GroupMessageRead(Base):
-    __tablename__ = "group_message_reads"
-    id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("group_messages.id", ondelete="CASCADE"))
-    user_id = Column(Integer)
-    read = Column(Boolean, default=False)
-    read_at = Column(DateTime, nullable=True)
+class ChangeLog(Base):
+    """
+    Log append-only das alterações visíveis aos clientes (ver changelog.py e GET /sync).
+    Diretas: user_low/user_high; grupos: group_id; "read" só interessa a user_id.
+    """
+    __tablename__ = "change_log"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)         # message | message_deleted | conversation_deleted | read
+    chat_type = Column(String, nullable=False)    # direct | group
+    user_low = Column(Integer, nullable=True)
+    user_high = Column(Integer, nullable=True)
+    group_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)      # autor (ou quem leu, em "read")
+    message_id = Column(Integer, nullable=True)   # mensagem / cutoff / watermark
+    created_at = Column(DateTime, nullable=False, server_default=func.timezone("utc", func.now()))
+    # transação que escreveu a linha: /sync compara-a com o snapshot guardado no cursor
+    txid = Column(BigInteger, nullable=False, server_default=func.txid_current())
 
-    message = relationship("GroupMessage")
+    __table_args__ = (
+        Index("ix_change_log_user_low_id", "user_low", "id"),
+        Index("ix_change_log_user_high_id", "user_high", "id"),
+        Index("ix_change_log_group_id_id", "group_id", "id"),
+        Index("ix_change_log_user_id_id", "user_id", "id"),
+        Index("ix_change_log_created_at", "created_at"),
+        Index("ix_change_log_txid", "txid"),
+    )
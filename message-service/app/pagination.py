@@ -0,0 +1,65 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    """Cursor opaco com a chave (timestamp, id) da mensagem"""
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        ts, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def paginate(db, stmt, model, before: str | None = None, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Keyset pagination sobre (timestamp, id), para um select() numa AsyncSession.
+
+    - sem cursor ou com `before`: a página mais recente anterior ao cursor;
+      next_cursor serve como `before` da página seguinte (mais antiga).
+    - com `after`: a página seguinte ao cursor; next_cursor serve como `after`.
+
+    As linhas são sempre devolvidas em ordem cronológica.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    key = tuple_(model.timestamp, model.id)
+
+    # o filtro redundante só em timestamp deixa o planner ignorar as partições fora do intervalo
+    if after:
+        ts, message_id = decode_cursor(after)
+        stmt = stmt.where(model.timestamp >= ts, key > tuple_(ts, message_id))
+        stmt = stmt.order_by(model.timestamp.asc(), model.id.asc())
+    else:
+        if before:
+            ts, message_id = decode_cursor(before)
+            stmt = stmt.where(model.timestamp <= ts, key < tuple_(ts, message_id))
+        stmt = stmt.order_by(model.timestamp.desc(), model.id.desc())
+
+    # +1 para saber se há mais páginas sem um COUNT
+    rows = list((await db.execute(stmt.limit(limit + 1))).scalars().all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if not after:
+        rows.reverse()
+
+    next_cursor = None
+    if has_more and rows:
+        edge = rows[-1] if after else rows[0]
+        next_cursor = encode_cursor(edge.timestamp, edge.id)
+
+    return rows, next_cursor
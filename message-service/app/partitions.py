@@ -0,0 +1,115 @@
+import asyncio
+import os
+import re
+from datetime import date, datetime
+from sqlalchemy import text
+from . import media
+
+# Tabelas de mensagens particionadas por mês (RANGE sobre timestamp, ver models.py)
+PARTITIONED_TABLES = ("messages", "group_messages")
+
+# partições criadas antecipadamente (meses à frente do atual)
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+# meses de histórico mantidos; partições mais antigas são removidas inteiras (0 = guardar tudo)
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", "0"))
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", str(6 * 3600)))
+PARTITIONS_LOCK_ID = 4712
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def month_start(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, months: int) -> date:
+    years, month = divmod(d.month - 1 + months, 12)
+    return date(d.year + years, month + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE relname = :t"), {"t": table}
+    ).scalar() or False
+
+
+def create_partition(conn, table: str, month: date):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+def ensure_partitions(conn, table: str, first: date, last: date):
+    """Cria as partições mensais de first até last (inclusive)"""
+    month, last = month_start(first), month_start(last)
+    while month <= last:
+        create_partition(conn, table, month)
+        month = add_months(month, 1)
+
+
+def list_partitions(conn, table: str) -> list[tuple[str, date]]:
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :t
+    """), {"t": table}).scalars()
+
+    partitions = []
+    for name in rows:
+        match = _PARTITION_SUFFIX.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def drop_expired_partitions(conn, table: str, today: date, retention_months: int = MESSAGE_RETENTION_MONTHS):
+    """Retenção: remove partições inteiras (operação de metadados, sem DELETE em massa)"""
+    if retention_months <= 0:
+        return
+    cutoff = add_months(month_start(today), -retention_months)
+    for name, month in list_partitions(conn, table):
+        if month < cutoff:
+            # os ficheiros enviados nessas mensagens perdem uma referência
+            image_urls = conn.execute(
+                text(f"SELECT image_url FROM {name} WHERE image_url IS NOT NULL")
+            ).scalars().all()
+            orphaned = media.release_urls_sync(conn, image_urls)
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            conn.commit()
+            media.delete_blobs(orphaned)
+            print(f"🧹 Partição {name} removida (retenção de {retention_months} meses)")
+
+
+def run_maintenance(engine):
+    """Garante as partições dos próximos meses e aplica a retenção"""
+    today = datetime.utcnow().date()
+    current = month_start(today)
+    with engine.connect() as conn:
+        # uma réplica de cada vez
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": PARTITIONS_LOCK_ID})
+        try:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(conn, table):
+                    continue
+                ensure_partitions(conn, table, current, add_months(current, PARTITION_PREMAKE_MONTHS))
+                drop_expired_partitions(conn, table, today)
+            conn.commit()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": PARTITIONS_LOCK_ID})
+            conn.commit()
+
+
+async def run_maintenance_loop(engine):
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_SECONDS)
+        try:
+            await asyncio.to_thread(run_maintenance, engine)
+        except Exception as e:
+            print(f"❌ Erro na manutenção das partições: {e}")
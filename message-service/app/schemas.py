@@ -3,4 +3,9 @@ from typing import List
 
 class GroupCreate(BaseModel):
     name: str
-    member_ids: List[int]
\ No newline at end of file
+    member_ids: List[int]
+
+class UploadSessionCreate(BaseModel):
+    filename: str | None = None
+    content_type: str
+    size: int
@@ -0,0 +1,152 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import select, union_all, literal, null, func, cast, tuple_, or_
+from sqlalchemy.dialects.postgresql import REGCONFIG, REAL
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .deletion import visible_after
+from .serialization import dumps, loads
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=2"
+# o ts_headline não escapa o texto: escapamos antes, para o snippet ser HTML seguro (só <mark> é markup)
+HTML_ESCAPES = [("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#39;")]
+
+# tipo de conversa na chave de ordenação (desempate entre as duas tabelas)
+DIRECT, GROUP = 0, 1
+
+
+def encode_search_cursor(key) -> str:
+    raw = dumps([v.isoformat() if isinstance(v, datetime) else v for v in key])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str, sort: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = loads(base64.urlsafe_b64decode(padded.encode()))
+        if sort == "relevance":
+            rank, ts, kind, message_id = key
+            return float(rank), datetime.fromisoformat(ts), int(kind), int(message_id)
+        ts, kind, message_id = key
+        return datetime.fromisoformat(ts), int(kind), int(message_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _html_escape(expr):
+    """Escape HTML em SQL (o & primeiro, para não escapar duas vezes)"""
+    for char, entity in HTML_ESCAPES:
+        expr = func.replace(expr, char, entity)
+    return expr
+
+
+def _branch(model, kind: int, scope, query, sort: str, cursor, limit: int):
+    """Um SELECT por tabela: filtra pelo GIN (@@), aplica o cursor e corta em limit+1"""
+    rank = func.ts_rank(model.search_vector, query)
+    if model is models.Message:
+        extra = [model.receiver_id.label("receiver_id"), null().label("group_id")]
+    else:
+        extra = [null().label("receiver_id"), model.group_id.label("group_id")]
+
+    key = [model.timestamp, literal(kind), model.id]
+    if sort == "relevance":
+        key.insert(0, rank)
+
+    stmt = select(
+        literal(kind).label("kind"),
+        model.id.label("id"),
+        model.timestamp.label("timestamp"),
+        model.sender_id.label("sender_id"),
+        *extra,
+        model.content.label("content"),
+        model.image_url.label("image_url"),
+        rank.label("rank"),
+    ).where(model.search_vector.op("@@")(query), *scope)
+
+    if cursor:
+        values = list(cursor)
+        if sort == "relevance":
+            values[0] = cast(values[0], REAL)
+        else:
+            # limite só em timestamp → partition pruning
+            stmt = stmt.where(model.timestamp <= cursor[0])
+        stmt = stmt.where(tuple_(*key) < tuple_(*values))
+
+    return stmt.order_by(*(k.desc() for k in key)).limit(limit + 1)
+
+
+async def search(
+    db: AsyncSession,
+    text: str,
+    user_id: int,
+    group_ids,
+    conversation_id: str | None = None,
+    include_direct: bool = True,
+    include_groups: bool = True,
+    sort: str = "recent",
+    cursor: str | None = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+):
+    """
+    Pesquisa full-text nas mensagens visíveis para user_id.
+
+    - diretas: enviadas/recebidas pelo user (ou só a conversa conversation_id)
+    - grupos: só os group_ids do user
+    - sort="recent" ordena por (timestamp, id); sort="relevance" por ts_rank primeiro
+
+    Devolve (rows, next_cursor); o snippet (ts_headline) só é calculado para a página
+    e vem em HTML escapado, com os termos encontrados dentro de <mark>.
+    """
+    query = func.websearch_to_tsquery(cast(models.SEARCH_CONFIG, REGCONFIG), text)
+    key = decode_search_cursor(cursor, sort) if cursor else None
+
+    branches = []
+    if include_direct:
+        Message = models.Message
+        if conversation_id:
+            who = Message.conversation_id == conversation_id
+        else:
+            who = or_(Message.sender_id == user_id, Message.receiver_id == user_id)
+        scope = [who, Message.id > visible_after(Message, "direct", Message.conversation_id)]
+        branches.append(_branch(Message, DIRECT, scope, query, sort, key, limit))
+    if include_groups and group_ids:
+        GroupMessage = models.GroupMessage
+        scope = [
+            GroupMessage.group_id.in_(sorted(group_ids)),
+            GroupMessage.id > visible_after(GroupMessage, "group", GroupMessage.group_id),
+        ]
+        branches.append(_branch(GroupMessage, GROUP, scope, query, sort, key, limit))
+    if not branches:
+        return [], None
+
+    # cada ramo já vem ordenado e cortado → o merge final só vê 2 * (limit+1) linhas
+    hits = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery()
+    order = [hits.c.timestamp.desc(), hits.c.kind.desc(), hits.c.id.desc()]
+    if sort == "relevance":
+        order.insert(0, hits.c.rank.desc())
+    page = select(hits).order_by(*order).limit(limit + 1).subquery()
+
+    order = [page.c.timestamp.desc(), page.c.kind.desc(), page.c.id.desc()]
+    if sort == "relevance":
+        order.insert(0, page.c.rank.desc())
+    stmt = select(
+        page,
+        func.ts_headline(cast(models.SEARCH_CONFIG, REGCONFIG), _html_escape(page.c.content), query, HEADLINE_OPTIONS).label("snippet"),
+    ).order_by(*order)
+
+    rows = (await db.execute(stmt)).mappings().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        edge = rows[-1]
+        edge_key = [edge["timestamp"], edge["kind"], edge["id"]]
+        if sort == "relevance":
+            edge_key.insert(0, edge["rank"])
+        next_cursor = encode_search_cursor(edge_key)
+
+    return rows, next_cursor
@@ -0,0 +1,28 @@
+import orjson
+from starlette.responses import JSONResponse
+
+# Camada única de JSON do message-service (orjson): respostas HTTP e frames WebSocket.
+
+
+class ORJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def dumps(obj) -> str:
+    """
+    Codifica um payload WebSocket. Num fan-out chama-se uma vez por evento:
+    o mesmo str é enfileirado em todas as sessões, sem voltar a codificar.
+    """
+    return orjson.dumps(obj).decode()
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+def json_response(content) -> ORJSONResponse:
+    """Resposta já serializada — evita o jsonable_encoder do FastAPI nas listas grandes"""
+    return ORJSONResponse(content)
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from starlette.concurrency import run_in_threadpool
+
+# Backend dos ficheiros enviados: "local" (UPLOAD_DIR) ou "s3" (qualquer serviço compatível, ex.: MinIO)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+S3_BUCKET = os.getenv("S3_BUCKET", "pingu-media")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # vazio = AWS
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+# URL pública dos objetos (CDN / bucket público); por omissão endpoint/bucket
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")
+# origem dos URLs de media locais quando servidos por um processo à parte (ver media_server.py)
+MEDIA_BASE_URL = (os.getenv("MEDIA_BASE_URL") or "").rstrip("/")
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+_SHA256 = re.compile(r"([0-9a-f]{64})")
+
+
+class TooLarge(Exception):
+    pass
+
+
+def object_key(sha256: str, ext: str) -> str:
+    """Chave content-addressed: ab/cd/abcd…<ext> (evita diretórios com milhões de ficheiros)"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def sha256_from_url(url: str | None) -> str | None:
+    """Hash de um image_url gerado por /upload (None para uploads antigos com nome uuid)"""
+    if not url:
+        return None
+    match = _SHA256.search(url.rsplit("/", 1)[-1])
+    return match.group(1) if match else None
+
+
+def spool_and_hash(src, tmp_dir: str, max_bytes: int):
+    """
+    Copia o upload para um ficheiro temporário calculando o sha256 na mesma passagem.
+    Corre numa thread (I/O bloqueante). Devolve (tmp_path, sha256, size).
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise TooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class StorageBackend:
+    """Interface comum: put_file/delete_file são bloqueantes, put/delete correm-nos numa thread"""
+
+    tmp_dir = os.path.join(UPLOAD_DIR, ".tmp")
+
+    def put_file(self, key: str, tmp_path: str, content_type: str):
+        raise NotImplementedError
+
+    def delete_file(self, key: str):
+        raise NotImplementedError
+
+    def url(self, key: str, base_url: str) -> str:
+        raise NotImplementedError
+
+    async def put(self, key: str, tmp_path: str, content_type: str):
+        """Guarda o ficheiro temporário em key (idempotente: o conteúdo é o mesmo). O temporário fica para quem chamou."""
+        await run_in_threadpool(self.put_file, key, tmp_path, content_type)
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self.delete_file, key)
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, ".tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put_file(self, key: str, tmp_path: str, content_type: str):
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # hard link (mesmo filesystem): sem cópia e o temporário continua disponível
+        try:
+            os.link(tmp_path, dest)
+        except FileExistsError:
+            pass  # mesmo conteúdo já guardado por outro pedido
+        except OSError:
+            shutil.copyfile(tmp_path, dest)
+
+    def delete_file(self, key: str):
+        discard(self.path(key))
+
+    def url(self, key: str, base_url: str) -> str:
+        return f"{MEDIA_BASE_URL or base_url}/uploads/{key}"
+
+
+class S3Storage(StorageBackend):
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str | None = S3_ENDPOINT_URL):
+        import boto3  # só é preciso com STORAGE_BACKEND=s3
+
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=S3_REGION)
+        self.public_url = (S3_PUBLIC_URL or f"{endpoint_url or 'https://s3.amazonaws.com'}/{bucket}").rstrip("/")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def put_file(self, key: str, tmp_path: str, content_type: str):
+        self.client.upload_file(
+            tmp_path, self.bucket, key,
+            ExtraArgs={"ContentType": content_type, "CacheControl": "public, max-age=31536000, immutable"},
+        )
+
+    def delete_file(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str, base_url: str) -> str:
+        return f"{self.public_url}/{key}"
+
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "s3":
+        print(f"🪣 Uploads em S3 (bucket {S3_BUCKET})")
+        return S3Storage()
+    return LocalStorage()
+
+
+storage = create_storage()
+
+
+async def ingest(src, max_bytes: int):
+    """Lê + hash do upload fora do event loop → (tmp_path, sha256, size)"""
+    return await run_in_threadpool(spool_and_hash, src, storage.tmp_dir, max_bytes)
+
+
+async def discard_async(path: str):
+    await run_in_threadpool(discard, path)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy.orm import Session
+from . import models
+from .db import run_db
+from .storage import storage, discard_async
+
+# variantes WebP geradas para cada imagem: "nome:lado_máximo,..."
+IMAGE_VARIANTS = os.getenv("IMAGE_VARIANTS", "thumb:256,medium:768")
+VARIANT_SIZES = {
+    name: int(size)
+    for name, size in (item.split(":") for item in IMAGE_VARIANTS.split(",") if item)
+}
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# proteção contra "decompression bombs" (imagem pequena em bytes, enorme em píxeis)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+_pool: ProcessPoolExecutor | None = None
+# sha256 → tarefa em curso (para quem queira esperar pelas variantes, ver wait_for)
+_pending: dict[str, asyncio.Task] = {}
+
+
+def variant_key(sha256: str, name: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}_{name}.webp"
+
+
+def render_variants(src_path: str, out_dir: str, sizes: dict[str, int]):
+    """
+    Corre num processo do pool (decode/resize é CPU-bound e não liberta o GIL).
+    Devolve {nome: (ficheiro_temporário, largura, altura)}.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    results = {}
+    with Image.open(src_path) as im:
+        im = ImageOps.exif_transpose(im)  # fotos de telemóvel rodadas
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+        for name, size in sizes.items():
+            variant = im.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out_path = os.path.join(out_dir, f"{uuid.uuid4().hex}.webp")
+            variant.save(out_path, "WEBP", quality=WEBP_QUALITY, method=4)
+            results[name] = (out_path, variant.width, variant.height)
+    return results
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+
+def set_variants(db: Session, sha256: str, variants: dict):
+    media = db.get(models.MediaObject, sha256)
+    if media is not None:
+        media.variants = variants
+        db.commit()
+
+
+async def _generate(sha256: str, src_path: str):
+    loop = asyncio.get_running_loop()
+    try:
+        rendered = await loop.run_in_executor(
+            _get_pool(), render_variants, src_path, storage.tmp_dir, VARIANT_SIZES
+        )
+        variants = {}
+        for name, (path, width, height) in rendered.items():
+            key = variant_key(sha256, name)
+            try:
+                await storage.put(key, path, "image/webp")
+            finally:
+                await discard_async(path)
+            variants[name] = {"key": key, "width": width, "height": height}
+        await run_db(set_variants, sha256, variants)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Erro a gerar variantes de {sha256}: {e}")
+    finally:
+        await discard_async(src_path)
+
+
+def schedule(sha256: str, src_path: str):
+    """Gera as variantes em background; a tarefa fica dona de src_path (apagado no fim)"""
+    if sha256 in _pending:
+        asyncio.create_task(discard_async(src_path))
+        return
+    task = asyncio.create_task(_generate(sha256, src_path))
+    _pending[sha256] = task
+    task.add_done_callback(lambda _: _pending.pop(sha256, None))
+
+
+async def wait_for(sha256: str, timeout: float):
+    """Espera (no máximo timeout) pelas variantes que estejam a ser geradas nesta réplica"""
+    task = _pending.get(sha256)
+    if task is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def close():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    for task in list(_pending.values()):
+        task.cancel()
@@ -0,0 +1,214 @@
+import asyncio
+import os
+from .websocket import manager
+from .membership import membership
+from .serialization import dumps
+
+# quanto tempo um "typing" fica ativo sem novo frame do cliente
+TYPING_TTL_SECONDS = float(os.getenv("TYPING_TTL_SECONDS", "5"))
+# resolução da timer wheel
+TYPING_TICK_SECONDS = float(os.getenv("TYPING_TICK_SECONDS", "0.5"))
+# intervalo mínimo entre transições enviadas para o mesmo (user, chat)
+TYPING_MIN_INTERVAL_SECONDS = float(os.getenv("TYPING_MIN_INTERVAL_SECONDS", "1"))
+
+
+class _TypingEntry:
+    __slots__ = ("username", "expires_tick", "slot")
+
+    def __init__(self, username: str, expires_tick: int, slot: int):
+        self.username = username
+        self.expires_tick = expires_tick
+        self.slot = slot
+
+
+class _Emitted:
+    """Último estado enviado aos clientes para uma chave (e quando)"""
+    __slots__ = ("tick", "started", "username", "deferred")
+
+    def __init__(self, tick: int, started: bool, username: str):
+        self.tick = tick
+        self.started = started
+        self.username = username
+        self.deferred = False
+
+
+class TypingState:
+    """
+    Estado de "a escrever" por (user, chat), com expiração numa timer wheel.
+
+    Só as mudanças de estado chegam aos clientes: o primeiro frame de typing
+    emite um start, os seguintes apenas renovam o prazo. O stop é emitido
+    quando o cliente o pede, quando envia a mensagem, quando desliga ou
+    quando o prazo expira — o cliente já não precisa de mandar stop_typing.
+
+    Entre duas transições enviadas para a mesma chave passa pelo menos
+    TYPING_MIN_INTERVAL_SECONDS: o que muda mais depressa fica adiado para o
+    fim do intervalo e só sai se o estado final for diferente do último
+    enviado (typing/stop_typing alternados rapidamente → no máximo um frame
+    por intervalo).
+
+    Os envios correm em tarefas próprias: a timer wheel nunca espera pela
+    rede nem por um resync de membros.
+
+    Chaves: (user_id, "direct", to_id) ou (user_id, "group", group_id).
+    """
+
+    def __init__(
+        self,
+        ttl: float = TYPING_TTL_SECONDS,
+        tick: float = TYPING_TICK_SECONDS,
+        min_interval: float = TYPING_MIN_INTERVAL_SECONDS,
+    ):
+        self.tick_seconds = tick
+        self.ttl_ticks = max(1, int(round(ttl / tick)))
+        self.interval_ticks = max(1, int(round(min_interval / tick)))
+        # +1 para que o prazo nunca caia no slot que está a ser processado
+        self.wheel: list[set] = [set() for _ in range(self.ttl_ticks + 1)]
+        # transições adiadas pelo intervalo mínimo, por tick em que podem sair
+        self.deferred_wheel: list[set] = [set() for _ in range(self.interval_ticks + 1)]
+        self.tick = 0
+        self.entries: dict[tuple, _TypingEntry] = {}
+        self.by_user: dict[int, set[tuple]] = {}
+        self.emitted: dict[tuple, _Emitted] = {}
+        # referências fortes às tarefas de envio (não serem recolhidas pelo GC)
+        self._sends: set[asyncio.Task] = set()
+
+    def _schedule(self, key: tuple, entry: _TypingEntry):
+        entry.expires_tick = self.tick + self.ttl_ticks
+        slot = entry.expires_tick % len(self.wheel)
+        if slot != entry.slot:
+            if entry.slot >= 0:
+                self.wheel[entry.slot].discard(key)
+            self.wheel[slot].add(key)
+            entry.slot = slot
+
+    def _remove(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.wheel[entry.slot].discard(key)
+        keys = self.by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_user[key[0]]
+        return entry
+
+    def _defer(self, key: tuple, emitted: _Emitted):
+        if not emitted.deferred:
+            emitted.deferred = True
+            due = emitted.tick + self.interval_ticks
+            self.deferred_wheel[due % len(self.deferred_wheel)].add(key)
+
+    def _sync(self, key: tuple, username: str):
+        """Envia o estado atual da chave se for diferente do último enviado (e o intervalo o permitir)"""
+        started = key in self.entries
+        emitted = self.emitted.get(key)
+        if emitted is None:
+            if not started:
+                return
+        elif emitted.started == started:
+            return  # voltou ao que os clientes já sabem → nada a enviar
+        elif self.tick - emitted.tick < self.interval_ticks:
+            self._defer(key, emitted)
+            return
+
+        if emitted is None:
+            emitted = self.emitted[key] = _Emitted(self.tick, started, username)
+        else:
+            emitted.tick, emitted.started = self.tick, started
+            if started:
+                emitted.username = username
+        self._emit(key, emitted.username, started)
+        if not started:
+            # o registo só serve para limitar um start logo a seguir → limpo no fim do intervalo
+            self._defer(key, emitted)
+
+    async def start(self, user_id: int, username: str, kind: str, target: int):
+        key = (user_id, kind, target)
+        entry = self.entries.get(key)
+        if entry is not None:
+            # já está a escrever → só renova o prazo, sem frames
+            self._schedule(key, entry)
+            return
+
+        entry = _TypingEntry(username, 0, -1)
+        self.entries[key] = entry
+        self.by_user.setdefault(user_id, set()).add(key)
+        self._schedule(key, entry)
+        self._sync(key, username)
+
+    async def stop(self, user_id: int, kind: str, target: int):
+        key = (user_id, kind, target)
+        entry = self._remove(key)
+        if entry is not None:
+            self._sync(key, entry.username)
+
+    async def stop_all(self, user_id: int):
+        """Limpa todo o estado de um user (ex.: ao desligar)."""
+        for key in list(self.by_user.get(user_id, ())):
+            entry = self._remove(key)
+            if entry is not None:
+                self._sync(key, entry.username)
+
+    def _expire_tick(self):
+        self.tick += 1
+        bucket = self.wheel[self.tick % len(self.wheel)]
+        expired = [key for key in bucket if self.entries[key].expires_tick <= self.tick]
+        for key in expired:
+            entry = self._remove(key)
+            if entry is not None:
+                self._sync(key, entry.username)
+
+        bucket = self.deferred_wheel[self.tick % len(self.deferred_wheel)]
+        for key in list(bucket):
+            emitted = self.emitted.get(key)
+            if emitted is not None and self.tick - emitted.tick < self.interval_ticks:
+                continue
+            bucket.discard(key)
+            if emitted is None:
+                continue
+            emitted.deferred = False
+            self._sync(key, emitted.username)
+            if not emitted.started and not emitted.deferred and key not in self.entries:
+                del self.emitted[key]
+
+    def _emit(self, key: tuple, username: str, started: bool):
+        task = asyncio.get_running_loop().create_task(self._send(key, username, started))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    async def _send(self, key: tuple, username: str, started: bool):
+        user_id, kind, target = key
+        try:
+            if kind == "direct":
+                if started:
+                    payload = {"type": "typing", "from_user_id": user_id, "from_username": username}
+                else:
+                    payload = {"type": "stop_typing", "from_user_id": user_id}
+                await manager.send_to_user(target, dumps(payload))
+            else:
+                payload = {
+                    "type": "group_typing" if started else "group_stop_typing",
+                    "group_id": target,
+                    "from_user_id": user_id,
+                    "from_username": username,
+                }
+                # réplica local; só um grupo desconhecido espera por um resync (nesta tarefa)
+                members = membership.members.get(target)
+                if members is None:
+                    members = await membership.get_members(target)
+                await manager.send_to_users([m for m in members if m != user_id], dumps(payload))
+        except Exception as e:
+            print(f"⚠️ Erro a enviar typing {kind} {target}: {e}")
+
+    async def run_expiry_loop(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick_seconds
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            self._expire_tick()
+
+
+typing_state = TypingState()
@@ -0,0 +1,250 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import models, media
+from .db import run_db
+from .storage import storage, discard, CHUNK_SIZE
+
+# Tipos aceites e tamanho máximo (imagens: thumbnails + payloads dos chats)
+ALLOWED_MIME = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+MAX_BYTES = 10 * 1024 * 1024  # 10 MB
+
+# Anexos (só por upload resumível)
+ALLOWED_FILE_MIME = {
+    "application/pdf": ".pdf",
+    "application/zip": ".zip",
+    "text/plain": ".txt",
+    "audio/mpeg": ".mp3",
+    "video/mp4": ".mp4",
+}
+MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(200 * 1024 * 1024)))  # 200 MB
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", str(16 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_CLEANUP_SECONDS = float(os.getenv("UPLOAD_CLEANUP_SECONDS", "3600"))
+
+# hash incremental das sessões ativas nesta réplica: id → (offset, sha256)
+# (se o chunk seguinte chegar a outra réplica, o finalize volta a ler o ficheiro)
+_hashers: dict[str, tuple] = {}
+
+
+def limits_for(content_type: str):
+    """(extensão, tamanho máximo) ou None se o tipo não for aceite"""
+    if content_type in ALLOWED_MIME:
+        return ALLOWED_MIME[content_type], MAX_BYTES
+    if content_type in ALLOWED_FILE_MIME:
+        return ALLOWED_FILE_MIME[content_type], MAX_FILE_BYTES
+    return None
+
+
+def part_path(session_id: str) -> str:
+    # mesmo filesystem que o destino (link sem cópia no LocalStorage)
+    return os.path.join(storage.tmp_dir, "sessions", session_id)
+
+
+def _create_part(session_id: str):
+    path = part_path(session_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+
+def create_session(db: Session, user_id: int, filename: str | None, content_type: str, size: int):
+    session = models.UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        offset=0,
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS),
+    )
+    _create_part(session.id)
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    _hashers[session.id] = (0, hashlib.sha256())
+    return session
+
+
+def get_session(db: Session, session_id: str, user_id: int):
+    session = db.get(models.UploadSession, session_id)
+    if session is None or session.user_id != user_id or session.expires_at < datetime.utcnow():
+        return None
+    return session
+
+
+def _advance(db: Session, session_id: str, old_offset: int, new_offset: int) -> bool:
+    """Avança o offset só se ninguém o mudou entretanto (PUTs concorrentes na mesma sessão)"""
+    res = db.execute(
+        update(models.UploadSession)
+        .where(models.UploadSession.id == session_id, models.UploadSession.offset == old_offset)
+        .values(offset=new_offset)
+    )
+    db.commit()
+    return res.rowcount == 1
+
+
+def _current_offset(db: Session, session_id: str):
+    return db.execute(
+        select(models.UploadSession.offset).where(models.UploadSession.id == session_id)
+    ).scalar_one_or_none()
+
+
+def _lock_part(session_id: str):
+    """Abre o ficheiro parcial com lock exclusivo, ou None se outro PUT já o tiver (nesta ou noutra réplica)"""
+    f = open(part_path(session_id), "r+b")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def _truncate_at(f, offset: int):
+    f.seek(offset)
+    f.truncate()  # descarta restos de um chunk interrompido além do offset confirmado
+
+
+async def write_chunk(session, offset: int, stream) -> int:
+    """
+    Escreve o corpo do pedido a partir de offset, à medida que chega (nunca fica todo em memória).
+    Se a ligação cair a meio, o que já foi escrito conta: o cliente retoma do novo offset.
+    Um PUT de cada vez por sessão: um segundo em paralelo (ex.: retry do cliente) recebe 409.
+    Devolve o offset final.
+    """
+    if offset != session.offset:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Offset mismatch", "offset": session.offset},
+        )
+
+    f = await run_in_threadpool(_lock_part, session.id)
+    if f is None:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload chunk already in progress", "offset": session.offset},
+        )
+    try:
+        return await _write_locked(f, session, offset, stream)
+    finally:
+        # o lock só é largado depois de o offset avançar
+        await run_in_threadpool(f.close)
+
+
+async def _write_locked(f, session, offset: int, stream) -> int:
+    # o PUT anterior pode ter acabado entre a leitura da sessão e o lock
+    current = await run_db(_current_offset, session.id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if current != offset:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Offset mismatch", "offset": current},
+        )
+    await run_in_threadpool(_truncate_at, f, offset)
+
+    # cópia própria: o hash guardado só muda se o offset avançar
+    hasher = _hashers.get(session.id)
+    hasher = hasher[1].copy() if hasher is not None and hasher[0] == offset else None
+
+    written = 0
+    try:
+        async for chunk in stream:
+            if not chunk:
+                continue
+            if written + len(chunk) > UPLOAD_CHUNK_MAX_BYTES or offset + written + len(chunk) > session.size:
+                raise HTTPException(status_code=413, detail="Chunk exceeds declared upload size")
+            await run_in_threadpool(f.write, chunk)
+            written += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+    finally:
+        await run_in_threadpool(f.flush)
+        # ClientDisconnect incluído: o offset avança até onde os bytes chegaram
+        if written and await run_db(_advance, session.id, offset, offset + written):
+            if hasher is not None:
+                _hashers[session.id] = (offset + written, hasher)
+        elif written:
+            _hashers.pop(session.id, None)
+    return offset + written
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _delete_session(db: Session, session_id: str) -> bool:
+    res = db.execute(delete(models.UploadSession).where(models.UploadSession.id == session_id))
+    db.commit()
+    return res.rowcount == 1
+
+
+async def finalize(session) -> str:
+    """Ficheiro completo → storage content-addressed (media.store_file). Devolve a key."""
+    if session.offset != session.size:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload incomplete", "offset": session.offset, "size": session.size},
+        )
+    ext, _ = limits_for(session.content_type)
+    path = part_path(session.id)
+
+    hasher = _hashers.pop(session.id, None)
+    if hasher is not None and hasher[0] == session.size:
+        sha256 = hasher[1].hexdigest()
+    else:
+        sha256 = await run_in_threadpool(_hash_file, path)
+
+    # apagar a sessão "reclama" o ficheiro: um segundo finalize em paralelo recebe 404
+    if not await run_db(_delete_session, session.id):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return await media.store_file(path, sha256, session.size, session.content_type, ext, session.user_id)
+
+
+async def abort(session):
+    _hashers.pop(session.id, None)
+    await run_db(_delete_session, session.id)
+    await run_in_threadpool(discard, part_path(session.id))
+
+
+def _cleanup_expired(db: Session) -> int:
+    expired = db.execute(
+        delete(models.UploadSession)
+        .where(models.UploadSession.expires_at < datetime.utcnow())
+        .returning(models.UploadSession.id)
+    ).scalars().all()
+    db.commit()
+    for session_id in expired:
+        _hashers.pop(session_id, None)
+        discard(part_path(session_id))
+    return len(expired)
+
+
+async def run_cleanup_loop():
+    while True:
+        await asyncio.sleep(UPLOAD_CLEANUP_SECONDS)
+        try:
+            count = await run_db(_cleanup_expired)
+            if count:
+                print(f"🧹 {count} uploads incompletos expirados removidos")
+            count = await media.cleanup_unsent()
+            if count:
+                print(f"🧹 {count} ficheiros enviados e nunca usados removidos")
+        except Exception as e:
+            print(f"❌ Erro a limpar uploads expirados: {e}")
@@ -1,70 +1,86 @@
+import asyncio
 from fastapi import WebSocket
-from typing import List, Dict
-from . import crud
-from sqlalchemy.orm import Session
+from .membership import membership
+from .broker import create_broker
+from .connections import ConnectionRegistry
+from .serialization import dumps, loads
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.user_map: Dict[int, WebSocket] = {}
+        # user → {sessões}; vários separadores/dispositivos por user
+        # cada sessão tem fila de envio própria; lentos são expulsos (ver connections.py)
+        self.registry = ConnectionRegistry(on_dead=self.disconnect)
+        # entrega entre réplicas (ver broker.py); as ligações continuam locais
+        self.broker = create_broker(self._on_broker_message, self._on_broker_event)
+        # referências fortes às tarefas de _release (não serem recolhidas pelo GC)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        await self.broker.start()
+
+    async def close(self):
+        await self.broker.close()
 
     async def connect(self, websocket: WebSocket, user_id: int):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        self.user_map[user_id] = websocket
+        _, first_session = self.registry.add(websocket, user_id)
+        if first_session:
+            await self.broker.subscribe_user(user_id)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        session, last_session = self.registry.remove(websocket)
+        if last_session:
+            # esta réplica deixou de ter o user → deixa de ouvir o canal dele
+            task = asyncio.get_running_loop().create_task(self._release(session.user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _release(self, user_id: int):
+        if self.registry.is_online(user_id):
+            return  # voltou a ligar entretanto
+        try:
+            await self.broker.unsubscribe_user(user_id)
+        except Exception as e:
+            print(f"⚠️ Erro a cancelar subscrição do user {user_id}: {e}")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
+    async def _on_broker_message(self, user_id, message: str):
+        # só enfileira: a escrita no socket é feita pela tarefa de cada sessão
+        if user_id is None:
+            self.registry.broadcast(message)
+        else:
+            self.registry.send_to_user(user_id, message)
+
+    async def _on_broker_event(self, message: str):
+        event = loads(message)
+        if event.get("topic") == "membership":
+            await membership.apply_event(event["event"])
+
+    async def publish_membership_event(self, event: dict):
+        """Evento do group-service → todas as réplicas (esta incluída) atualizam a réplica de membros"""
+        await self.broker.publish_event(dumps({"topic": "membership", "event": event}))
+
     async def send_to_user(self, user_id: int, message: str):
-        ws = self.user_map.get(user_id)
-        if ws:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                self.disconnect(ws)
+        await self.broker.publish_user(user_id, message)
 
     async def send_to_users(self, user_ids: list, message: str):
-        for user_id in user_ids:
-            ws = self.user_map.get(user_id)
-            if ws:
-                try:
-                    await ws.send_text(message)
-                except Exception:
-                    self.disconnect(ws)
-
-    async def send_to_group(self, db: Session, group_id: int, message: str, token: str):
+        await self.broker.publish_users(user_ids, message)
+
+    async def send_to_group(self, group_id: int, message: str):
         """
         Sends a message to all active WebSocket connections of users in a group.
         """
         try:
-            # 🔍 buscar membros do grupo
-            member_ids = crud.get_group_members_ids(db, group_id, token)
-            for uid in member_ids:
-                ws = self.user_map.get(uid)
-                if ws:
-                    try:
-                        await ws.send_text(message)
-                    except Exception:
-                        self.disconnect(ws)
+            # 🔍 membros do grupo (réplica local, sem pedidos ao group-service)
+            member_ids = await membership.get_members(group_id)
+            await self.broker.publish_users(member_ids, message)
         except Exception as e:
             print(f"❌ Error sending message to group {group_id}: {e}")
 
 
     async def broadcast(self, message: str):
-        to_remove = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                # If connection is closed, mark for removal
-                to_remove.append(connection)
-
-        for conn in to_remove:
-            self.disconnect(conn)
-
-manager = ConnectionManager()
\ No newline at end of file
+        await self.broker.publish_broadcast(message)
+
+manager = ConnectionManager()
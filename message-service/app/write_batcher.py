@@ -0,0 +1,142 @@
+import asyncio
+import os
+from . import models, crud
+from .db import run_db
+
+# opt-in: agrupa os INSERTs vindos dos WebSockets em micro-batches
+WS_WRITE_BATCHING = os.getenv("WS_WRITE_BATCHING", "false").lower() in ("1", "true", "yes")
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", "200"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "5"))
+
+
+class WriteBatcher:
+    """
+    Group commit para mensagens novas.
+
+    Cada submit() entra numa fila; uma tarefa junta o que chegar durante
+    WRITE_BATCH_MAX_DELAY_MS (ou até WRITE_BATCH_MAX_SIZE linhas), escreve
+    tudo com um INSERT ... RETURNING numa só transação e resolve o future de
+    cada remetente com o id atribuído. O ack continua a ser por mensagem:
+    quem envia só avança depois de a sua linha estar gravada.
+    """
+
+    def __init__(self, model, max_size: int = WRITE_BATCH_MAX_SIZE, max_delay_ms: float = WRITE_BATCH_MAX_DELAY_MS):
+        self.model = model
+        self.max_size = max_size
+        self.max_delay = max_delay_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = None
+        # batch que a tarefa tem em mãos (fora da fila), para o poder falhar se ela morrer
+        self.batch = []
+
+    async def submit(self, values: dict) -> int:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+            self.task.add_done_callback(self._on_task_done)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((values, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return  # close()
+            batch = self.batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    await self._flush(batch)
+                    self.batch = []
+                    return
+                batch.append(item)
+            await self._flush(batch)
+            self.batch = []
+
+    def _on_task_done(self, task):
+        """
+        Se a tarefa morrer (erro inesperado ou cancelamento), falha os futures
+        pendentes — o batch em mãos e o que está na fila — em vez de os deixar
+        à espera para sempre; o próximo submit() arranca uma tarefa nova.
+        """
+        if self.task is task:
+            self.task = None
+        if not task.cancelled() and task.exception() is None:
+            return  # saída normal (close)
+        error = RuntimeError("write batcher parou") if task.cancelled() else task.exception()
+        print(f"❌ Tarefa do write batcher terminou: {error!r}")
+        pending, self.batch = self.batch, []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                pending.append(item)
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _flush(self, batch):
+        rows = [values for values, _ in batch]
+        try:
+            ids = await run_db(crud.insert_many, self.model, rows)
+        except Exception as e:
+            # uma linha inválida (ex.: reply_to inexistente) não pode derrubar as outras
+            print(f"⚠️ Batch de {len(rows)} mensagens falhou ({e}); a gravar uma a uma")
+            await self._flush_one_by_one(batch)
+            return
+
+        for (_, future), message_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(message_id)
+
+    async def _flush_one_by_one(self, batch):
+        for values, future in batch:
+            try:
+                ids = await run_db(crud.insert_many, self.model, [values])
+                if not future.done():
+                    future.set_result(ids[0])
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def close(self):
+        # grava o que ainda está na fila antes de sair
+        if self.task is not None:
+            await self.queue.put(None)
+            try:
+                await self.task
+            except BaseException:
+                pass  # já tratado em _on_task_done
+            self.task = None
+
+
+direct_writer = WriteBatcher(models.Message)
+group_writer = WriteBatcher(models.GroupMessage)
+
+
+async def save_message(**kwargs) -> int:
+    """Grava uma mensagem direta e devolve o id (em batch se WS_WRITE_BATCHING)"""
+    if WS_WRITE_BATCHING:
+        return await direct_writer.submit(crud.message_values(**kwargs))
+    msg = await run_db(crud.save_message, **kwargs)
+    return msg.id
+
+
+async def save_group_message(**kwargs) -> int:
+    """Grava uma mensagem de grupo e devolve o id (em batch se WS_WRITE_BATCHING)"""
+    if WS_WRITE_BATCHING:
+        return await group_writer.submit(crud.group_message_values(**kwargs))
+    msg = await run_db(crud.save_group_message, **kwargs)
+    return msg.id
+
+
+async def close():
+    await direct_writer.close()
+    await group_writer.close()
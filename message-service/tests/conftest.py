@@ -0,0 +1,63 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Testes com base de dados: TEST_DATABASE_URL aponta para uma base descartável
+# (o schema public é recriado). Sem ela esses testes são saltados.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+# ficheiros enviados num diretório temporário (antes de importar app.storage)
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="pingu-uploads-"))
+
+TABLES = [
+    "messages", "group_messages", "direct_read_state", "group_read_state", "change_log",
+    "media_uploads", "media_objects", "upload_sessions", "conversation_deletions",
+]
+
+
+@pytest.fixture(scope="session")
+def schema():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL não definido")
+    from sqlalchemy import text
+    from app import models, migrations, partitions
+    from app.db import engine
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE; CREATE SCHEMA public"))
+    models.Base.metadata.create_all(bind=engine)
+    migrations.run_migrations(engine)
+    partitions.run_maintenance(engine)
+    return engine
+
+
+@pytest.fixture
+def db(schema):
+    """Sessão síncrona numa base limpa"""
+    from sqlalchemy import text
+    from app.db import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+    with schema.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+
+
+@pytest.fixture
+def arun(db):
+    """Corre uma corrotina num loop novo e larga as ligações asyncpg no fim (ficam presas ao loop)"""
+    from app.db import async_engine
+
+    def run(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(wrapper())
+
+    return run
@@ -0,0 +1,111 @@
+import asyncio
+
+from app.broker import MemoryBroker, MemoryBus
+from app.membership import MembershipIndex
+from app.serialization import dumps, loads
+
+
+class Replica:
+    """Uma "réplica" do message-service: broker próprio + réplica de membros própria"""
+
+    def __init__(self, bus: MemoryBus):
+        self.received = []
+        self.membership = MembershipIndex()
+        self.broker = MemoryBroker(self._on_message, self._on_event, bus=bus)
+
+    async def _on_message(self, user_id, message):
+        self.received.append((user_id, message))
+
+    async def _on_event(self, message):
+        event = loads(message)
+        if event.get("topic") == "membership":
+            await self.membership.apply_event(event["event"])
+
+
+async def _replicas(n=2):
+    bus = MemoryBus()
+    replicas = [Replica(bus) for _ in range(n)]
+    for replica in replicas:
+        await replica.broker.start()
+    return replicas
+
+
+def test_user_message_reaches_only_the_subscribed_replica():
+    async def run():
+        a, b = await _replicas()
+        await a.broker.subscribe_user(1)
+        await b.broker.publish_user(1, "hi")
+        await b.broker.publish_user(2, "nobody")
+        return a.received, b.received
+
+    a_received, b_received = asyncio.run(run())
+    assert a_received == [(1, "hi")]
+    assert b_received == []
+
+
+def test_unsubscribe_stops_delivery():
+    async def run():
+        a, b = await _replicas()
+        await a.broker.subscribe_user(1)
+        await a.broker.unsubscribe_user(1)
+        await b.broker.publish_users([1], "late")
+        return a.received
+
+    assert asyncio.run(run()) == []
+
+
+def test_broadcast_reaches_every_replica():
+    async def run():
+        replicas = await _replicas(3)
+        await replicas[0].broker.publish_broadcast("all")
+        return [r.received for r in replicas]
+
+    assert asyncio.run(run()) == [[(None, "all")]] * 3
+
+
+def test_closed_replica_receives_nothing():
+    async def run():
+        a, b = await _replicas()
+        await a.broker.subscribe_user(1)
+        await a.broker.close()
+        await b.broker.publish_user(1, "x")
+        await b.broker.publish_broadcast("y")
+        return a.received
+
+    assert asyncio.run(run()) == []
+
+
+def test_membership_event_updates_every_replica():
+    async def run():
+        a, b = await _replicas()
+        for replica in (a, b):
+            replica.membership.apply_snapshot(9, 1, [1, 2])
+
+        # o group-service entrega o evento a uma réplica; o broker leva-o às outras
+        removed = {"type": "member_removed", "group_id": 9, "user_id": 2, "version": 2}
+        await a.broker.publish_event(dumps({"topic": "membership", "event": removed}))
+        return a.membership, b.membership
+
+    a_index, b_index = asyncio.run(run())
+    for index in (a_index, b_index):
+        assert index.members[9] == {1}
+        assert index.groups_for(2) == set()
+        assert index.versions[9] == 2
+
+
+def test_manager_publishes_membership_events_through_the_broker(monkeypatch):
+    from app import websocket
+
+    index = MembershipIndex()
+    index.apply_snapshot(9, 1, [1])
+    monkeypatch.setattr(websocket, "membership", index)
+
+    async def run():
+        manager = websocket.ConnectionManager()
+        manager.broker = MemoryBroker(manager._on_broker_message, manager._on_broker_event, bus=MemoryBus())
+        await manager.start()
+        await manager.publish_membership_event({"type": "member_added", "group_id": 9, "user_id": 5, "version": 2})
+
+    asyncio.run(run())
+    assert index.members[9] == {1, 5}
+    assert index.groups_for(5) == {9}
@@ -0,0 +1,110 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from app import changelog, crud, models
+from app.db import AsyncSessionLocal, SessionLocal
+
+
+def test_cursor_round_trip():
+    at = datetime(2026, 5, 4, 10, 0, 0, 5)
+    cursor = changelog.encode_cursor(17, "100:105:101,103", at)
+    assert changelog.decode_cursor(cursor) == (17, "100:105:101,103", at)
+
+
+@pytest.mark.parametrize("raw", [
+    "garbage",
+    "17|2026-05-04T10:00:00",                # formato antigo, sem snapshot → reset
+    "17|2026-05-04T10:00:00|1:2:3; drop",    # snapshot inválido nunca chega ao SQL
+    "x|2026-05-04T10:00:00|1:2:",
+    "17|not-a-date|1:2:",
+])
+def test_invalid_cursor_decodes_to_none(raw):
+    cursor = base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    assert changelog.decode_cursor(cursor) is None
+
+
+def test_non_base64_cursor_decodes_to_none():
+    assert changelog.decode_cursor("%%%") is None
+
+
+async def _sync(user_id, group_ids, cursor=None):
+    """(mudanças, cursor novo) como o /sync as veria"""
+    async with AsyncSessionLocal() as session:
+        head, snapshot, now = await changelog.read_head(session)
+        if cursor is None:
+            return [], changelog.encode_cursor(head, snapshot, now)
+        since, since_snapshot, _ = changelog.decode_cursor(cursor)
+        late, new = await changelog.load_changes(session, user_id, group_ids, since, since_snapshot, head, snapshot)
+        return late + new, changelog.encode_cursor(head, snapshot, now)
+
+
+def _kinds(changes):
+    return [(c.kind, c.chat_type, c.message_id) for c in changes]
+
+
+def test_each_user_sees_only_own_conversations(db, arun):
+    _, start = arun(_sync(1, set()))
+    to_1 = crud.save_message(db, 2, 1, "for 1")
+    crud.save_message(db, 2, 3, "not for 1")
+    in_group = crud.save_group_message(db, 2, 7, "group 7")
+    crud.save_group_message(db, 2, 8, "group 8")
+    crud.mark_messages_read(db, 1, 2)
+    crud.mark_messages_read(db, 2, 1)  # a leitura do outro não interessa ao user 1
+
+    changes, _ = arun(_sync(1, {7}, start))
+    assert _kinds(changes) == [
+        ("message", "direct", to_1.id),
+        ("message", "group", in_group.id),
+        ("read", "direct", to_1.id),
+    ]
+    assert all(c.user_id == 1 for c in changes if c.kind == "read")
+
+
+def test_cursor_at_head_returns_nothing_new(db, arun):
+    crud.save_message(db, 2, 1, "old")
+    _, cursor = arun(_sync(1, set()))
+    changes, _ = arun(_sync(1, set(), cursor))
+    assert changes == []
+
+
+def test_late_commit_below_cursor_is_delivered_once(db, arun):
+    _, cursor = arun(_sync(1, set()))
+
+    # transação lenta: tira o id primeiro e só commita depois de um sync ter passado por ele
+    slow = SessionLocal()
+    slow_msg = models.Message(sender_id=2, receiver_id=1, conversation_id="1:2", content="slow")
+    slow.add(slow_msg)
+    slow.flush()
+    slow_id = slow_msg.id
+    changelog.record_messages(slow, "direct", [{"sender_id": 2, "receiver_id": 1}], [slow_id])
+    slow.flush()
+    try:
+        fast = crud.save_message(db, 2, 1, "fast")
+        changes, cursor = arun(_sync(1, set(), cursor))
+        assert [c.message_id for c in changes] == [fast.id]
+        slow.commit()
+    finally:
+        slow.close()
+
+    changes, cursor = arun(_sync(1, set(), cursor))
+    assert [c.message_id for c in changes] == [slow_id]
+    assert slow_id < fast.id
+
+    changes, _ = arun(_sync(1, set(), cursor))
+    assert changes == []
+
+
+def test_rolled_back_change_never_shows_up(db, arun):
+    _, cursor = arun(_sync(1, set()))
+    aborted = SessionLocal()
+    changelog.record_messages(aborted, "direct", [{"sender_id": 2, "receiver_id": 1}], [999])
+    aborted.flush()
+    aborted.rollback()
+    aborted.close()
+    kept = crud.save_message(db, 2, 1, "kept")
+
+    changes, cursor = arun(_sync(1, set(), cursor))
+    assert [c.message_id for c in changes] == [kept.id]
+    assert arun(_sync(1, set(), cursor))[0] == []
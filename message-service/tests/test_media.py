@@ -0,0 +1,113 @@
+import asyncio
+import io
+import os
+
+import pytest
+from sqlalchemy import text
+
+from app import crud, media, models
+from app.storage import storage
+
+BASE = "http://testserver"
+
+
+def _upload(content: bytes, user_id: int) -> str:
+    key = asyncio.run(media.store_upload(io.BytesIO(content), "text/plain", ".txt", 1024, user_id))
+    return storage.url(key, BASE)
+
+
+def _media(db, url):
+    db.expire_all()
+    return db.get(models.MediaObject, url.rsplit("/", 1)[-1][:64])
+
+
+def _delete(db, msg) -> list[str]:
+    db.delete(msg)
+    keys = media.release_urls_sync(db, [msg.image_url])
+    db.commit()
+    return keys
+
+
+def _expire_uploads(db):
+    db.execute(text(
+        "UPDATE media_uploads SET created_at = created_at - interval '2 days';"
+        "UPDATE media_objects SET created_at = created_at - interval '2 days'"
+    ))
+    db.commit()
+
+
+def test_upload_holds_no_reference(db):
+    url = _upload(b"hello", user_id=1)
+    assert _media(db, url).refcount == 0
+    assert db.get(models.MediaUpload, (_media(db, url).sha256, 1)) is not None
+
+
+def test_refcount_follows_messages(db):
+    url = _upload(b"shared", user_id=1)
+    first = crud.save_message(db, 1, 2, "[image]", image_url=url)
+    second = crud.save_group_message(db, 1, 9, "[image]", image_url=url)
+    crud.insert_many(db, models.Message, [crud.message_values(1, 3, "[image]", image_url=url)] * 2)
+    assert _media(db, url).refcount == 4
+
+    # apagar uma das mensagens não apaga o ficheiro das outras
+    assert _delete(db, first) == []
+    assert _media(db, url).refcount == 3
+    assert os.path.exists(storage.path(_media(db, url).key))
+
+    # a última mensagem vai-se, mas o upload ainda está dentro do TTL → o ficheiro fica
+    for msg in [second, *db.query(models.Message).all()]:
+        assert _delete(db, msg) == []
+    assert _media(db, url).refcount == 0
+    assert os.path.exists(storage.path(_media(db, url).key))
+
+
+def test_last_release_without_fresh_upload_deletes(db):
+    url = _upload(b"gone", user_id=1)
+    msg = crud.save_message(db, 1, 2, "[image]", image_url=url)
+    key = _media(db, url).key
+    db.execute(text("DELETE FROM media_uploads"))
+    db.commit()
+    assert _delete(db, msg) == [key]
+    assert _media(db, url) is None
+
+
+def test_unsent_upload_is_cleaned_after_ttl(db):
+    sent = _upload(b"sent", user_id=1)
+    unsent = _upload(b"unsent", user_id=1)
+    crud.save_message(db, 1, 2, "[image]", image_url=sent)
+    path = storage.path(_media(db, unsent).key)
+
+    assert asyncio.run(media.cleanup_unsent()) == 0  # ainda dentro do TTL
+    _expire_uploads(db)
+    assert asyncio.run(media.cleanup_unsent()) == 1
+
+    assert _media(db, unsent) is None and not os.path.exists(path)
+    assert _media(db, sent).refcount == 1
+    assert db.query(models.MediaUpload).count() == 0
+
+
+def test_message_with_unknown_media_is_rejected(db):
+    url = _upload(b"real", user_id=1)
+    fake = url.replace(url.rsplit("/", 1)[-1][:64], "0" * 64)
+    with pytest.raises(media.InvalidMedia):
+        crud.save_message(db, 1, 2, "[image]", image_url=fake)
+    db.rollback()
+    assert db.query(models.Message).count() == 0
+
+
+def test_image_url_must_be_own_recent_upload(db):
+    url = _upload(b"mine", user_id=1)
+
+    def check(image_url, user_id):
+        return asyncio.run(media.check_image_url(image_url, user_id, BASE))
+
+    assert check(url, 1)
+    assert not check(url, 2)  # ficheiro de outro user
+    assert not check(url.replace(BASE, "https://evil.example"), 1)
+    assert not check(f"{BASE}/uploads/legacy-uuid.png", 1)
+    _expire_uploads(db)
+    assert not check(url, 1)
+
+    # voltar a enviar o mesmo conteúdo renova o prazo (e o dono)
+    assert _upload(b"mine", user_id=2) == url
+    assert check(url, 2)
@@ -0,0 +1,96 @@
+import asyncio
+
+from app.membership import MembershipIndex
+
+
+class FakeGroupService(MembershipIndex):
+    """MembershipIndex com o resync servido de um dicionário (group_id → (version, members))"""
+
+    def __init__(self, snapshots):
+        super().__init__()
+        self.snapshots = snapshots
+        self.resyncs = []
+
+    async def resync(self, group_id):
+        self.resyncs.append(group_id)
+        if group_id in self.snapshots:
+            version, members = self.snapshots[group_id]
+            self.apply_snapshot(group_id, version, members)
+        else:
+            self.remove_group(group_id)
+
+
+def _apply(index, *events):
+    async def run():
+        for event in events:
+            await index.apply_event(event)
+    asyncio.run(run())
+
+
+def test_events_in_order_apply_without_resync():
+    index = FakeGroupService({})
+    _apply(
+        index,
+        {"type": "group_created", "group_id": 1, "version": 1, "member_ids": [1, 2]},
+        {"type": "member_added", "group_id": 1, "version": 2, "user_id": 3},
+        {"type": "member_removed", "group_id": 1, "version": 3, "user_id": 1},
+    )
+    assert index.members[1] == {2, 3}
+    assert index.versions[1] == 3
+    assert index.groups_for(1) == set()
+    assert index.groups_for(3) == {1}
+    assert index.resyncs == []
+
+
+def test_duplicate_and_stale_events_are_ignored():
+    index = FakeGroupService({})
+    index.apply_snapshot(1, 5, [1, 2])
+    _apply(
+        index,
+        {"type": "member_removed", "group_id": 1, "version": 5, "user_id": 1},
+        {"type": "member_added", "group_id": 1, "version": 3, "user_id": 9},
+    )
+    assert index.members[1] == {1, 2}
+    assert index.versions[1] == 5
+    assert index.resyncs == []
+
+
+def test_version_gap_resyncs_from_snapshot():
+    # o evento v3 perdeu-se: o v4 não pode ser aplicado por cima do v2
+    index = FakeGroupService({1: (4, [2, 5])})
+    index.apply_snapshot(1, 2, [1, 2])
+    _apply(index, {"type": "member_added", "group_id": 1, "version": 4, "user_id": 5})
+    assert index.resyncs == [1]
+    assert index.members[1] == {2, 5}
+    assert index.versions[1] == 4
+    assert index.groups_for(1) == set()
+
+    # depois do resync os eventos seguintes voltam a aplicar-se diretamente
+    _apply(index, {"type": "group_left", "group_id": 1, "version": 5, "user_id": 2})
+    assert index.members[1] == {5}
+    assert index.resyncs == [1]
+
+
+def test_unknown_group_resyncs():
+    index = FakeGroupService({7: (3, [1])})
+    _apply(index, {"type": "member_added", "group_id": 7, "version": 3, "user_id": 1})
+    assert index.resyncs == [7]
+    assert index.members[7] == {1}
+
+
+def test_older_snapshot_does_not_roll_back():
+    index = FakeGroupService({})
+    index.apply_snapshot(1, 4, [1])
+    index.apply_snapshot(1, 3, [1, 2])
+    assert index.members[1] == {1}
+    assert index.versions[1] == 4
+
+
+def test_group_deleted_clears_reverse_index():
+    index = FakeGroupService({})
+    index.apply_snapshot(1, 1, [1, 2])
+    index.apply_snapshot(2, 1, [1])
+    _apply(index, {"type": "group_deleted", "group_id": 1})
+    assert 1 not in index.members and 1 not in index.versions
+    assert index.groups_for(1) == {2}
+    assert index.groups_for(2) == set()
@@ -0,0 +1,45 @@
+from sqlalchemy import inspect, text
+
+from app import crud, migrations
+
+
+def _columns(engine, table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+def _run_startup(engine):
+    with engine.connect() as conn:
+        migrations.add_missing_columns(conn)
+        migrations.ensure_indexes(conn)
+        conn.commit()
+
+
+def test_heavy_ddl_is_left_out_of_startup(db, schema):
+    crud.save_message(db, 1, 2, "hello world")
+    db.close()  # sem transação aberta: o ALTER e o CONCURRENTLY esperariam por ela
+    with schema.begin() as conn:
+        conn.execute(text("ALTER TABLE messages DROP COLUMN search_vector"))  # leva o índice GIN com ele
+        conn.execute(text("DROP INDEX ix_change_log_created_at"))
+
+    # arranque com dados: nem reescrita da tabela nem CREATE INDEX bloqueante
+    _run_startup(schema)
+    assert "search_vector" not in _columns(schema, "messages")
+    with schema.connect() as conn:
+        assert migrations._index_valid(conn, "ix_messages_search_vector") is None
+        assert migrations._index_valid(conn, "ix_change_log_created_at") is None
+
+    migrations.add_generated_columns(schema)
+    migrations.build_indexes_concurrently(schema)
+
+    with schema.connect() as conn:
+        assert migrations._index_valid(conn, "ix_messages_search_vector")
+        assert migrations._index_valid(conn, "ix_change_log_created_at")
+        # um índice por partição, ligado ao do pai
+        children = migrations._child_tables(conn, "ix_messages_search_vector")
+        assert children and len(children) == len(migrations._child_tables(conn, "messages"))
+        assert conn.execute(text(
+            "SELECT search_vector IS NOT NULL FROM messages WHERE content = 'hello world'"
+        )).scalar()
+
+    # correr outra vez não faz nada
+    migrations.build_indexes_concurrently(schema)
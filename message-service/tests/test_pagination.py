@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app import models
+from app.db import AsyncSessionLocal
+from app.pagination import encode_cursor, decode_cursor, paginate
+
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 3, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(ts, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (ts, 42)
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "", encode_cursor(datetime(2026, 1, 1), 1)[:-3] + "@@@"])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def _insert_conversation(db, n, same_timestamp_every=3):
+    """n mensagens em "1:2"; grupos de 3 com o mesmo timestamp (o id desempata)"""
+    base = datetime.utcnow() - timedelta(hours=1)
+    for i in range(n):
+        db.add(models.Message(
+            sender_id=1, receiver_id=2, conversation_id="1:2", content=f"m{i}",
+            timestamp=base + timedelta(seconds=i // same_timestamp_every),
+        ))
+    db.add(models.Message(sender_id=1, receiver_id=3, conversation_id="1:3", content="other", timestamp=base))
+    db.commit()
+
+
+async def _walk(direction, limit):
+    stmt = select(models.Message).where(models.Message.conversation_id == "1:2")
+    pages, cursor = [], None
+    async with AsyncSessionLocal() as session:
+        while True:
+            kwargs = {direction: cursor} if cursor else {}
+            rows, cursor = await paginate(session, stmt, models.Message, limit=limit, **kwargs)
+            pages.append([m.content for m in rows])
+            if cursor is None:
+                return pages
+
+
+def test_before_pages_cover_history_without_gaps(db, arun):
+    _insert_conversation(db, 8)
+    pages = arun(_walk("before", 3))
+    # mais recente primeiro, cada página em ordem cronológica, empates no timestamp por id
+    assert pages == [["m5", "m6", "m7"], ["m2", "m3", "m4"], ["m0", "m1"]]
+
+
+def test_exact_multiple_has_no_empty_last_page(db, arun):
+    _insert_conversation(db, 6)
+    assert arun(_walk("before", 3)) == [["m3", "m4", "m5"], ["m0", "m1", "m2"]]
+
+
+def test_after_pages_forward_from_cursor(db, arun):
+    _insert_conversation(db, 8)
+
+    async def run():
+        stmt = select(models.Message).where(models.Message.conversation_id == "1:2")
+        async with AsyncSessionLocal() as session:
+            oldest, _ = await paginate(session, stmt, models.Message, limit=8)
+            cursor = encode_cursor(oldest[1].timestamp, oldest[1].id)
+            first, next_cursor = await paginate(session, stmt, models.Message, after=cursor, limit=4)
+            second, last_cursor = await paginate(session, stmt, models.Message, after=next_cursor, limit=4)
+            return [m.content for m in first], [m.content for m in second], last_cursor
+
+    first, second, last_cursor = arun(run())
+    assert first == ["m2", "m3", "m4", "m5"]
+    assert second == ["m6", "m7"]
+    assert last_cursor is None
+
+
+def test_before_and_after_together_is_400(db, arun):
+    cursor = encode_cursor(datetime.utcnow(), 1)
+
+    async def run():
+        async with AsyncSessionLocal() as session:
+            await paginate(session, select(models.Message), models.Message, before=cursor, after=cursor)
+
+    with pytest.raises(HTTPException) as exc:
+        arun(run())
+    assert exc.value.status_code == 400
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from app import models, uploads
+from app.storage import storage
+
+CONTENT = os.urandom(5000)
+
+
+async def _stream(*chunks, fail_after=None, delay=0):
+    for i, chunk in enumerate(chunks):
+        if fail_after is not None and i == fail_after:
+            raise ConnectionResetError("client went away")  # ligação cai a meio do PUT
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+def _session(db, session_id, user_id=1):
+    db.expire_all()
+    return uploads.get_session(db, session_id, user_id)
+
+
+def _create(db, size=len(CONTENT)):
+    return uploads.create_session(db, 1, "notes.txt", "text/plain", size)
+
+
+def test_wrong_offset_is_409_with_current_offset(db):
+    session = _create(db)
+    assert asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:1000]))) == 1000
+
+    session = _session(db, session.id)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:1000])))
+    assert exc.value.status_code == 409
+    assert exc.value.detail["offset"] == 1000
+    assert _session(db, session.id).offset == 1000
+
+
+def test_concurrent_put_at_same_offset_is_409(db):
+    session = _create(db)
+
+    async def both():
+        # o retry do cliente chega enquanto o primeiro PUT ainda está a receber bytes
+        first = asyncio.create_task(uploads.write_chunk(session, 0, _stream(CONTENT[:1000], CONTENT[1000:2000], delay=0.05)))
+        await asyncio.sleep(0.02)
+        retry = uploads.write_chunk(session, 0, _stream(b"x" * 2000))
+        return await asyncio.gather(first, retry, return_exceptions=True)
+
+    done, conflict = asyncio.run(both())
+    assert done == 2000
+    assert isinstance(conflict, HTTPException) and conflict.status_code == 409
+    assert _session(db, session.id).offset == 2000
+
+    asyncio.run(uploads.write_chunk(_session(db, session.id), 2000, _stream(CONTENT[2000:])))
+    key = asyncio.run(uploads.finalize(_session(db, session.id)))
+    assert key.endswith(hashlib.sha256(CONTENT).hexdigest() + ".txt")
+    with open(storage.path(key), "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_interrupted_chunk_resumes_from_confirmed_offset(db):
+    session = _create(db)
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:1500], CONTENT[1500:3000], fail_after=1)))
+
+    # o que chegou conta: o cliente retoma do offset guardado
+    session = _session(db, session.id)
+    assert session.offset == 1500
+    assert asyncio.run(uploads.write_chunk(session, 1500, _stream(CONTENT[1500:]))) == len(CONTENT)
+
+    session = _session(db, session.id)
+    key = asyncio.run(uploads.finalize(session))
+    assert key.endswith(hashlib.sha256(CONTENT).hexdigest() + ".txt")
+    with open(storage.path(key), "rb") as f:
+        assert f.read() == CONTENT
+    assert _session(db, session.id) is None  # sessão consumida pelo finalize
+    assert db.get(models.MediaUpload, (hashlib.sha256(CONTENT).hexdigest(), 1)) is not None
+
+
+def test_resume_on_another_replica_rehashes_file(db):
+    session = _create(db)
+    asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:2000])))
+    uploads._hashers.pop(session.id)  # o chunk seguinte chega a uma réplica sem o hash incremental
+
+    session = _session(db, session.id)
+    asyncio.run(uploads.write_chunk(session, 2000, _stream(CONTENT[2000:])))
+    key = asyncio.run(uploads.finalize(_session(db, session.id)))
+    assert key.endswith(hashlib.sha256(CONTENT).hexdigest() + ".txt")
+
+
+def test_finalize_incomplete_is_409(db):
+    session = _create(db)
+    asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:100])))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(uploads.finalize(_session(db, session.id)))
+    assert exc.value.status_code == 409
+    assert exc.value.detail["offset"] == 100
+
+
+def test_chunk_past_declared_size_is_413(db):
+    session = _create(db, size=100)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(uploads.write_chunk(session, 0, _stream(CONTENT[:101])))
+    assert exc.value.status_code == 413
+    assert _session(db, session.id).offset == 0
+
+
+def test_session_of_another_user_is_not_found(db):
+    session = _create(db)
+    assert _session(db, session.id, user_id=2) is None
@@ -0,0 +1,76 @@
+import asyncio
+
+from app import write_batcher
+from app.write_batcher import WriteBatcher
+
+
+def _fake_insert(calls):
+    next_id = iter(range(1, 10_000))
+
+    async def run_db(fn, model, rows):
+        calls.append(len(rows))
+        return [next(next_id) for _ in rows]
+
+    return run_db
+
+
+def test_batches_concurrent_submits(monkeypatch):
+    calls = []
+    monkeypatch.setattr(write_batcher, "run_db", _fake_insert(calls))
+
+    async def run():
+        batcher = WriteBatcher(object, max_size=10, max_delay_ms=20)
+        ids = await asyncio.gather(*(batcher.submit({"n": i}) for i in range(5)))
+        await batcher.close()
+        return ids
+
+    assert sorted(asyncio.run(run())) == [1, 2, 3, 4, 5]
+    assert calls == [5]
+
+
+def test_dead_task_fails_pending_and_restarts(monkeypatch):
+    calls = []
+    monkeypatch.setattr(write_batcher, "run_db", _fake_insert(calls))
+
+    async def run():
+        batcher = WriteBatcher(object, max_size=10, max_delay_ms=20)
+        real_flush = batcher._flush
+
+        async def broken_flush(batch):
+            raise KeyError("boom")  # erro fora do try de _flush → a tarefa morre
+
+        batcher._flush = broken_flush
+        results = await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit({"n": i}) for i in range(3)), return_exceptions=True),
+            timeout=1,
+        )
+        assert batcher.task is None
+        assert batcher.batch == []
+
+        # o próximo submit arranca uma tarefa nova
+        batcher._flush = real_flush
+        message_id = await asyncio.wait_for(batcher.submit({"n": 3}), timeout=1)
+        await batcher.close()
+        return results, message_id
+
+    results, message_id = asyncio.run(run())
+    assert all(isinstance(r, KeyError) for r in results)
+    assert message_id == 1
+
+
+def test_cancelled_task_fails_queued_submits(monkeypatch):
+    monkeypatch.setattr(write_batcher, "run_db", _fake_insert([]))
+
+    async def run():
+        batcher = WriteBatcher(object, max_size=10, max_delay_ms=1000)
+        pending = asyncio.ensure_future(batcher.submit({"n": 0}))
+        await asyncio.sleep(0.01)
+        batcher.task.cancel()
+        try:
+            await asyncio.wait_for(pending, timeout=1)
+        except RuntimeError as e:
+            return e
+        finally:
+            await batcher.close()
+
+    assert isinstance(asyncio.run(run()), RuntimeError)
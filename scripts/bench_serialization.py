@@ -0,0 +1,75 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+
+def build_history(n: int) -> dict:
+    """Histórico com o mesmo formato que o message-service devolve em /messages/{u1}/{u2}"""
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(n):
+        msg = {
+            "id": i + 1,
+            "from": "alice" if i % 2 else "bob",
+            "to": "bob" if i % 2 else "alice",
+            "content": f"message number {i} with some text 🚀",
+            "image_url": None,
+            "timestamp": (base + timedelta(seconds=i)).isoformat(),
+        }
+        if i % 10 == 0 and i:
+            msg["reply_to"] = {"id": i, "from": "alice", "content": f"message number {i - 1}"}
+        messages.append(msg)
+    return {"messages": messages, "next_cursor": None}
+
+
+def bench(label: str, fn, rounds: int):
+    fn()  # aquecimento
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds * 1000
+    print(f"{label:<40} {elapsed:8.2f} ms")
+    return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare JSON encode cost of message histories.")
+    ap.add_argument("--messages", type=int, default=10_000, help="Messages per history (default 10000)")
+    ap.add_argument("--rounds", type=int, default=20, help="Repetitions per encoder (default 20)")
+    args = ap.parse_args()
+
+    history = build_history(args.messages)
+    print(f"History: {args.messages} messages, {len(orjson.dumps(history)) / 1024:.0f} KiB encoded\n")
+
+    # caminho antigo: jsonable_encoder + json.dumps (JSONResponse do FastAPI)
+    baseline = bench(
+        "jsonable_encoder + json.dumps",
+        lambda: json.dumps(jsonable_encoder(history), ensure_ascii=False).encode(),
+        args.rounds,
+    )
+    bench("json.dumps", lambda: json.dumps(history, ensure_ascii=False).encode(), args.rounds)
+    fast = bench("orjson.dumps (serialization.py)", lambda: orjson.dumps(history), args.rounds)
+    print(f"\nSpeed-up vs default FastAPI path: {baseline / fast:.1f}x")
+
+    # fan-out: codificar uma vez vs. uma vez por destinatário
+    payload = history["messages"][0]
+    recipients = 500
+    per_recipient = bench(
+        f"WS frame x{recipients} (json.dumps each)",
+        lambda: [json.dumps(payload) for _ in range(recipients)],
+        args.rounds,
+    )
+    once = bench(
+        f"WS frame x{recipients} (orjson once)",
+        lambda: [orjson.dumps(payload).decode()] * recipients,
+        args.rounds,
+    )
+    print(f"\nFan-out speed-up: {per_recipient / once:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
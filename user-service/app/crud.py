@@ -1,7 +1,10 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from . import models, schemas
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
+import os
 import re
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -49,3 +52,51 @@ def validate_password_strength(password: str):
             }
         )
 
+
+# limite de ids por GET /users?ids= (os clientes partem pedidos maiores em lotes)
+MAX_BULK_IDS = int(os.getenv("MAX_BULK_IDS", "1000"))
+
+def parse_id_list(raw: str) -> list[int]:
+    """Converte "1,2,3" em [1, 2, 3] (sem duplicados, ordem preservada)"""
+    try:
+        ids = [int(part) for part in raw.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_IDS} ids per request")
+    return ids
+
+# Lookups async (rotas mais usadas pelos outros serviços) — só id/username
+async def get_users_by_ids(db: AsyncSession, user_ids: list[int]):
+    if not user_ids:
+        return []
+    result = await db.execute(
+        select(models.User.id, models.User.username).where(models.User.id.in_(user_ids))
+    )
+    return result.all()
+
+async def list_users(db: AsyncSession):
+    result = await db.execute(select(models.User.id, models.User.username))
+    return result.all()
+
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.User.id, models.User.username).where(models.User.id == user_id)
+    )
+    return result.first()
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(
+        select(models.User.id, models.User.username).where(models.User.username == username)
+    )
+    return result.first()
+
+async def list_contacts(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.User.id, models.User.username)
+        .join(models.Contact, models.Contact.contact_id == models.User.id)
+        .where(models.Contact.user_id == user_id)
+    )
+    return result.all()
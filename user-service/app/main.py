@@ -1,15 +1,18 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Response
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Response, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import or_, and_
 from datetime import datetime
 from . import models, schemas, crud
-from .db import engine, SessionLocal
+from .db import engine, async_engine, SessionLocal, AsyncSessionLocal
 from fastapi.middleware.cors import CORSMiddleware
 import json
 from .websocket import manager
 from .auth import create_access_token, decode_access_token
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from .http_client import get_client, close_client
+from contextlib import asynccontextmanager
 import os
 
 # --- Prometheus Metrics ---
@@ -18,7 +21,14 @@ from starlette.responses import Response
 import time
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_client()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # --- Define Prometheus metrics ---
@@ -66,6 +76,12 @@ def get_db():
         db.close()
 
 
+# Sessão async (asyncpg) para os lookups mais usados
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")  # ou onde crias o token
 
 import os
@@ -108,7 +124,6 @@ def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
         "user": {"id": db_user.id, "username": db_user.username}
     }
 
-import httpx
 @app.delete("/users/{user_id}", status_code=204)
 async def delete_user(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
     token = token_data.get("token")
@@ -124,9 +139,8 @@ async def delete_user(user_id: int, db: Session = Depends(get_db), token_data: d
     db.commit()
 
     try:
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer INTERNAL"}
-            res = await client.delete(f"{GROUP_SERVICE_URL}/cleanup/{user_id}", headers=headers)
+        headers = {"Authorization": f"Bearer INTERNAL"}
+        res = await get_client().delete(f"{GROUP_SERVICE_URL}/cleanup/{user_id}", headers=headers)
     except Exception as e:
         print(f"⚠️ Group cleanup failed: {e}")
 
@@ -137,20 +151,25 @@ async def delete_user(user_id: int, db: Session = Depends(get_db), token_data: d
 
 
 @app.get("/users")
-def list_users(db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    users = db.query(models.User).all()
+async def list_users(ids: str | None = Query(None), db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    # ?ids=1,2,3 → lookup em bulk (usado pelo message-service para hidratar históricos)
+    if ids is not None:
+        user_ids = crud.parse_id_list(ids)
+        users = await crud.get_users_by_ids(db, user_ids)
+    else:
+        users = await crud.list_users(db)
     return [{"id": u.id, "username": u.username} for u in users]
 
 @app.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    user = await crud.get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"id": user.id, "username": user.username}
 
 @app.get("/users/by-username/{username}")
-def get_user_by_username(username: str, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(username: str, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
+    user = await crud.get_user_by_username(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"id": user.id, "username": user.username}
@@ -177,7 +196,7 @@ async def websocket_users(websocket: WebSocket):
 
     await manager.connect(websocket, user_id)
 
-    online_now = list(manager.user_map.keys())
+    online_now = manager.registry.online_users()
     await websocket.send_json({
         "type": "online_users",
         "user_ids": online_now
@@ -297,14 +316,9 @@ async def respond_invite(invite_id: int, accept: bool, db: Session = Depends(get
 
 
 @app.get("/contacts/{user_id}")
-def list_contacts(user_id: int, db: Session = Depends(get_db), token_data: dict = Depends(verify_token)):
+async def list_contacts(user_id: int, db: AsyncSession = Depends(get_async_db), token_data: dict = Depends(verify_token)):
 
-    contacts = (
-        db.query(models.User)
-        .join(models.Contact, models.Contact.contact_id == models.User.id)
-        .filter(models.Contact.user_id == user_id)
-        .all()
-    )
+    contacts = await crud.list_contacts(db, user_id)
     return [{"id": u.id, "username": u.username} for u in contacts]
 
 